@@ -0,0 +1,97 @@
+"""
+Azure Function answering a batch of questions in one invocation, for
+pre-generated FAQ pages and evaluation jobs. Results come back as
+newline-delimited JSON, one line per question in completion order.
+"""
+import json
+import logging
+from typing import Any, Dict, List
+from azure.functions import HttpRequest, HttpResponse
+from portfolio_assistant import metrics
+from portfolio_assistant.app import configure_logging_once, get_agent_client
+from portfolio_assistant.config import Config
+
+
+def _error(message: str, status_code: int) -> HttpResponse:
+    return HttpResponse(
+        body=json.dumps({"error": message}),
+        status_code=status_code,
+        mimetype="application/json"
+    )
+
+
+def _parse_items(body: Any) -> List[Dict[str, Any]]:
+    """
+    Accept {"messages": [...]} whose entries are questions or
+    {"id": ..., "message": ...} objects.
+
+    Raises:
+        ValueError: If the body or one of its entries is malformed.
+    """
+    messages = body.get("messages") if isinstance(body, dict) else None
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("Missing messages list")
+    items = []
+    for index, entry in enumerate(messages):
+        item = {"message": entry} if isinstance(entry, str) else entry
+        if not isinstance(item, dict) or \
+           not isinstance(item.get("message"), str) or \
+           not item["message"].strip():
+            raise ValueError(f"Missing user message at index {index}")
+        items.append(item)
+    return items
+
+
+async def main(req: HttpRequest) -> HttpResponse:
+    """
+    Azure Function trigger for batch chat.
+
+        Arg:
+            req (HttpRequest): {"messages": [...]} with up to
+            BATCH_MAX_ITEMS questions
+        Return:
+            HTTP response: NDJSON results (or error message)
+    """
+    configure_logging_once()
+    logging.info("Portfolio Assistant batch API triggered.")
+    with metrics.request_scope(name="batch",
+                               log=Config.get_metrics_log_requests()) \
+            as record:
+        response = await _handle(req)
+        record["status"] = response.status_code
+        metrics.incr(f"responses.{response.status_code}")
+        return response
+
+
+async def _handle(req: HttpRequest) -> HttpResponse:
+    try:
+        body = req.get_json()
+    except ValueError as e:
+        return _error(f"Invalid JSON: {str(e)}", 400)
+    try:
+        items = _parse_items(body)
+    except ValueError as e:
+        return _error(str(e), 400)
+    max_items = Config.get_batch_max_items()
+    if len(items) > max_items:
+        return _error(f"Too many messages: {len(items)} > {max_items}", 413)
+
+    try:
+        from portfolio_assistant.batch import BatchRunner
+        runner = BatchRunner(
+            get_agent_client(),
+            search_concurrency=Config.get_batch_search_concurrency(),
+            chat_concurrency=Config.get_batch_chat_concurrency(),
+            deadline=Config.get_batch_deadline())
+        # The HTTP binding sends the body in one piece; the lines are in
+        # the order the answers finished.
+        lines = [json.dumps(result) + "\n"
+                 async for result in runner.run(items)]
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return _error(str(e), 500)
+    return HttpResponse(
+        body="".join(lines),
+        status_code=200,
+        mimetype="application/x-ndjson"
+    )
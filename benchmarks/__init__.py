@@ -0,0 +1 @@
+"""Offline benchmarks and local stand-ins for the Azure services."""
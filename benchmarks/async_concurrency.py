@@ -0,0 +1,52 @@
+"""
+Throughput of AsyncAgentClient at increasing concurrency in one process,
+against local stub servers with fixed latency.
+
+    PYTHONPATH=src python -m benchmarks.async_concurrency --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.stubs import StubServer
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.sessions import close_async_sessions
+
+
+async def _drive(client: AsyncAgentClient, total: int,
+                 concurrency: int) -> float:
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with gate:
+            await client.ask(f"question {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    await close_async_sessions()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="stub latency per call in seconds")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--levels", default="1,4,16,64")
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency) as server:
+        search = AsyncSearchClient(endpoint=server.url, index_name="bench",
+                                   api_key="bench", api_version="bench")
+        client = AsyncAgentClient(endpoint=server.url + "/chat",
+                                  api_key="bench", search_client=search)
+        print(f"{'concurrency':>11} {'seconds':>8} {'req/s':>8}")
+        for level in (int(x) for x in args.levels.split(",")):
+            elapsed = asyncio.run(_drive(client, args.requests, level))
+            print(f"{level:>11} {elapsed:>8.2f} "
+                  f"{args.requests / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Cold-start cost of the chat function: each run is a fresh interpreter
+that imports `chat_function` and answers one request against local stub
+services, optionally after the warm-up hook.
+
+    PYTHONPATH=src python -m benchmarks.cold_start --runs 5
+    PYTHONPATH=src python -m benchmarks.cold_start --warm-up \
+        --compare benchmarks/cold_start_baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Sequence
+from benchmarks.stubs import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, json, time
+start = time.perf_counter()
+import chat_function
+imported = time.perf_counter()
+from azure.functions import HttpRequest
+
+async def first_request(warm):
+    if warm:
+        from portfolio_assistant.app import warm_up
+        await warm_up()
+    ready = time.perf_counter()
+    response = await chat_function.main(HttpRequest(
+        method="POST", url="/api/chat", body=b'{{"message": "hello"}}'))
+    from portfolio_assistant.sessions import close_async_sessions
+    await close_async_sessions()
+    return ready, response.status_code
+
+ready, status = asyncio.run(first_request({warm}))
+done = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000,
+                  "warm_up_ms": (ready - imported) * 1000,
+                  "first_request_ms": (done - ready) * 1000,
+                  "status": status}}))
+"""
+
+
+def _heaviest_imports(stderr: str, count: int) -> List[Dict]:
+    """
+    Top-level imports with the largest cumulative `-X importtime` cost.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):  # nested import, counted by its parent
+            continue
+        rows.append({"module": name.strip(),
+                     "ms": round(int(cumulative) / 1000, 1)})
+    return sorted(rows, key=lambda r: r["ms"], reverse=True)[:count]
+
+
+def measure(runs: int = 5, warm: bool = False) -> Dict:
+    """
+    Median import, warm-up and first-request times over `runs` fresh
+    interpreters, plus the heaviest imports of the last run.
+    """
+    samples: List[Dict] = []
+    stderr = ""
+    with StubServer() as server:
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join([os.path.join(ROOT, "src"),
+                                               ROOT]),
+                   AZURE_CHAT_AGENT_ENDPOINT=server.url + "/chat",
+                   AZURE_CHAT_API_KEY="bench",
+                   AZURE_SEARCH_ENDPOINT=server.url,
+                   AZURE_SEARCH_API_KEY="bench",
+                   AZURE_SEARCH_INDEX_NAME="bench",
+                   AZURE_SEARCH_API_VERSION="bench",
+                   METRICS_LOG_REQUESTS="false")
+        for _ in range(runs):
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c",
+                 CHILD.format(warm=warm)],
+                env=env, cwd=ROOT, capture_output=True, text=True,
+                check=True)
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            stderr = proc.stderr
+    report = {"runs": runs, "warm_up": warm}
+    for key in ("import_ms", "warm_up_ms", "first_request_ms"):
+        report[key] = round(statistics.median(s[key] for s in samples), 1)
+    report["statuses"] = sorted({s["status"] for s in samples})
+    report["heaviest_imports"] = _heaviest_imports(stderr, 8)
+    return report
+
+
+def compare(report: Dict, baseline: Dict,
+            tolerance: float = 0.5) -> List[str]:
+    """
+    Timings more than `tolerance` above the baseline.
+    """
+    regressions = []
+    for key in ("import_ms", "warm_up_ms", "first_request_ms"):
+        old = baseline.get(key)
+        if old and report[key] > old * (1 + tolerance):
+            regressions.append(f"{key}: {report[key]:.1f} vs {old:.1f}")
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure chat function import and cold-start time.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true",
+                        help="call the warm-up hook before the request")
+    parser.add_argument("--save", help="write the report to this file")
+    parser.add_argument("--compare", help="baseline report to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    report = measure(args.runs, args.warm_up)
+    print(f"import {report['import_ms']:.1f} ms, warm-up "
+          f"{report['warm_up_ms']:.1f} ms, first request "
+          f"{report['first_request_ms']:.1f} ms "
+          f"(median of {report['runs']}, status {report['statuses']})")
+    for row in report["heaviest_imports"]:
+        print(f"  {row['ms']:>8.1f} ms  {row['module']}")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
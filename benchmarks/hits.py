@@ -0,0 +1,70 @@
+"""
+Cost of turning a search response into prompt context: normalizing the
+hits and running `SearchClient.build_context`, per query.
+
+    PYTHONPATH=src python -m benchmarks.hits --top-k 5,50 --doc-chars 4000
+"""
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+from benchmarks.stubs import sized_responder
+from portfolio_assistant.search_client import SearchClient
+
+
+def _payload(top_k: int, doc_chars: int, captions: bool):
+    _, payload = sized_responder(docs=top_k, doc_chars=doc_chars)(
+        "/docs/search", {"top": top_k})
+    if not captions:
+        for hit in payload["value"]:
+            hit.pop("@search.captions")
+            hit.pop("@search.answers")
+    # a fresh copy, as decoding the response body would give
+    return json.dumps(payload)
+
+
+def measure(client: SearchClient, raw: str, queries: int):
+    """
+    Microseconds per query and peak KiB allocated by one query, with the
+    JSON decoding excluded.
+    """
+    payloads = [json.loads(raw) for _ in range(queries)]
+    start = time.perf_counter()
+    for payload in payloads:
+        client.build_context(client._normalize_hits(payload))
+    elapsed = (time.perf_counter() - start) / queries
+    payload = json.loads(raw)
+    tracemalloc.start()
+    try:
+        client.build_context(client._normalize_hits(payload))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed * 1e6, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top-k", default="5,50")
+    parser.add_argument("--doc-chars", default="400,4000")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.disable(logging.INFO)  # logging configured but not emitted
+    client = SearchClient(endpoint="https://bench", index_name="bench",
+                          api_key="bench", api_version="bench")
+    print(f"{'top_k':>6} {'doc_chars':>9} {'captions':>8} {'us/query':>9} "
+          f"{'peak_kib':>9}")
+    for top_k in (int(x) for x in args.top_k.split(",")):
+        for doc_chars in (int(x) for x in args.doc_chars.split(",")):
+            for captions in (True, False):
+                raw = _payload(top_k, doc_chars, captions)
+                micros, peak = measure(client, raw, args.queries)
+                print(f"{top_k:>6} {doc_chars:>9} {str(captions):>8} "
+                      f"{micros:>9.1f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Cost of re-ranking search candidates per query.
+
+    PYTHONPATH=src python -m benchmarks.rerank --candidates 1000,5000
+"""
+import argparse
+import random
+import time
+from portfolio_assistant.rerank import HashingEmbedder, Reranker, VectorStore
+
+WORDS = ("victoria python climate model drone agent research data science "
+         "machine learning cloud azure portfolio project analysis simulation "
+         "household adaptation gpu cluster teaching statistics").split()
+
+
+def _docs(n: int, rng: random.Random):
+    return [{"id": str(i), "_score": rng.random(),
+             "content": " ".join(rng.choice(WORDS) for _ in range(80))}
+            for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--candidates", default="100,1000,5000")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'candidates':>10} {'ms/query':>9}")
+    for n in (int(x) for x in args.candidates.split(",")):
+        docs = _docs(n, rng)
+        reranker = Reranker(VectorStore.build(docs,
+                                              HashingEmbedder(args.dim)))
+        queries = [" ".join(rng.sample(WORDS, 4))
+                   for _ in range(args.queries)]
+        start = time.perf_counter()
+        for q in queries:
+            reranker.rerank(q, docs, top_k=5)
+        elapsed = (time.perf_counter() - start) / args.queries
+        print(f"{n:>10} {elapsed * 1000:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
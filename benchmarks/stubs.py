@@ -0,0 +1,171 @@
+"""
+Local stub servers imitating the Azure AI Search `docs/search` and chat
+completions APIs, for tests and benchmarks that must run offline.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_responder(path, body):
+    """Answer like Azure AI Search for docs/search, otherwise like chat"""
+    if "/docs/search" in path:
+        return 200, {"value": [
+            {"id": "1", "path": "/a", "content": "alpha",
+             "@search.score": 1.0},
+        ]}
+    return 200, {"choices": [{"message": {"content": "stub reply"}}]}
+
+
+def sized_responder(docs: int = 5, doc_chars: int = 400,
+                    reply_words: int = 40):
+    """
+    Responder whose payloads have a fixed size: `docs` search hits of
+    about `doc_chars` characters each (with captions and an answer, as
+    semantic search returns) and a reply of `reply_words` words. A
+    `select` in the request is honoured.
+    """
+    words = ("Victoria designed and shipped a Python service for climate "
+             "model analysis on Azure with a team of researchers.").split()
+    text = " ".join(words[i % len(words)] for i in range(doc_chars // 6))
+    hits = [{"id": str(i), "path": f"/docs/{i}.md", "topics": "projects",
+             "notes": "", "content": text[:doc_chars],
+             "@search.score": 10.0 - i,
+             "@search.captions": [{"text": text[:160]}],
+             "@search.answers": [{"text": text[:80]}] if i == 0 else []}
+            for i in range(docs)]
+    reply = " ".join(words[i % len(words)] for i in range(reply_words))
+
+    def respond(path, body):
+        if "/docs/search" in path:
+            selected = hits[:body.get("top", docs)]
+            if body.get("select"):
+                fields = body["select"].split(",")
+                selected = [{k: v for k, v in hit.items()
+                             if k in fields or k.startswith("@search.")}
+                            for hit in selected]
+            return 200, {"value": selected}
+        return 200, {"choices": [{"message": {"content": reply}}]}
+    return respond
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops SYNs under concurrent benchmarks
+    request_queue_size = 256
+
+
+class StubServer:
+    """
+    Keep-alive HTTP/1.1 server counting connections and requests.
+
+    Chat requests with `"stream": true` are answered with server-sent
+    events, one word of the reply per chunk.
+
+    Args:
+        responder: Callable (path, body) -> (status, payload).
+        latency (float): Seconds to sleep before answering each request.
+        chunk_delay (float): Seconds between streamed chunks.
+        error_rate (float): Fraction of requests answered with a 503.
+        seed (int): Seed for the error draws, so runs are repeatable.
+        retry_after (str): `Retry-After` header sent with the 503s.
+    """
+    def __init__(self, responder=default_responder, latency: float = 0.0,
+                 chunk_delay: float = 0.0, error_rate: float = 0.0,
+                 seed: int = 0, retry_after: str = None):
+        self.responder = responder
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.retry_after = retry_after
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out in separate writes; with Nagle on,
+            # delayed ACKs add ~40ms to every response
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else {}
+                with stub._lock:
+                    stub.requests += 1
+                    fail = stub.error_rate and \
+                        stub._random.random() < stub.error_rate
+                    if fail:
+                        stub.errors += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if fail:
+                    status, payload = 503, {"error": "stub overload"}
+                else:
+                    status, payload = stub.responder(self.path, body)
+                if body.get("stream") and status == 200:
+                    self._stream(payload)
+                    return
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if fail and stub.retry_after is not None:
+                    self.send_header("Retry-After", stub.retry_after)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, payload):
+                reply = payload["choices"][0]["message"]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = reply.split(" ")
+                events = [{"choices": [{"delta": {
+                    "content": w if i == 0 else " " + w}}]}
+                    for i, w in enumerate(words)]
+                lines = [f"data: {json.dumps(e)}\n\n" for e in events]
+                lines.append("data: [DONE]\n\n")
+                for i, line in enumerate(lines):
+                    if i and stub.chunk_delay:
+                        time.sleep(stub.chunk_delay)
+                    data = line.encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data +
+                                     b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
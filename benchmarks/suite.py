@@ -0,0 +1,365 @@
+"""
+Load and latency benchmark of the chat pipeline against local stub
+Azure services, runnable offline.
+
+Drives `chat_function.main`, AsyncAgentClient and AgentClient at fixed
+concurrency levels and reports throughput, latency percentiles, error
+counts and memory allocated per request (tracemalloc). Results can be
+saved as a baseline and later runs compared against it:
+
+    PYTHONPATH=src python -m benchmarks.suite --save benchmarks/baseline.json
+    PYTHONPATH=src python -m benchmarks.suite --compare \
+        benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from azure.functions import HttpRequest
+from benchmarks.stubs import StubServer, sized_responder
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.search_client import SearchClient
+from portfolio_assistant.sessions import close_async_sessions, reset_sessions
+
+SCENARIOS = ("main", "async_client", "sync_client")
+
+
+@dataclass
+class Settings:
+    """
+    Stub behaviour and load shape of one benchmark run.
+    """
+    search_latency: float = 0.01
+    chat_latency: float = 0.02
+    docs: int = 5
+    doc_chars: int = 400
+    reply_words: int = 40
+    error_rate: float = 0.0
+    requests: int = 200
+    levels: Tuple[int, ...] = (1, 8, 32)
+    allocation_requests: int = 20
+    seed: int = 0
+
+
+def _percentile(ordered: Sequence[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def summarize(latencies: List[float], elapsed: float,
+              errors: int) -> Dict[str, float]:
+    """
+    Throughput and latency percentiles (milliseconds) of one run.
+    """
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput": round(len(ordered) / elapsed, 2),
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+    }
+
+
+def _failed(result) -> bool:
+    return not isinstance(result, dict) or "error" in result
+
+
+class Scenario:
+    """
+    One way of sending a question through the pipeline.
+    """
+    name = ""
+    is_async = True
+
+    def __init__(self, search: StubServer, chat: StubServer):
+        self.search_url = search.url
+        self.chat_url = chat.url + "/chat"
+
+    def call(self, i: int):
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MainScenario(Scenario):
+    """
+    The Azure Function entry point, body parsing included.
+    """
+    name = "main"
+
+    def __init__(self, search: StubServer, chat: StubServer):
+        super().__init__(search, chat)
+        self._environ = dict(os.environ)
+        os.environ.update({
+            "AZURE_CHAT_AGENT_ENDPOINT": self.chat_url,
+            "AZURE_CHAT_API_KEY": "bench",
+            "AZURE_SEARCH_ENDPOINT": self.search_url,
+            "AZURE_SEARCH_API_KEY": "bench",
+            "AZURE_SEARCH_INDEX_NAME": "bench",
+            "AZURE_SEARCH_API_VERSION": "bench",
+            "METRICS_LOG_REQUESTS": "false",
+        })
+        import chat_function
+        from portfolio_assistant.app import reset_clients
+        reset_clients()
+        self._main = chat_function.main
+
+    async def call(self, i: int):
+        body = json.dumps({"message": f"What did Victoria build? {i % 50}"})
+        response = await self._main(HttpRequest(
+            method="POST", url="/api/chat", body=body.encode()))
+        if response.status_code != 200:
+            return {"error": response.status_code}
+        return json.loads(response.get_body())
+
+    def close(self) -> None:
+        from portfolio_assistant.app import reset_clients
+        reset_clients()
+        os.environ.clear()
+        os.environ.update(self._environ)
+
+
+class AsyncClientScenario(Scenario):
+    name = "async_client"
+
+    def __init__(self, search: StubServer, chat: StubServer):
+        super().__init__(search, chat)
+        self.client = AsyncAgentClient(
+            endpoint=self.chat_url, api_key="bench",
+            search_client=AsyncSearchClient(
+                endpoint=self.search_url, index_name="bench",
+                api_key="bench", api_version="bench"))
+
+    async def call(self, i: int):
+        return await self.client.ask(f"What did Victoria build? {i % 50}")
+
+
+class SyncClientScenario(Scenario):
+    name = "sync_client"
+    is_async = False
+
+    def __init__(self, search: StubServer, chat: StubServer):
+        super().__init__(search, chat)
+        self.client = AgentClient(
+            endpoint=self.chat_url, api_key="bench",
+            search_client=SearchClient(
+                endpoint=self.search_url, index_name="bench",
+                api_key="bench", api_version="bench"))
+
+    def call(self, i: int):
+        return self.client.ask(f"What did Victoria build? {i % 50}")
+
+
+SCENARIO_TYPES = {s.name: s for s in (MainScenario, AsyncClientScenario,
+                                      SyncClientScenario)}
+
+
+async def _drive_async(call: Callable, total: int,
+                       concurrency: int) -> Tuple[List[float], float, int]:
+    gate = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with gate:
+            start = time.perf_counter()
+            result = await call(i)
+            latencies.append(time.perf_counter() - start)
+            errors += _failed(result)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    await close_async_sessions()
+    return latencies, elapsed, errors
+
+
+def _drive_threads(call: Callable, total: int,
+                   concurrency: int) -> Tuple[List[float], float, int]:
+    def one(i: int):
+        start = time.perf_counter()
+        result = call(i)
+        return time.perf_counter() - start, _failed(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    return [o[0] for o in outcomes], elapsed, sum(o[1] for o in outcomes)
+
+
+def drive(scenario: Scenario, total: int,
+          concurrency: int) -> Tuple[List[float], float, int]:
+    """
+    Send `total` questions with at most `concurrency` in flight.
+    """
+    if scenario.is_async:
+        return asyncio.run(_drive_async(scenario.call, total, concurrency))
+    return _drive_threads(scenario.call, total, concurrency)
+
+
+def allocations(scenario: Scenario, total: int) -> Dict[str, float]:
+    """
+    Memory traced while answering `total` questions one at a time: the
+    peak above the starting point and what is still held afterwards,
+    both per request.
+    """
+    drive(scenario, 2, 1)  # warm pools and lazily built clients
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        drive(scenario, total, 1)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_kib": round((peak - before) / 1024, 1),
+            "retained_kib_per_request":
+                round((after - before) / 1024 / total, 2)}
+
+
+def run(settings: Settings,
+        scenarios: Sequence[str] = SCENARIOS) -> Dict:
+    """
+    Run the benchmark and return the report as a JSON-ready dict.
+    """
+    responder = sized_responder(settings.docs, settings.doc_chars,
+                                settings.reply_words)
+    # lists, so the settings compare equal after a JSON round trip
+    report: Dict = {"settings": dict(asdict(settings),
+                                     levels=list(settings.levels)),
+                    "python": platform.python_version(),
+                    "scenarios": {}}
+    with StubServer(responder, latency=settings.search_latency,
+                    error_rate=settings.error_rate,
+                    seed=settings.seed) as search, \
+            StubServer(responder, latency=settings.chat_latency,
+                       error_rate=settings.error_rate,
+                       seed=settings.seed + 1) as chat:
+        for name in scenarios:
+            reset_sessions()
+            scenario = SCENARIO_TYPES[name](search, chat)
+            try:
+                levels = {}
+                for level in settings.levels:
+                    levels[str(level)] = summarize(
+                        *drive(scenario, settings.requests, level))
+                report["scenarios"][name] = {
+                    "levels": levels,
+                    "allocations": allocations(
+                        scenario, settings.allocation_requests),
+                }
+            finally:
+                scenario.close()
+    reset_sessions()
+    return report
+
+
+def compare(report: Dict, baseline: Dict,
+            tolerance: float = 0.5) -> List[str]:
+    """
+    Regressions of `report` against `baseline`: p95 latency or peak
+    allocation more than `tolerance` above it, or throughput more than
+    `tolerance` below it.
+    """
+    regressions: List[str] = []
+    for name, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        for level, stats in current["levels"].items():
+            old = base["levels"].get(level)
+            if old is None:
+                continue
+            if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{name}@{level}: p95 {stats['p95_ms']:.1f}ms vs "
+                    f"{old['p95_ms']:.1f}ms")
+            if stats["throughput"] < old["throughput"] * (1 - tolerance):
+                regressions.append(
+                    f"{name}@{level}: {stats['throughput']:.1f} req/s vs "
+                    f"{old['throughput']:.1f} req/s")
+        peak = current["allocations"]["peak_kib"]
+        old_peak = base["allocations"]["peak_kib"]
+        if peak > old_peak * (1 + tolerance):
+            regressions.append(f"{name}: peak allocation {peak:.0f} KiB vs "
+                               f"{old_peak:.0f} KiB")
+    return regressions
+
+
+def _print_report(report: Dict) -> None:
+    print(f"{'scenario':<13} {'conc':>5} {'req/s':>8} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for name, result in report["scenarios"].items():
+        for level, s in result["levels"].items():
+            print(f"{name:<13} {level:>5} {s['throughput']:>8.1f} "
+                  f"{s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} "
+                  f"{s['p99_ms']:>8.2f} {s['errors']:>6}")
+        a = result["allocations"]
+        print(f"{name:<13} peak {a['peak_kib']:.1f} KiB, retained "
+              f"{a['retained_kib_per_request']:.2f} KiB/request")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the chat pipeline against local stubs.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--levels", default="1,8,32",
+                        help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per concurrency level")
+    parser.add_argument("--search-latency", type=float, default=0.01)
+    parser.add_argument("--chat-latency", type=float, default=0.02)
+    parser.add_argument("--docs", type=int, default=5,
+                        help="search hits per response")
+    parser.add_argument("--doc-chars", type=int, default=400)
+    parser.add_argument("--reply-words", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the report to this file")
+    parser.add_argument("--compare", help="baseline report to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative regression (default 0.5)")
+    args = parser.parse_args(argv)
+
+    settings = Settings(
+        search_latency=args.search_latency, chat_latency=args.chat_latency,
+        docs=args.docs, doc_chars=args.doc_chars,
+        reply_words=args.reply_words, error_rate=args.error_rate,
+        requests=args.requests,
+        levels=tuple(int(x) for x in args.levels.split(",")),
+        seed=args.seed)
+    # the pipeline logs every request at INFO; keep the output readable
+    logging.disable(logging.ERROR)
+    report = run(settings, args.scenarios.split(","))
+    _print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print("Warning: baseline was recorded with different settings.")
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
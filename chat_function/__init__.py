@@ -5,15 +5,57 @@ then, returns the response.
 """
 import logging
 import json
+from typing import TYPE_CHECKING, List
 from azure.functions import HttpRequest, HttpResponse
-from portfolio_assistant.agent_client import AgentClient
-from portfolio_assistant.search_client import SearchClient
-from portfolio_assistant.utils import configure_logging
+from portfolio_assistant import metrics
+from portfolio_assistant.app import (configure_logging_once, get_admission,
+                                     get_agent_client)
+from portfolio_assistant.config import Config
 
-configure_logging()
+if TYPE_CHECKING:
+    from portfolio_assistant.async_agent_client import AsyncAgentClient
 
 
-def main(req: HttpRequest) -> HttpResponse:
+def _admission_keys(req: HttpRequest, conversation_id: str) -> List[str]:
+    """
+    Rate limit keys for the request: the client IP the front end
+    forwarded and the conversation. The shared "default" conversation
+    is not limited as one client.
+    """
+    keys = []
+    headers = getattr(req, "headers", None) or {}
+    # X-Client-IP is set by the front end; otherwise only the last
+    # X-Forwarded-For entry, the one the proxy appended, can be trusted,
+    # as the client can send any entries before it
+    client = (headers.get("x-client-ip") or "").strip()
+    if not client:
+        forwarded = headers.get("x-forwarded-for") or ""
+        client = forwarded.split(",")[-1].strip()
+    if client:
+        # App Service appends the client port to IPv4 addresses
+        if client.count(":") == 1:
+            client = client.split(":")[0]
+        keys.append(f"ip:{client}")
+    if conversation_id and conversation_id != "default":
+        keys.append(f"conversation:{conversation_id}")
+    return keys
+
+
+async def _answer(agent_client: "AsyncAgentClient", user_message: str,
+                  conversation_id: str) -> HttpResponse:
+    # The function.json HTTP binding sends the body in one piece, so
+    # replies are not streamed here; ask_stream is for hosts that can
+    # forward a streamed body.
+    ai_response = await agent_client.ask(user_message, conversation_id)
+
+    return HttpResponse(
+        body=json.dumps(ai_response),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+
+async def main(req: HttpRequest) -> HttpResponse:
     """
     Azure Function trigger for portfolio assistant chat.
 
@@ -23,12 +65,26 @@ def main(req: HttpRequest) -> HttpResponse:
         Return:
             HTTP response: AI response (or error message)
     """
+    configure_logging_once()
     logging.info("Portfolio Assistant API triggered.")
+    with metrics.request_scope(log=Config.get_metrics_log_requests()) \
+            as record:
+        response = await _handle(req)
+        record["status"] = response.status_code
+        metrics.incr(f"responses.{response.status_code}")
+        return response
+
+
+async def _handle(req: HttpRequest) -> HttpResponse:
+    """
+    Parse the request and answer it; `main` wraps this with metrics.
+    """
     try:
         logging.info(f"Raw body: {req.get_body()}")
 
         try:
-            body = req.get_json()
+            with metrics.span("parse_body"):
+                body = req.get_json()
         except Exception as e:
             try:
                 logging.info(f"Attempting to decode body: {req.get_body()}")
@@ -49,14 +105,26 @@ def main(req: HttpRequest) -> HttpResponse:
                 mimetype="application/json"
             )
 
-        agent_client = AgentClient(search_client=SearchClient())
-        ai_response = agent_client.ask(user_message, conversation_id)
-
-        return HttpResponse(
-            body=json.dumps(ai_response),
-            status_code=200,
-            mimetype="application/json"
-        )
+        agent_client = get_agent_client()
+        admission = get_admission()
+        if admission is None:
+            return await _answer(agent_client, user_message,
+                                 conversation_id)
+        from portfolio_assistant.admission import AdmissionRejected
+        try:
+            async with admission.admit(
+                    _admission_keys(req, conversation_id)):
+                return await _answer(agent_client, user_message,
+                                     conversation_id)
+        except AdmissionRejected as e:
+            logging.warning(f"{e}; retry after {e.retry_after:.1f}s.")
+            return HttpResponse(
+                body=json.dumps({"error": "Too many requests",
+                                 "reason": e.reason}),
+                status_code=429,
+                headers={"Retry-After": e.retry_after_header},
+                mimetype="application/json"
+            )
     except Exception as e:
         logging.error(f"Error: {str(e)}")
         return HttpResponse(
@@ -0,0 +1,28 @@
+"""
+Azure Function exposing the chat pipeline's in-process metrics.
+Disabled unless METRICS_ENDPOINT_ENABLED is set; the numbers describe
+the worker that serves the request, not the whole app.
+"""
+import json
+from azure.functions import HttpRequest, HttpResponse
+from portfolio_assistant import metrics
+from portfolio_assistant.config import Config
+
+
+def main(req: HttpRequest) -> HttpResponse:
+    """
+    Return the span histograms (p50/p95/p99 seconds), value histograms,
+    counters and outbound circuit breaker states as JSON.
+    """
+    if not Config.get_metrics_endpoint_enabled():
+        return HttpResponse(
+            body='{"error":"Metrics endpoint is disabled"}',
+            status_code=404,
+            mimetype="application/json"
+        )
+    from portfolio_assistant.resilience import policy_stats
+    return HttpResponse(
+        body=json.dumps(dict(metrics.snapshot(), circuits=policy_stats())),
+        status_code=200,
+        mimetype="application/json"
+    )
@@ -0,0 +1,263 @@
+"""
+Admission control in front of the chat pipeline.
+
+Every request takes one token from the token bucket of its client IP
+and of its conversation, so a single client cannot fan out into a burst
+of search and chat calls. Tokens are only taken when every bucket has
+one, so a rejected request costs nothing. Admitted requests then share
+a fixed number
+of in-flight slots; when all are taken, requests wait in a bounded
+queue, and once the queue is full, or a request has waited too long,
+it is turned away at once. Rejections carry the seconds after which a
+retry can succeed, for a 429 with `Retry-After`.
+
+Buckets live in a `MemoryBucketStore` by default. `SQLiteBucketStore`
+shares them between the worker processes on one machine, and any object
+with the same `take(keys, rate, burst)` method can stand in for a shared
+store such as Redis; stores are called from a thread unless their
+`blocking` attribute is false. The in-flight slots are per worker
+process.
+"""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Sequence
+from portfolio_assistant import metrics
+from portfolio_assistant.utils import run_blocking
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Args:
+        reason (str): "rate_limited", "queue_full" or "queue_timeout".
+        retry_after (float): Seconds until a retry can be admitted.
+    """
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request not admitted: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """
+        `Retry-After` value: whole seconds, at least 1.
+        """
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def _refill(tokens: float, updated: float, now: float, rate: float,
+            burst: float) -> float:
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def _spend(levels: List[float], rate: float) -> float:
+    """
+    Seconds until every bucket at `levels` holds a token, 0 when they
+    all do; in that case one token is taken from each, in place.
+    """
+    wait = max(((1 - tokens) / rate for tokens in levels if tokens < 1),
+               default=0.0)
+    if not wait:
+        levels[:] = [tokens - 1 for tokens in levels]
+    return wait
+
+
+class MemoryBucketStore:
+    """
+    Token buckets in the worker's memory; the least recently used ones
+    are dropped beyond `max_keys`, which only resets them to full.
+    """
+    blocking = False
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, keys: Sequence[str], rate: float, burst: float) -> float:
+        """
+        Take one token from the bucket of each of `keys`, each holding up
+        to `burst` tokens and refilling at `rate` tokens per second, if
+        every one of them has a token; otherwise take none.
+
+        Returns:
+            float: 0 when the tokens were taken, otherwise the seconds
+                until every bucket has one.
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.monotonic()
+        with self._lock:
+            levels = [_refill(*self._buckets.pop(key, (burst, now)), now,
+                              rate, burst) for key in keys]
+            wait = _spend(levels, rate)
+            for key, tokens in zip(keys, levels):
+                self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets in a local SQLite file, shared by the worker processes
+    on one machine. Same semantics as MemoryBucketStore.
+    """
+    # takes between deletions of buckets idle long enough to be full
+    _PRUNE_EVERY = 1000
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+            "updated REAL NOT NULL)")
+        self._takes = 0
+
+    def take(self, keys: Sequence[str], rate: float, burst: float) -> float:
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so concurrent
+            # processes cannot both spend the same token
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                levels = []
+                for key in keys:
+                    row = self._db.execute(
+                        "SELECT tokens, updated FROM buckets WHERE key = ?",
+                        (key,)).fetchone()
+                    levels.append(_refill(*(row or (burst, now)), now, rate,
+                                          burst))
+                wait = _spend(levels, rate)
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) "
+                    "VALUES (?, ?, ?)",
+                    [(key, tokens, now) for key, tokens in zip(keys, levels)])
+                self._takes += 1
+                if self._takes % self._PRUNE_EVERY == 0:
+                    self._db.execute("DELETE FROM buckets WHERE updated < ?",
+                                     (now - burst / rate,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return wait
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class AdmissionController:
+    """
+    Token-bucket rate limits plus an in-flight cap with a bounded wait
+    queue. Used from the worker's event loop.
+
+    Args:
+        store: MemoryBucketStore, SQLiteBucketStore or another object
+            with `take(keys, rate, burst)`.
+        rate_per_minute (float): Requests each client IP and each
+            conversation may make per minute, sustained.
+        burst (int): Requests each may make at once.
+        max_in_flight (int): Requests answered at the same time.
+        max_queue (int): Requests waiting for a slot before new ones are
+            rejected.
+        queue_timeout (float): Seconds a request waits for a slot.
+        retry_after (float): Retry-After for requests turned away by the
+            queue.
+    """
+    def __init__(self, store=None, rate_per_minute: float = 20.0,
+                 burst: int = 10, max_in_flight: int = 16,
+                 max_queue: int = 32, queue_timeout: float = 10.0,
+                 retry_after: float = 1.0):
+        self.store = store if store is not None else MemoryBucketStore()
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def _check_rate(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+        wait = await run_blocking(self.store, self.store.take, keys,
+                                  self.rate, self.burst)
+        if wait > 0:
+            metrics.incr("admission.rate_limited")
+            raise AdmissionRejected("rate_limited", wait)
+
+    async def _acquire_slot(self) -> None:
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            metrics.incr("admission.queue_full")
+            raise AdmissionRejected("queue_full", self.retry_after)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.incr("admission.queued")
+        try:
+            with metrics.span("admission_wait"):
+                await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            # gave up just after the slot was handed over: pass it on
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.incr("admission.queue_timeouts")
+                raise AdmissionRejected("queue_timeout",
+                                        self.retry_after) from None
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def _release_slot(self) -> None:
+        # hand the slot straight to the oldest live waiter
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self, keys: Sequence[str]) -> AsyncIterator[None]:
+        """
+        Hold an in-flight slot for the body of the `async with`, after
+        taking a token for each rate limit key.
+
+        Args:
+            keys (Sequence[str]): Rate limit keys, e.g. "ip:203.0.113.7".
+
+        Raises:
+            AdmissionRejected: If a bucket is empty, the queue is full or
+                no slot freed up within `queue_timeout`.
+        """
+        await self._check_rate(keys)
+        await self._acquire_slot()
+        metrics.incr("admission.admitted")
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": self._in_flight, "queued": len(self._waiters)}
@@ -1,23 +1,89 @@
 """
 Interactions with the Azure AI Foundry chat agent
 """
+import contextvars
 import requests
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from portfolio_assistant import metrics
+from portfolio_assistant.cache import make_key, normalize_query
+from portfolio_assistant.coalesce import SingleFlight
 from portfolio_assistant.config import Config
-from typing import Optional, List, Tuple, Dict
+from portfolio_assistant.context_packer import count_tokens
+from portfolio_assistant.conversation import (Conversation, is_follow_up,
+                                              is_private_id, trim_history)
+from typing import Optional, List, Tuple, Dict, Iterator, Union, Sequence
+from portfolio_assistant.prompt import PromptTemplate
+from portfolio_assistant.resilience import (CircuitOpenError, OutboundPolicy,
+                                            get_policy)
 from portfolio_assistant.search_client import SearchClient
+from portfolio_assistant.sessions import get_session
+
+# Shared by every client in the worker; sized so abandoned searches that
+# are still waiting on their own timeout cannot starve new requests.
+_retrieval_pool = ThreadPoolExecutor(max_workers=8,
+                                     thread_name_prefix="retrieval")
+# Background refreshes of stale cached answers.
+_refresh_pool = ThreadPoolExecutor(max_workers=2,
+                                   thread_name_prefix="answer-refresh")
+# Chat errors worth retrying: the request never reached the endpoint
+# (ConnectTimeout is a ConnectionError). A read timeout is not retried,
+# as the completion may still be running and billed.
+CHAT_TRANSIENT = (requests.ConnectionError,)
 
 
 class AgentClient:
     """
     Handle communication with the Azure AI Foundry chat agent.
     """
+    _flight_class = SingleFlight
 
     def __init__(self, endpoint: str = None, api_key: str = None,
-                 search_client: Optional[SearchClient] = None):
+                 search_client: Optional[SearchClient] = None,
+                 session: Optional[requests.Session] = None,
+                 retrieval_budget: Optional[float] = None,
+                 answer_cache=None, reranker=None, top_k: int = 5,
+                 rerank_candidates: int = 50, context_packer=None,
+                 conversation_store=None, history_tokens: int = 600,
+                 policy: Optional[OutboundPolicy] = None,
+                 coalesce_wait: Optional[float] = None, router=None,
+                 prompt: Optional[PromptTemplate] = None):
         self.endpoint = endpoint or Config.get_chat_endpoint()
         self.api_key = api_key or Config.get_chat_api_key()
         self.search_client = search_client
+        self._session = session
+        # Seconds to wait for retrieval before answering without context;
+        # None keeps the serial search-then-chat behaviour.
+        self.retrieval_budget = retrieval_budget
+        # Optional ResponseCache of final replies
+        self.answer_cache = answer_cache
+        # Optional Reranker applied to `rerank_candidates` search hits
+        # before the best `top_k` are packed into the prompt
+        self.reranker = reranker
+        self.top_k = top_k
+        self.rerank_candidates = rerank_candidates
+        # Optional ContextPacker replacing build_context's character cap
+        # with a token budget
+        self.context_packer = context_packer
+        # Optional Memory/SQLiteConversationStore; earlier turns are sent
+        # along, trimmed to `history_tokens`
+        self.conversation_store = conversation_store
+        self.history_tokens = history_tokens
+        self._policy = policy
+        # Optional QueryRouter deciding per message whether to search and
+        # how many hits to pack
+        self.router = router
+        if prompt is None:
+            path = Config.get_system_prompt_path()
+            prompt = PromptTemplate.load(path) if path else PromptTemplate()
+        self.prompt = prompt
+        # Identical concurrent prompts share one completion; 0 disables
+        if coalesce_wait is None:
+            coalesce_wait = Config.get_coalesce_wait_seconds()
+        self._flight = self._flight_class("chat", coalesce_wait) \
+            if coalesce_wait else None
 
         if not self.endpoint or not self.api_key:
             raise ValueError(
@@ -25,96 +91,492 @@ class AgentClient:
         if self.search_client is None:
             logging.info("Azure AI Search functionality not enabled.")
 
-    def _build_informed_messages(self, user_message: str) -> Tuple[
-                                                    List[Dict], List[Dict]]:
+    @property
+    def session(self) -> requests.Session:
+        """
+        Session used for chat calls; the shared "chat" pool unless one was
+        passed in.
+        """
+        return self._session or get_session("chat")
+
+    @property
+    def policy(self) -> OutboundPolicy:
+        """
+        Retry/breaker/timeout policy; the shared one for this endpoint
+        unless one was passed in.
+        """
+        return self._policy or get_policy("chat", self.endpoint)
+
+    def _retrieve_context(self, user_message: str,
+                          top_k: Optional[int] = None,
+                          reserved_tokens: int = 0) -> Tuple[str,
+                                                             List[Dict]]:
         """
-        Attempt to inform the user message with relevant document context.
+        Search for documents relevant to the user message and pack them.
         Args:
             user_message (str): The user's input message.
+            top_k (int): Hits to pack; defaults to `self.top_k`.
+            reserved_tokens (int): Prompt tokens outside the context.
         Returns:
-            Tuple[List[Dict], List[Dict]]: A tuple containing:
-                - List of messages and a system prompt if context was found.
-                - List of citations for the context used.
+            Tuple[str, List[Dict]]: Context text and its citations.
         """
-        citations: List[Dict] = []
-        if not self.search_client:
-            return ([{"role": "user", "content": user_message}], citations)
-
-        try:
-            docs = self.search_client.search(user_message, top_k=5,
+        top_k = top_k or self.top_k
+        fetch = self.rerank_candidates if self.reranker else top_k
+        with metrics.span("search"):
+            docs = self.search_client.search(user_message, top_k=fetch,
                                              semantic=True,
                                              semantic_config="searchConfig")
-            context, citations = self.search_client.build_context(docs)
-            if context:
-                system = ("Identity: Lenny the Portfolio Assistant, "
-                          "an AI Agent that answers questions users "
-                          "have about Victoria's professional experience, "
-                          "projects, and expertise."
-                          "Additional Instructions:"
-                          "It is permitted to request clarification from "
-                          "the user if there is very high ambiguity in the "
-                          "user message meaning or intent. "
-                          "Use only the context below to answer. "
-                          "If the answer pertains to Victoria, specifically, "
-                          "but is not in the context, specify "
-                          "that there is uncertainty about "
-                          "the response, and simply suggest contacting "
-                          "Victoria for clarification. If the question is "
-                          "basic or factual and can be reasonably answered "
-                          "from general knowledge or context, it is permitted "
-                          "to answer directly.\n\n"
-                          f"Context:\n{context}")
-                return [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": user_message},
-                ], citations
+        metrics.observe("search.hits", len(docs))
+        return self._pack_context(user_message, docs, top_k, reserved_tokens)
+
+    def _pack_context(self, user_message: str, docs: List[Dict],
+                      top_k: Optional[int] = None,
+                      reserved_tokens: int = 0) -> Tuple[str, List[Dict]]:
+        """
+        Re-rank the hits if configured and pack them into context. With a
+        ContextPacker, the context gets what the token budget leaves after
+        the instructions and `reserved_tokens`.
+        """
+        if self.reranker is not None:
+            with metrics.span("rerank"):
+                docs = self.reranker.rerank(user_message, docs,
+                                            top_k=top_k or self.top_k)
+        with metrics.span("build_context"):
+            if self.context_packer is not None:
+                packed = self.context_packer.pack(docs,
+                                                  self.prompt.static_text,
+                                                  reserved_tokens)
+                context, citations = packed.context, packed.citations
+                tokens = packed.tokens_used
+            else:
+                context, citations = self.search_client.build_context(docs)
+                tokens = count_tokens(context)
+        metrics.observe("context.chars", len(context))
+        metrics.observe("context.tokens", tokens)
+        return context, citations
+
+    def _compose_messages(self, user_message: str, context: str,
+                          history: Sequence[Dict] = ()) -> List[Dict]:
+        """
+        Wrap the user message with the instructions, the context and any
+        earlier turns of the conversation.
+        Args:
+            user_message (str): The user's input message.
+            context (str): Retrieved document context, may be empty.
+            history (Sequence[Dict]): Earlier user/assistant messages.
+        Returns:
+            List[Dict]: Chat messages for the completion request.
+        """
+        return self.prompt.messages(user_message, context, history)
+
+    def _route(self, user_message: str) -> Optional[int]:
+        """
+        Hits to retrieve for the message, or None when the router says it
+        can be answered without a search.
+        """
+        if self.router is None:
+            return self.top_k
+        route = self.router.route(user_message)
+        return route.top_k if route.retrieve else None
+
+    def _gather_context(self, user_message: str,
+                        reserved_tokens: int = 0) -> Tuple[
+                                            str, List[Dict], bool]:
+        """
+        Attempt to find relevant document context for the user message.
+        With a `retrieval_budget`, retrieval runs on the shared retrieval
+        pool and is abandoned once the budget has passed.
+        Args:
+            user_message (str): The user's input message.
+            reserved_tokens (int): Prompt tokens outside the context.
+        Returns:
+            Tuple[str, List[Dict], bool]: Context (empty if none was
+                found), its citations, and whether the budget ran out.
+        """
+        if not self.search_client:
+            return "", [], False
+        top_k = self._route(user_message)
+        if top_k is None:
+            return "", [], False
+        try:
+            if self.retrieval_budget is None:
+                context, citations = self._retrieve_context(
+                    user_message, top_k, reserved_tokens)
+            else:
+                # Run in a copy of this context so the search is counted
+                # against the current request
+                future = _retrieval_pool.submit(
+                    contextvars.copy_context().run, self._retrieve_context,
+                    user_message, top_k, reserved_tokens)
+                context, citations = future.result(
+                    timeout=self.retrieval_budget)
+        except FuturesTimeoutError:
+            metrics.incr("retrieval.timeouts")
+            logging.warning(f"Search retrieval exceeded budget of "
+                            f"{self.retrieval_budget}s; answering without "
+                            f"document context.")
+            return "", [], True
         except Exception as e:
             logging.warning(f"Search retrieval failed; continuing without "
                             f"relevant document context: {e}")
-        return ([{"role": "user", "content": user_message}], citations)
+            return "", [], False
+        return context, citations, False
 
-    def ask(self, user_message: str, conversation_id: str = "default") -> dict:
+    @staticmethod
+    def _message_tokens(user_message: str, history: Sequence[Dict]) -> int:
         """
-        Send a prompt to the AI agent and return the response.
+        Prompt tokens of the question and earlier turns, counted as
+        trim_history does.
+        """
+        return sum(count_tokens(t["content"]) + 4 for t in history) + \
+            count_tokens(user_message) + 4
 
-        Args:
-            user_message (str) - The question or input from the user.
-            conversation_id (str) - Optional conversation thread ID.
+    def _history_budget(self, user_message: str, context: str) -> int:
+        """
+        Tokens of earlier turns to send with an already packed `context`:
+        `history_tokens`, cut to what the ContextPacker's budget leaves.
+        """
+        if self.context_packer is None:
+            return self.history_tokens
+        left = self.context_packer.budget.for_context(
+            self.prompt.static_text) - count_tokens(context) - \
+            self._message_tokens(user_message, ())
+        return max(0, min(self.history_tokens, left))
+
+    def _keeps_history(self, conversation_id: str) -> bool:
+        """
+        Whether turns of `conversation_id` are stored and replayed: only
+        for ids that are random tokens, since anyone sending the id gets
+        the history. The shared "default" id has no memory.
+        """
+        return self.conversation_store is not None and \
+            is_private_id(conversation_id)
 
+    def _load_conversation(self, conversation_id: str) -> Optional[
+                                                        Conversation]:
+        """
+        Earlier turns of the conversation, if it keeps history.
+        """
+        if not self._keeps_history(conversation_id):
+            return None
+        return self.conversation_store.get(conversation_id)
+
+    def _prepare(self, user_message: str, conversation_id: str) -> Tuple[
+                                    List[Dict], List[Dict], bool, str]:
+        """
+        Build the chat messages for one turn. Follow-up questions reuse
+        the previous turn's context instead of searching again.
         Returns:
-            dict -  JSON response from the AI agent parsed into a dictionary.
+            Tuple[List[Dict], List[Dict], bool, str]: Messages, citations,
+                whether the retrieval budget ran out, and the context.
         """
-        messages, citations = self._build_informed_messages(user_message)
+        prior = self._load_conversation(conversation_id)
+        if prior and prior.context and is_follow_up(user_message):
+            logging.info("Follow-up question; reusing previous context.")
+            context, citations, timeout = prior.context, prior.citations, \
+                False
+            history = trim_history(prior.turns, self._history_budget(
+                user_message, context))
+        else:
+            # the history is sized first, so packing leaves room for it
+            history = trim_history(prior.turns, self.history_tokens) \
+                if prior else []
+            context, citations, timeout = self._gather_context(
+                user_message, self._message_tokens(user_message, history))
+        return (self._compose_messages(user_message, context, history),
+                citations, timeout, context)
+
+    def _remember(self, conversation_id: str, user_message: str,
+                  result: dict, context: str, citations: List[Dict]) -> None:
+        if not self._keeps_history(conversation_id) or \
+           not isinstance(result, dict) or "reply" not in result:
+            return
+        self.conversation_store.append(conversation_id, user_message,
+                                       result["reply"], context, citations)
 
-        headers = {
+    def _headers(self) -> Dict:
+        return {
             "Content-Type": "application/json",
             "api-key": self.api_key
         }
 
+    @staticmethod
+    def _observe_prompt(messages: List[Dict]) -> None:
+        metrics.observe("prompt.chars",
+                        sum(len(m["content"]) for m in messages))
+        metrics.observe("prompt.messages", len(messages))
+
+    @staticmethod
+    def _observe_usage(data) -> None:
+        """
+        Record prompt tokens, and how many of them the endpoint served
+        from its prompt cache, from the completion's `usage`.
+        """
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if not usage or not usage.get("prompt_tokens"):
+            return
+        prompt_tokens = usage["prompt_tokens"]
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or 0
+        metrics.incr("prompt.tokens", prompt_tokens)
+        metrics.incr("prompt.cached_tokens", cached)
+        metrics.observe("prompt.cached_ratio", cached / prompt_tokens)
+
+    def _lookup_answer(self, key: str) -> Tuple[Optional[dict], bool]:
+        cached, stale = self.answer_cache.lookup(key)
+        metrics.incr("answer_cache.hits" if cached is not None
+                     else "answer_cache.misses")
+        return cached, stale
+
+    @staticmethod
+    def _payload(messages: List[Dict], stream: bool = False) -> Dict:
         payload = {
             "messages": messages,
             "max_tokens": 256
         }
+        if stream:
+            payload["stream"] = True
+        return payload
 
-        logging.info(f"POSTing to endpoint: {self.endpoint}")
-        logging.info(f"Payload: {payload}")
+    @staticmethod
+    def _sse_delta(line: Union[str, bytes]) -> Tuple[bool, Optional[str]]:
+        """
+        Parse one line of a streamed chat completion.
+        Returns:
+            Tuple[bool, Optional[str]]: Whether the stream is finished and
+                the text delta carried by the line, if any.
+        """
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line.startswith("data:"):
+            return False, None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return True, None
         try:
-            response = requests.post(self.endpoint, json=payload,
-                                     headers=headers, timeout=30)
+            chunk = json.loads(data)
+        except ValueError:
+            logging.warning(f"Skipping malformed stream chunk: {data[:80]}")
+            return False, None
+        choices = chunk.get("choices") or []
+        if not choices:
+            return False, None
+        delta = choices[0].get("delta") or {}
+        return False, delta.get("content") or choices[0].get("text")
+
+    @staticmethod
+    def _parse_reply(data, citations: List[Dict],
+                     context_timeout: bool = False) -> dict:
+        """
+        Reduce a chat completion to the reply/citations shape returned to
+        callers; unexpected payloads are passed through unchanged.
+        """
+        if isinstance(data, dict) and "choices" in data and data["choices"]:
+            msg = data["choices"][0].get("message", {})
+            content = msg.get("content") or data["choices"][0].get("text")
+            if content:
+                result = {"reply": content}
+                if citations:
+                    result["citations"] = citations
+                if context_timeout:
+                    result["context_timeout"] = True
+                return result
+        return data
+
+    def _answer_key(self, user_message: str, messages: List[Dict],
+                    citations: List[Dict]) -> str:
+        """
+        Cache key covering the normalized question, the system prompt with
+        its retrieved context, the citations and the completion settings.
+        """
+        return make_key("answer", self.endpoint, normalize_query(user_message),
+                        messages[:-1], citations, self._payload([]))
+
+    def _flight_key(self, user_message: str, messages: List[Dict],
+                    citations: List[Dict], key: Optional[str],
+                    context_timeout: bool) -> str:
+        return make_key(key or self._answer_key(user_message, messages,
+                                                citations), context_timeout)
+
+    @staticmethod
+    def _cacheable(result: dict) -> bool:
+        return isinstance(result, dict) and "reply" in result and \
+            "error" not in result and not result.get("context_timeout")
+
+    def _complete(self, messages: List[Dict], citations: List[Dict],
+                  context_timeout: bool = False) -> dict:
+        """
+        POST the messages to the chat endpoint and parse the reply.
+        """
+        logging.info(f"POSTing to endpoint: {self.endpoint}")
+        payload = self._payload(messages)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # the payload holds the whole retrieved context
+            logging.debug(f"Payload: {payload}")
+        self._observe_prompt(messages)
+        policy = self.policy
+
+        def send():
+            response = self.session.post(
+                self.endpoint, json=payload, headers=self._headers(),
+                timeout=policy.timeouts.for_requests())
             response.raise_for_status()
-            data = response.json()
-
-            if isinstance(
-                    data, dict) and "choices" in data and data["choices"]:
-                msg = data["choices"][0].get("message", {})
-                content = msg.get("content") or data["choices"][0].get("text")
-                if content:
-                    result = {"reply": content}
-                    if citations:
-                        result["citations"] = citations
-                    return result
-
-            return data
+            return response.json()
+
+        try:
+            with metrics.span("chat"):
+                data = policy.call(send, transient=CHAT_TRANSIENT)
+            self._observe_usage(data)
+            return self._parse_reply(data, citations, context_timeout)
+        except CircuitOpenError as e:
+            logging.error(f"Not calling AI agent: {e}")
+            return {"error": "The assistant is temporarily unavailable."}
         except requests.RequestException as e:
+            metrics.incr("chat.errors")
             logging.error(f"Request to AI agent failed: {e}")
             return {"error": str(e)}
+
+    def _refresh_answer(self, key: str, messages: List[Dict],
+                        citations: List[Dict]) -> None:
+        try:
+            result = self._complete(messages, citations)
+            if self._cacheable(result):
+                self.answer_cache.store(key, result)
+        finally:
+            self.answer_cache.end_refresh(key)
+
+    def _complete_shared(self, user_message: str, messages: List[Dict],
+                         citations: List[Dict], context_timeout: bool,
+                         key: Optional[str]) -> dict:
+        """
+        Complete and cache the answer, sharing one in-flight completion
+        among identical concurrent prompts.
+        """
+        def complete() -> dict:
+            result = self._complete(messages, citations, context_timeout)
+            if key is not None and self._cacheable(result):
+                self.answer_cache.store(key, result)
+            return result
+
+        if self._flight is None:
+            return complete()
+        return dict(self._flight.do(
+            self._flight_key(user_message, messages, citations, key,
+                             context_timeout), complete))
+
+    def ask(self, user_message: str, conversation_id: str = "default") -> dict:
+        """
+        Send a prompt to the AI agent and return the response.
+
+        Args:
+            user_message (str) - The question or input from the user.
+            conversation_id (str) - Optional conversation thread ID.
+
+        Returns:
+            dict -  JSON response from the AI agent parsed into a dictionary.
+        """
+        messages, citations, context_timeout, context = self._prepare(
+            user_message, conversation_id)
+
+        key = None
+        result = None
+        if self.answer_cache is not None and not context_timeout:
+            key = self._answer_key(user_message, messages, citations)
+            cached, stale = self._lookup_answer(key)
+            if cached is not None:
+                logging.info(f"Answer cache hit (stale={stale}).")
+                if stale and self.answer_cache.begin_refresh(key):
+                    _refresh_pool.submit(self._refresh_answer, key,
+                                         messages, citations)
+                result = dict(cached)
+
+        if result is None:
+            result = self._complete_shared(user_message, messages, citations,
+                                           context_timeout, key)
+        self._remember(conversation_id, user_message, result, context,
+                       citations)
+        return result
+
+    def ask_stream(self, user_message: str,
+                   conversation_id: str = "default") -> Iterator[dict]:
+        """
+        Stream the AI agent's reply as it is generated.
+
+        Args:
+            user_message (str) - The question or input from the user.
+            conversation_id (str) - Optional conversation thread ID.
+
+        Yields:
+            dict - First {"citations": [...]} (with "context_timeout" when
+                the retrieval budget ran out), then {"delta": text} chunks,
+                or a final {"error": message} if the request fails.
+        """
+        messages, citations, context_timeout, context = self._prepare(
+            user_message, conversation_id)
+
+        head = {"citations": citations}
+        if context_timeout:
+            head["context_timeout"] = True
+        yield head
+
+        key = None
+        if self.answer_cache is not None and not context_timeout:
+            key = self._answer_key(user_message, messages, citations)
+            cached, stale = self._lookup_answer(key)
+            if cached is not None:
+                if stale and self.answer_cache.begin_refresh(key):
+                    _refresh_pool.submit(self._refresh_answer, key,
+                                         messages, citations)
+                self._remember(conversation_id, user_message, cached,
+                               context, citations)
+                yield {"delta": cached["reply"]}
+                return
+
+        logging.info(f"Streaming from endpoint: {self.endpoint}")
+        self._observe_prompt(messages)
+        policy = self.policy
+
+        def open_stream():
+            # retried until the reply starts; nothing is retried after
+            response = self.session.post(
+                self.endpoint, json=self._payload(messages, stream=True),
+                headers=self._headers(),
+                timeout=policy.timeouts.for_requests(), stream=True)
+            try:
+                response.raise_for_status()
+            except requests.RequestException:
+                response.close()
+                raise
+            return response
+
+        parts: List[str] = []
+        try:
+            with metrics.span("chat"), \
+                 policy.call(open_stream,
+                             transient=CHAT_TRANSIENT) as response:
+                for line in response.iter_lines():
+                    done, delta = self._sse_delta(line)
+                    if done:
+                        break
+                    if delta:
+                        parts.append(delta)
+                        yield {"delta": delta}
+        except CircuitOpenError as e:
+            logging.error(f"Not calling AI agent: {e}")
+            yield {"error": "The assistant is temporarily unavailable."}
+            return
+        except requests.RequestException as e:
+            metrics.incr("chat.errors")
+            logging.error(f"Streaming request to AI agent failed: {e}")
+            yield {"error": str(e)}
+            return
+
+        if parts:
+            result = self._parse_reply(
+                {"choices": [{"message": {"content": "".join(parts)}}]},
+                citations)
+            if key is not None:
+                self.answer_cache.store(key, result)
+            self._remember(conversation_id, user_message, result, context,
+                           citations)
@@ -0,0 +1,265 @@
+"""
+Worker-wide application state shared by the Azure Functions: the agent
+client and admission controller built from the configuration, the
+warm-up routine and the one-time logging setup. The function folders
+import it from here so that they all use the same client; the worker
+loads each folder as its own package (__app__.<name>), so state kept in
+one function's module would not be seen by the others.
+"""
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+from portfolio_assistant import metrics
+from portfolio_assistant.config import Config
+from portfolio_assistant.utils import configure_logging
+
+# The clients (aiohttp, requests) and the optional features are imported
+# when the first request, or the warm-up hook, builds the agent client,
+# keeping them out of the worker's cold-start import.
+if TYPE_CHECKING:
+    from portfolio_assistant.admission import AdmissionController
+    from portfolio_assistant.async_agent_client import AsyncAgentClient
+
+_client_lock = threading.Lock()
+_agent_client: Optional["AsyncAgentClient"] = None
+_admission: Optional["AdmissionController"] = None
+_logging_configured = False
+
+
+def _build_search_cache():
+    """
+    Search result cache described by the SEARCH_CACHE_* settings, or None
+    when caching is not enabled.
+    """
+    ttl = Config.get_search_cache_ttl()
+    if ttl is None:
+        return None
+    from portfolio_assistant.cache import DiskCache, MemoryCache
+    max_entries = Config.get_search_cache_max_entries()
+    path = Config.get_search_cache_path()
+    if path:
+        return DiskCache(path, max_entries=max_entries, ttl=ttl)
+    return MemoryCache(max_entries=max_entries, ttl=ttl)
+
+
+def _build_answer_cache():
+    """
+    Reply cache described by the ANSWER_CACHE_* settings, or None when
+    caching is not enabled.
+    """
+    ttl = Config.get_answer_cache_ttl()
+    if ttl is None:
+        return None
+    from portfolio_assistant.cache import MemoryCache, ResponseCache
+    stale = Config.get_answer_cache_stale()
+    backend = MemoryCache(max_entries=Config.get_answer_cache_max_entries(),
+                          ttl=ttl + stale)
+    return ResponseCache(backend, ttl=ttl, stale_ttl=stale)
+
+
+def _build_search_client():
+    """
+    Local BM25 index when LOCAL_SEARCH_INDEX_PATH is set, otherwise
+    Azure AI Search.
+    """
+    index_path = Config.get_local_search_index_path()
+    if index_path:
+        from portfolio_assistant.local_search import LocalSearchClient
+        return LocalSearchClient(index_path)
+    from portfolio_assistant.async_search_client import AsyncSearchClient
+    return AsyncSearchClient(cache=_build_search_cache())
+
+
+def _build_reranker():
+    """
+    Re-ranker over the RERANK_VECTORS_PATH vectors, or None. Imported
+    lazily because it needs NumPy, which is not a default requirement.
+
+    Raises:
+        ValueError: If RERANK_VECTORS_PATH is set without NumPy installed.
+    """
+    prefix = Config.get_rerank_vectors_path()
+    if not prefix:
+        return None
+    try:
+        from portfolio_assistant.rerank import Reranker, VectorStore
+    except ImportError as e:
+        raise ValueError(f"RERANK_VECTORS_PATH is set but re-ranking is "
+                         f"unavailable: {e}; add numpy to "
+                         f"requirements.txt.") from e
+    return Reranker(VectorStore.load(prefix))
+
+
+def _build_context_packer():
+    """
+    Token-budget packer for CONTEXT_TOKEN_BUDGET, or None.
+    """
+    total = Config.get_context_token_budget()
+    if total is None:
+        return None
+    from portfolio_assistant.context_packer import ContextPacker, TokenBudget
+    return ContextPacker(TokenBudget(total=total))
+
+
+def _build_conversation_store():
+    """
+    Conversation history store described by the CONVERSATION_* settings.
+    """
+    max_count = Config.get_conversation_max_count()
+    idle = Config.get_conversation_idle_seconds()
+    path = Config.get_conversation_store_path()
+    from portfolio_assistant.conversation import (MemoryConversationStore,
+                                                  SQLiteConversationStore)
+    if path:
+        return SQLiteConversationStore(path, max_conversations=max_count,
+                                       idle_ttl=idle)
+    return MemoryConversationStore(max_conversations=max_count,
+                                   idle_ttl=idle)
+
+
+def _build_router():
+    """
+    Query router deciding which messages need a search, or None when
+    QUERY_ROUTER_ENABLED is off.
+    """
+    if not Config.get_query_router_enabled():
+        return None
+    from portfolio_assistant.router import QueryRouter, RouterModel
+    model_path = Config.get_router_model_path()
+    return QueryRouter(top_k=Config.get_search_top_k(),
+                       model=RouterModel.load(model_path)
+                       if model_path else None)
+
+
+def _build_admission():
+    """
+    Admission controller described by the ADMISSION_* settings, or None
+    when ADMISSION_ENABLED is off.
+    """
+    if not Config.get_admission_enabled():
+        return None
+    from portfolio_assistant.admission import (AdmissionController,
+                                               MemoryBucketStore,
+                                               SQLiteBucketStore)
+    path = Config.get_admission_store_path()
+    return AdmissionController(
+        SQLiteBucketStore(path) if path else MemoryBucketStore(),
+        rate_per_minute=Config.get_admission_rate_per_minute(),
+        burst=Config.get_admission_burst(),
+        max_in_flight=Config.get_admission_max_in_flight(),
+        max_queue=Config.get_admission_max_queue(),
+        queue_timeout=Config.get_admission_queue_timeout())
+
+
+def _configure_policies() -> None:
+    """
+    Apply the retry, timeout, hedging and circuit breaker settings to
+    the shared outbound policies.
+    """
+    from portfolio_assistant.resilience import (RetryPolicy, Timeouts,
+                                                configure_policy)
+    retry = RetryPolicy(attempts=Config.get_outbound_retry_attempts())
+    breaker = {"failure_threshold": Config.get_circuit_failure_threshold(),
+               "reset_timeout": Config.get_circuit_reset_seconds()}
+    configure_policy("search", retry=retry,
+                     timeouts=Timeouts(Config.get_search_connect_timeout(),
+                                       Config.get_search_read_timeout()),
+                     deadline=Config.get_search_deadline(),
+                     hedge_percentile=Config.get_search_hedge_percentile(),
+                     **breaker)
+    configure_policy("chat", retry=retry,
+                     timeouts=Timeouts(Config.get_chat_connect_timeout(),
+                                       Config.get_chat_read_timeout()),
+                     **breaker)
+
+
+def configure_logging_once() -> None:
+    """
+    Configure logging on the first call in this worker.
+    """
+    global _logging_configured
+    if not _logging_configured:
+        configure_logging()
+        _logging_configured = True
+
+
+def get_agent_client() -> "AsyncAgentClient":
+    """
+    Return the worker-wide AsyncAgentClient, building it on first use so
+    warm invocations reuse its pooled connections. The configuration is
+    snapshotted and validated at the same time.
+    """
+    global _agent_client, _admission
+    if _agent_client is None:
+        with _client_lock:
+            if _agent_client is None:
+                from portfolio_assistant.async_agent_client import \
+                    AsyncAgentClient
+                Config.load()
+                _configure_policies()
+                _admission = _build_admission()
+                _agent_client = AsyncAgentClient(
+                    search_client=_build_search_client(),
+                    retrieval_budget=Config.get_retrieval_budget(),
+                    answer_cache=_build_answer_cache(),
+                    reranker=_build_reranker(),
+                    top_k=Config.get_search_top_k(),
+                    rerank_candidates=Config.get_rerank_candidates(),
+                    context_packer=_build_context_packer(),
+                    conversation_store=_build_conversation_store(),
+                    router=_build_router())
+    return _agent_client
+
+
+def get_admission() -> Optional["AdmissionController"]:
+    """
+    Return the admission controller built with the agent client, or
+    None when ADMISSION_ENABLED is off.
+    """
+    get_agent_client()
+    return _admission
+
+
+def reset_clients() -> None:
+    """
+    Drop the cached clients, their sessions and the configuration
+    snapshot, e.g. after the endpoint configuration changes.
+    """
+    global _agent_client, _admission
+    with _client_lock:
+        _agent_client = None
+        _admission = None
+        Config.reset()
+    from portfolio_assistant.resilience import reset_policies
+    from portfolio_assistant.sessions import reset_sessions
+    reset_sessions()
+    reset_policies()
+
+
+async def warm_up() -> None:
+    """
+    Do the first request's setup ahead of time: build the agent client
+    (loading local indexes, vectors and cache files), load the token
+    encoding and open pooled connections to the chat and search
+    endpoints. Invalid configuration raises; connection failures are
+    logged and left for the first request.
+    """
+    configure_logging_once()
+    with metrics.span("warm_up"):
+        agent_client = get_agent_client()
+        from portfolio_assistant.context_packer import count_tokens
+        count_tokens("warm up")
+        import aiohttp
+        targets = [(agent_client.async_session, agent_client.endpoint)]
+        search_client = agent_client.search_client
+        if hasattr(search_client, "async_session"):
+            targets.append((search_client.async_session,
+                            search_client.endpoint))
+        for session, url in targets:
+            # any response leaves a kept-alive connection in the pool
+            try:
+                async with session.head(
+                        url, timeout=aiohttp.ClientTimeout(total=5)) as r:
+                    await r.read()
+            except Exception as e:
+                logging.warning(f"Warm-up request to {url} failed: {e}")
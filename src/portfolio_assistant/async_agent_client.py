@@ -0,0 +1,324 @@
+"""
+Asyncio interactions with the Azure AI Foundry chat agent
+"""
+import asyncio
+import inspect
+import logging
+import aiohttp
+from typing import Optional, List, Tuple, Dict, AsyncIterator
+from portfolio_assistant import metrics
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.coalesce import AsyncSingleFlight
+from portfolio_assistant.conversation import (Conversation, is_follow_up,
+                                              trim_history)
+from portfolio_assistant.resilience import CircuitOpenError
+from portfolio_assistant.sessions import get_async_session
+from portfolio_assistant.utils import run_blocking
+
+# Connect failures only, as for AgentClient
+CHAT_TRANSIENT = (aiohttp.ClientConnectorError,
+                  aiohttp.ConnectionTimeoutError)
+
+
+class AsyncAgentClient(AgentClient):
+    """
+    Handle non-blocking communication with the Azure AI Foundry chat
+    agent. Returns the same reply/citations shape as AgentClient.
+    """
+    _flight_class = AsyncSingleFlight
+
+    def __init__(self, endpoint: str = None, api_key: str = None,
+                 search_client=None,
+                 session: Optional[aiohttp.ClientSession] = None,
+                 retrieval_budget: Optional[float] = None,
+                 answer_cache=None, reranker=None, top_k: int = 5,
+                 rerank_candidates: int = 50, context_packer=None,
+                 conversation_store=None, history_tokens: int = 600,
+                 policy=None, coalesce_wait=None, router=None,
+                 prompt=None):
+        super().__init__(endpoint=endpoint, api_key=api_key,
+                         search_client=search_client,
+                         retrieval_budget=retrieval_budget,
+                         answer_cache=answer_cache, reranker=reranker,
+                         top_k=top_k, rerank_candidates=rerank_candidates,
+                         context_packer=context_packer,
+                         conversation_store=conversation_store,
+                         history_tokens=history_tokens, policy=policy,
+                         coalesce_wait=coalesce_wait, router=router,
+                         prompt=prompt)
+        self._async_session = session
+        # Keeps background refresh tasks referenced until they finish
+        self._refresh_tasks = set()
+
+    @property
+    def async_session(self) -> aiohttp.ClientSession:
+        """
+        Session used for chat calls; the shared async "chat" pool unless
+        one was passed in.
+        """
+        return self._async_session or get_async_session("chat")
+
+    async def _retrieve_context(self, user_message: str,
+                                top_k: Optional[int] = None,
+                                reserved_tokens: int = 0) -> Tuple[
+                                                        str, List[Dict]]:
+        """
+        Search for documents relevant to the user message and pack them.
+        Sync search clients are accepted as well as async ones.
+        """
+        top_k = top_k or self.top_k
+        fetch = self.rerank_candidates if self.reranker else top_k
+        with metrics.span("search"):
+            docs = self.search_client.search(user_message, top_k=fetch,
+                                             semantic=True,
+                                             semantic_config="searchConfig")
+            if inspect.isawaitable(docs):
+                docs = await docs
+        metrics.observe("search.hits", len(docs))
+        return self._pack_context(user_message, docs, top_k, reserved_tokens)
+
+    async def _gather_context(self, user_message: str,
+                              reserved_tokens: int = 0) -> Tuple[
+                                                str, List[Dict], bool]:
+        """
+        Retrieve context; with a `retrieval_budget`, give up (and cancel
+        the search) once the budget has passed.
+        """
+        if not self.search_client:
+            return "", [], False
+        top_k = self._route(user_message)
+        if top_k is None:
+            return "", [], False
+        try:
+            context, citations = await asyncio.wait_for(
+                self._retrieve_context(user_message, top_k,
+                                       reserved_tokens),
+                timeout=self.retrieval_budget)
+        except asyncio.TimeoutError:
+            metrics.incr("retrieval.timeouts")
+            logging.warning(f"Search retrieval exceeded budget of "
+                            f"{self.retrieval_budget}s; answering without "
+                            f"document context.")
+            return "", [], True
+        except Exception as e:
+            logging.warning(f"Search retrieval failed; continuing without "
+                            f"relevant document context: {e}")
+            return "", [], False
+        return context, citations, False
+
+    async def _load_conversation(self, conversation_id: str) -> Optional[
+                                                        Conversation]:
+        """
+        Earlier turns of the conversation; a blocking store such as
+        SQLiteConversationStore is read from the default executor.
+        """
+        if not self._keeps_history(conversation_id):
+            return None
+        store = self.conversation_store
+        return await run_blocking(store, store.get, conversation_id)
+
+    async def _remember(self, conversation_id: str, user_message: str,
+                        result: dict, context: str,
+                        citations: List[Dict]) -> None:
+        if not self._keeps_history(conversation_id) or \
+           not isinstance(result, dict) or "reply" not in result:
+            return
+        store = self.conversation_store
+        await run_blocking(store, store.append, conversation_id,
+                           user_message, result["reply"], context, citations)
+
+    async def _prepare(self, user_message: str, conversation_id: str) -> \
+            Tuple[List[Dict], List[Dict], bool, str]:
+        prior = await self._load_conversation(conversation_id)
+        if prior and prior.context and is_follow_up(user_message):
+            logging.info("Follow-up question; reusing previous context.")
+            context, citations, timeout = prior.context, prior.citations, \
+                False
+            history = trim_history(prior.turns, self._history_budget(
+                user_message, context))
+        else:
+            history = trim_history(prior.turns, self.history_tokens) \
+                if prior else []
+            context, citations, timeout = await self._gather_context(
+                user_message, self._message_tokens(user_message, history))
+        return (self._compose_messages(user_message, context, history),
+                citations, timeout, context)
+
+    async def _complete(self, messages: List[Dict], citations: List[Dict],
+                        context_timeout: bool = False) -> dict:
+        """
+        POST the messages to the chat endpoint and parse the reply.
+        """
+        logging.info(f"POSTing to endpoint: {self.endpoint}")
+        payload = self._payload(messages)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # the payload holds the whole retrieved context
+            logging.debug(f"Payload: {payload}")
+        self._observe_prompt(messages)
+        policy = self.policy
+
+        async def send():
+            async with self.async_session.post(
+                    self.endpoint, json=payload, headers=self._headers(),
+                    timeout=policy.timeouts.for_aiohttp()) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+        try:
+            with metrics.span("chat"):
+                data = await policy.acall(send, transient=CHAT_TRANSIENT)
+            self._observe_usage(data)
+            return self._parse_reply(data, citations, context_timeout)
+        except CircuitOpenError as e:
+            logging.error(f"Not calling AI agent: {e}")
+            return {"error": "The assistant is temporarily unavailable."}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.incr("chat.errors")
+            logging.error(f"Request to AI agent failed: {e}")
+            return {"error": str(e)}
+
+    async def _complete_shared(self, user_message: str,
+                               messages: List[Dict], citations: List[Dict],
+                               context_timeout: bool,
+                               key: Optional[str]) -> dict:
+        async def complete() -> dict:
+            result = await self._complete(messages, citations,
+                                          context_timeout)
+            if key is not None and self._cacheable(result):
+                self.answer_cache.store(key, result)
+            return result
+
+        if self._flight is None:
+            return await complete()
+        return dict(await self._flight.do(
+            self._flight_key(user_message, messages, citations, key,
+                             context_timeout), complete))
+
+    async def _refresh_answer(self, key: str, messages: List[Dict],
+                              citations: List[Dict]) -> None:
+        try:
+            result = await self._complete(messages, citations)
+            if self._cacheable(result):
+                self.answer_cache.store(key, result)
+        finally:
+            self.answer_cache.end_refresh(key)
+
+    def _schedule_refresh(self, key: str, messages: List[Dict],
+                          citations: List[Dict]) -> None:
+        task = asyncio.ensure_future(
+            self._refresh_answer(key, messages, citations))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def ask(self, user_message: str,
+                  conversation_id: str = "default") -> dict:
+        """
+        Send a prompt to the AI agent and return the response.
+
+        Args:
+            user_message (str) - The question or input from the user.
+            conversation_id (str) - Optional conversation thread ID.
+
+        Returns:
+            dict -  JSON response from the AI agent parsed into a dictionary.
+        """
+        messages, citations, context_timeout, context = \
+            await self._prepare(user_message, conversation_id)
+
+        key = None
+        result = None
+        if self.answer_cache is not None and not context_timeout:
+            key = self._answer_key(user_message, messages, citations)
+            cached, stale = self._lookup_answer(key)
+            if cached is not None:
+                logging.info(f"Answer cache hit (stale={stale}).")
+                if stale and self.answer_cache.begin_refresh(key):
+                    self._schedule_refresh(key, messages, citations)
+                result = dict(cached)
+
+        if result is None:
+            result = await self._complete_shared(
+                user_message, messages, citations, context_timeout, key)
+        await self._remember(conversation_id, user_message, result, context,
+                             citations)
+        return result
+
+    async def ask_stream(self, user_message: str,
+                         conversation_id: str = "default") -> \
+            AsyncIterator[dict]:
+        """
+        Stream the AI agent's reply as it is generated.
+
+        Args:
+            user_message (str) - The question or input from the user.
+            conversation_id (str) - Optional conversation thread ID.
+
+        Yields:
+            dict - First {"citations": [...]} (with "context_timeout" when
+                the retrieval budget ran out), then {"delta": text} chunks,
+                or a final {"error": message} if the request fails.
+        """
+        messages, citations, context_timeout, context = \
+            await self._prepare(user_message, conversation_id)
+
+        head = {"citations": citations}
+        if context_timeout:
+            head["context_timeout"] = True
+        yield head
+
+        key = None
+        if self.answer_cache is not None and not context_timeout:
+            key = self._answer_key(user_message, messages, citations)
+            cached, stale = self._lookup_answer(key)
+            if cached is not None:
+                if stale and self.answer_cache.begin_refresh(key):
+                    self._schedule_refresh(key, messages, citations)
+                await self._remember(conversation_id, user_message, cached,
+                                     context, citations)
+                yield {"delta": cached["reply"]}
+                return
+
+        logging.info(f"Streaming from endpoint: {self.endpoint}")
+        self._observe_prompt(messages)
+        policy = self.policy
+
+        async def open_stream():
+            # retried until the reply starts; nothing is retried after
+            response = await self.async_session.post(
+                self.endpoint, json=self._payload(messages, stream=True),
+                headers=self._headers(),
+                timeout=policy.timeouts.for_aiohttp())
+            response.raise_for_status()
+            return response
+
+        parts: List[str] = []
+        try:
+            with metrics.span("chat"):
+                response = await policy.acall(open_stream,
+                                              transient=CHAT_TRANSIENT)
+                async with response:
+                    async for line in response.content:
+                        done, delta = self._sse_delta(line)
+                        if done:
+                            break
+                        if delta:
+                            parts.append(delta)
+                            yield {"delta": delta}
+        except CircuitOpenError as e:
+            logging.error(f"Not calling AI agent: {e}")
+            yield {"error": "The assistant is temporarily unavailable."}
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.incr("chat.errors")
+            logging.error(f"Streaming request to AI agent failed: {e}")
+            yield {"error": str(e)}
+            return
+
+        if parts:
+            result = self._parse_reply(
+                {"choices": [{"message": {"content": "".join(parts)}}]},
+                citations)
+            if key is not None:
+                self.answer_cache.store(key, result)
+            await self._remember(conversation_id, user_message, result,
+                                 context, citations)
@@ -0,0 +1,100 @@
+"""
+Asyncio client for Azure AI Search, sharing SearchClient's request and
+context-building logic.
+"""
+import asyncio
+import logging
+import aiohttp
+from typing import Dict, List, Sequence, Optional
+from portfolio_assistant import metrics
+from portfolio_assistant.coalesce import AsyncSingleFlight
+from portfolio_assistant.resilience import CircuitOpenError
+from portfolio_assistant.search_client import SearchClient, SearchHit
+from portfolio_assistant.sessions import get_async_session
+from portfolio_assistant.utils import run_blocking
+
+
+class AsyncSearchClient(SearchClient):
+    """
+    Handle non-blocking communication with Azure AI Search.
+
+    `build_context` is inherited unchanged; it is pure CPU work and
+    returns the same (context, citations) shape as the sync client. A
+    blocking cache such as DiskCache is read and written from the
+    event loop's default executor.
+    """
+    _flight_class = AsyncSingleFlight
+
+    def __init__(self, endpoint: str = None, index_name: str = None,
+                 api_key: str = None, api_version: str = None,
+                 session: Optional[aiohttp.ClientSession] = None,
+                 cache=None, policy=None, semantic_select=None,
+                 coalesce_wait=None):
+        super().__init__(endpoint=endpoint, index_name=index_name,
+                         api_key=api_key, api_version=api_version,
+                         cache=cache, policy=policy,
+                         semantic_select=semantic_select,
+                         coalesce_wait=coalesce_wait)
+        self._async_session = session
+
+    @property
+    def async_session(self) -> aiohttp.ClientSession:
+        """
+        Session used for search calls; the shared async "search" pool
+        unless one was passed in.
+        """
+        return self._async_session or get_async_session("search")
+
+    async def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        select: Optional[Sequence[str]] = None,
+        filter: Optional[str] = None,
+        semantic: bool = False,
+        semantic_config: Optional[str] = None,
+    ) -> List[SearchHit]:
+        select = self._select(select, semantic)
+        key = None
+        if self.cache is not None or self._flight is not None:
+            key = self._cache_key(query, top_k, select, filter, semantic,
+                                  semantic_config)
+        if self.cache is not None:
+            cached = await run_blocking(self.cache, self._cached_hits, key)
+            if cached is not None:
+                return cached
+        body = self._request_body(query, top_k, select, filter, semantic,
+                                  semantic_config)
+        if self._flight is None:
+            return await self._fetch(body, key)
+        return list(await self._flight.do(key,
+                                          lambda: self._fetch(body, key)))
+
+    async def _fetch(self, body: Dict,
+                     key: Optional[str]) -> List[SearchHit]:
+        logging.info(f"Search request body: {body}")
+        policy = self.policy
+
+        async def send() -> List[SearchHit]:
+            timeouts = policy.attempt_timeouts()
+            async with self.async_session.post(
+                    self._url, headers=self._headers, json=body,
+                    timeout=timeouts.for_aiohttp()) as resp:
+                resp.raise_for_status()
+                return self._normalize_hits(
+                    await resp.json(content_type=None))
+
+        try:
+            items = await policy.acall(
+                send, transient=(aiohttp.ClientConnectionError,
+                                 asyncio.TimeoutError))
+            if self.cache is not None:
+                await run_blocking(self.cache, self._cache_hits, key, items)
+            return items
+        except CircuitOpenError as e:
+            logging.warning(f"Skipping search: {e}")
+            return []
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.incr("search.errors")
+            logging.error(f"Search request failed: {e}")
+            return []
@@ -0,0 +1,191 @@
+"""
+Answer many independent questions in one invocation.
+
+Identical questions are answered once; near-duplicates (same question
+up to case, whitespace and trailing punctuation) share one search call.
+Searches and chat calls each run with their own concurrency limit, and
+new chat calls wait while the chat endpoint is rate limiting us. Each
+item's result is yielded as soon as it is ready, with its index, and a
+failed item carries an error instead of failing the batch. Questions
+still unanswered at the batch deadline are reported as errors, so the
+response goes out before the platform's HTTP timeout cuts it off.
+"""
+import asyncio
+import copy
+import inspect
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+from portfolio_assistant import metrics
+from portfolio_assistant.cache import make_key, normalize_query
+
+
+class SharedSearch:
+    """
+    Search client wrapper for one batch: concurrent calls for the same
+    normalized query and arguments share one search, and at most
+    `concurrency` searches are in flight. Everything else, such as
+    `build_context`, is the wrapped client's.
+
+    Args:
+        search_client: Sync or async search client to wrap.
+        concurrency (int): Searches in flight at once.
+    """
+    def __init__(self, search_client, concurrency: int = 4):
+        self.search_client = search_client
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.search_client, name)
+
+    async def _search(self, query: str, **kwargs) -> List[Dict]:
+        async with self._semaphore:
+            docs = self.search_client.search(query, **kwargs)
+            if inspect.isawaitable(docs):
+                docs = await docs
+            return docs
+
+    async def search(self, query: str, **kwargs) -> List[Dict]:
+        key = make_key(normalize_query(query), kwargs)
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(self._search(query, **kwargs))
+            self._calls[key] = call
+        else:
+            metrics.incr("batch.shared_searches")
+        # shielded: one item giving up on its retrieval budget must not
+        # cancel the search for the others
+        return list(await asyncio.shield(call))
+
+
+class ChatGate:
+    """
+    Stand-in for the chat client's OutboundPolicy that limits concurrent
+    chat calls and holds new ones while the endpoint's last 429 back-off
+    runs.
+
+    Args:
+        policy (OutboundPolicy): The chat endpoint's shared policy.
+        concurrency (int): Chat calls in flight at once.
+    """
+    def __init__(self, policy, concurrency: int = 4):
+        self.policy = policy
+        self.timeouts = policy.timeouts
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def acall(self, send, transient=()) -> Any:
+        async with self._semaphore:
+            wait = self.policy.throttle_delay()
+            while wait > 0:
+                metrics.incr("batch.throttle_waits")
+                logging.info(f"Chat endpoint is rate limiting; holding "
+                             f"batch call for {wait:.2f}s.")
+                await asyncio.sleep(wait)
+                wait = self.policy.throttle_delay()
+            return await self.policy.acall(send, transient=transient)
+
+
+class BatchRunner:
+    """
+    Answer a list of questions with an AsyncAgentClient.
+
+    Args:
+        agent_client (AsyncAgentClient): Client answering each question;
+            its caches and pooled connections are shared with the batch.
+        search_concurrency (int): Searches in flight at once.
+        chat_concurrency (int): Chat calls in flight at once.
+        deadline (float): Seconds after which unanswered questions are
+            given up on; None waits for all of them.
+    """
+    def __init__(self, agent_client, search_concurrency: int = 4,
+                 chat_concurrency: int = 4,
+                 deadline: Optional[float] = None):
+        self.agent_client = agent_client
+        self.search_concurrency = search_concurrency
+        self.chat_concurrency = chat_concurrency
+        self.deadline = deadline
+
+    def _batch_client(self):
+        """
+        Shallow copy of the agent client whose searches and chat calls go
+        through this batch's limits.
+        """
+        client = copy.copy(self.agent_client)
+        if client.search_client is not None:
+            client.search_client = SharedSearch(client.search_client,
+                                                self.search_concurrency)
+        client._policy = ChatGate(self.agent_client.policy,
+                                  self.chat_concurrency)
+        return client
+
+    async def _answer(self, client, message: str) -> dict:
+        # items are independent, so no conversation history is kept
+        return await client.ask(message, "default")
+
+    async def run(self, items: List[Dict[str, Any]]) -> \
+            AsyncIterator[Dict[str, Any]]:
+        """
+        Answer `items` and yield one result per item as it completes.
+
+        Args:
+            items (list): Dicts with a "message" and an optional "id".
+
+        Yields:
+            dict - {"index": i, "id": ...} (id only when given) plus the
+                agent's reply and citations, or an "error".
+        """
+        client = self._batch_client()
+        groups: Dict[str, List[int]] = {}
+        for index, item in enumerate(items):
+            groups.setdefault(item["message"].strip(), []).append(index)
+        metrics.observe("batch.items", len(items))
+        metrics.observe("batch.unique", len(groups))
+        logging.info(f"Batch of {len(items)} questions, {len(groups)} "
+                     f"unique.")
+
+        async def answer(message: str):
+            try:
+                return message, await self._answer(client, message), None
+            except Exception as e:
+                logging.error(f"Batch item failed: {e}")
+                return message, None, e
+
+        tasks = [asyncio.ensure_future(answer(message)) for message in groups]
+        answered = set()
+        try:
+            for next_done in asyncio.as_completed(tasks,
+                                                  timeout=self.deadline):
+                try:
+                    message, result, error = await next_done
+                except asyncio.TimeoutError:
+                    break
+                answered.add(message)
+                for index in groups[message]:
+                    yield self._record(items[index], index, result, error)
+            late = [message for message in groups if message not in answered]
+            if late:
+                metrics.incr("batch.deadline_exceeded", len(late))
+                logging.warning(f"Batch deadline passed; {len(late)} "
+                                f"questions unanswered.")
+            for message in late:
+                error = TimeoutError("Batch deadline exceeded")
+                for index in groups[message]:
+                    yield self._record(items[index], index, None, error)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _record(item: Dict[str, Any], index: int, result: Optional[dict],
+                error: Optional[Exception]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"index": index}
+        if item.get("id") is not None:
+            record["id"] = item["id"]
+        if error is not None:
+            metrics.incr("batch.errors")
+            record["error"] = str(error) or type(error).__name__
+        else:
+            if "error" in result:
+                metrics.incr("batch.errors")
+            record.update(result)
+        return record
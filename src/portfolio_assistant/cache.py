@@ -0,0 +1,246 @@
+"""
+Bounded result caches with LRU eviction and per-entry TTL.
+
+`MemoryCache` lives as long as the worker; `DiskCache` keeps entries in
+a local SQLite file so a restarted worker starts warm. Both expose the
+same get/set/invalidate/stats interface, and values must be JSON
+serializable so either backend can be swapped in.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_query(query: Optional[str]) -> str:
+    """
+    Fold trivially different phrasings of a question onto one key:
+    case, repeated whitespace and trailing punctuation are ignored.
+    """
+    text = _WHITESPACE.sub(" ", (query or "").strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Hash arbitrary JSON-serializable parts into a fixed-length key.
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with a per-entry time to live.
+
+    Args:
+        max_entries (int): Entries kept before the least recently used
+            one is evicted.
+        ttl (float): Seconds an entry stays valid after it is stored.
+    """
+    blocking = False
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """
+        Drop one entry, or every entry when no key is given (e.g. after
+        the search index is rebuilt).
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "size": len(self._entries)}
+
+
+class DiskCache:
+    """
+    SQLite-backed LRU cache with a per-entry time to live, shared by
+    every worker process on the same machine.
+
+    Args:
+        path (str): SQLite database file; created if missing.
+        max_entries (int): Entries kept before the least recently used
+            ones are evicted.
+        ttl (float): Seconds an entry stays valid after it is stored.
+    """
+    # async callers run it in an executor (utils.run_blocking)
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 1024,
+                 ttl: float = 3600.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires REAL NOT NULL, used REAL NOT NULL)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires FROM cache WHERE key = ?",
+                (key,)).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._db.execute("DELETE FROM cache WHERE key = ?",
+                                     (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE cache SET used = ? WHERE key = ?",
+                             (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        data = json.dumps(value)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, used) "
+                "VALUES (?, ?, ?, ?)", (key, data, expires, now))
+            excess = self._db.execute(
+                "SELECT COUNT(*) FROM cache").fetchone()[0] - \
+                self.max_entries
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                    "ORDER BY used LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """
+        Drop one entry, or every entry when no key is given (e.g. after
+        the search index is rebuilt).
+        """
+        with self._lock:
+            if key is None:
+                self._db.execute("DELETE FROM cache")
+            else:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """
+    Stale-while-revalidate wrapper around a MemoryCache or DiskCache.
+
+    Entries are fresh for `ttl` seconds and may then be served stale for
+    another `stale_ttl` seconds while the caller refreshes them in the
+    background; after that they are gone.
+
+    Args:
+        backend: MemoryCache or DiskCache holding the entries.
+        ttl (float): Seconds an entry is served without refreshing.
+        stale_ttl (float): Extra seconds a stale entry may be served.
+    """
+    def __init__(self, backend, ttl: float = 600.0, stale_ttl: float = 0.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        Returns:
+            Tuple[Optional[Any], bool]: The cached value (None on a miss)
+                and whether it is stale and should be refreshed.
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            return None, False
+        stale = time.time() - entry["stored_at"] > self.ttl
+        return entry["value"], stale
+
+    def store(self, key: str, value: Any) -> None:
+        self.backend.set(key, {"stored_at": time.time(), "value": value},
+                         ttl=self.ttl + self.stale_ttl)
+
+    def begin_refresh(self, key: str) -> bool:
+        """
+        Claim the refresh of a stale entry; False if another caller is
+        already refreshing it.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: str) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        self.backend.invalidate(key)
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
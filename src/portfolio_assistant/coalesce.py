@@ -0,0 +1,134 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+When several callers ask for the same key at once, the first one (the
+leader) runs the call and the others wait for its result, so a burst
+of identical questions costs one search and one completion. The
+leader's exception is raised in every waiter. A waiter that has waited
+`wait` seconds gives up on the leader and runs the call itself. Shared
+waits are counted as `<name>.coalesced` and give-ups as
+`<name>.coalesce_timeouts` in the metrics registry.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+from portfolio_assistant import metrics
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalescing for threaded callers.
+
+    Args:
+        name (str): Metrics prefix, e.g. "search".
+        wait (float): Seconds a waiter waits before running the call
+            itself; None waits as long as the leader takes.
+    """
+    def __init__(self, name: str, wait: Optional[float] = None):
+        self.name = name
+        self.wait = wait
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Return `fn()`, or the result of the call already in flight for
+        `key`. The result object is shared, so callers must not mutate
+        it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        metrics.incr(f"{self.name}.coalesced")
+        if not call.done.wait(self.wait):
+            metrics.incr(f"{self.name}.coalesce_timeouts")
+            logging.warning(f"Gave up waiting {self.wait}s for an identical "
+                            f"{self.name} call; calling directly.")
+            return fn()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    Coalescing for coroutines on one event loop. The shared call is
+    cancelled only once every caller waiting on it has been cancelled,
+    e.g. by a retrieval budget.
+
+    Args:
+        name (str): Metrics prefix, e.g. "search".
+        wait (float): Seconds a waiter waits before running the call
+            itself; None waits as long as the leader takes.
+    """
+    def __init__(self, name: str, wait: Optional[float] = None):
+        self.name = name
+        self.wait = wait
+        self._calls: Dict[str, _Flight] = {}
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]) -> Any:
+        """
+        Return `await fn()`, or the result of the call already in flight
+        for `key`. The result object is shared, so callers must not
+        mutate it.
+        """
+        flight = self._calls.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._calls[key] = flight
+            flight.task.add_done_callback(
+                lambda _: self._forget(key, flight))
+        else:
+            metrics.incr(f"{self.name}.coalesced")
+        flight.waiters += 1
+        try:
+            done, _ = await asyncio.wait(
+                {flight.task}, timeout=None if leader else self.wait)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # every caller was cancelled or gave up
+                flight.task.cancel()
+        if not done:
+            metrics.incr(f"{self.name}.coalesce_timeouts")
+            logging.warning(f"Gave up waiting {self.wait}s for an identical "
+                            f"{self.name} call; calling directly.")
+            return await fn()
+        return flight.task.result()
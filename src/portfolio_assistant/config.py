@@ -1,46 +1,431 @@
 """
 Set variables for endpoint and key.
+
+Getters read the environment on every call unless `Config.load()` has
+taken a validated snapshot of all settings, as the function app does
+once per worker; `Config.reset()` goes back to reading the environment.
 """
+import logging
 import os
+from typing import Dict, Optional, Tuple
 
-AZURE_CHAT_AGENT_ENDPOINT = os.getenv("AZURE_CHAT_AGENT_ENDPOINT")
-AZURE_CHAT_API_KEY = os.getenv("AZURE_CHAT_API_KEY")
-AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
-AZURE_SEARCH_API_KEY = os.getenv("AZURE_SEARCH_API_KEY")
-AZURE_SEARCH_INDEX_NAME = os.getenv("AZURE_SEARCH_INDEX_NAME")
-AZURE_SEARCH_API_VERSION = os.getenv("AZURE_SEARCH_API_VERSION")
+SETTINGS = (
+    "AZURE_CHAT_AGENT_ENDPOINT",
+    "AZURE_CHAT_API_KEY",
+    "AZURE_SEARCH_ENDPOINT",
+    "AZURE_SEARCH_API_KEY",
+    "AZURE_SEARCH_INDEX_NAME",
+    "AZURE_SEARCH_API_VERSION",
+    "RETRIEVAL_BUDGET_SECONDS",
+    "LOCAL_SEARCH_INDEX_PATH",
+    "SEARCH_TOP_K",
+    "RERANK_VECTORS_PATH",
+    "RERANK_CANDIDATES",
+    "CONTEXT_TOKEN_BUDGET",
+    "CONVERSATION_STORE_PATH",
+    "CONVERSATION_MAX_COUNT",
+    "CONVERSATION_IDLE_SECONDS",
+    "SEARCH_CACHE_TTL_SECONDS",
+    "SEARCH_CACHE_MAX_ENTRIES",
+    "SEARCH_CACHE_PATH",
+    "ANSWER_CACHE_TTL_SECONDS",
+    "ANSWER_CACHE_STALE_SECONDS",
+    "ANSWER_CACHE_MAX_ENTRIES",
+    "METRICS_ENDPOINT_ENABLED",
+    "METRICS_LOG_REQUESTS",
+    "OUTBOUND_RETRY_ATTEMPTS",
+    "SEARCH_CONNECT_TIMEOUT_SECONDS",
+    "SEARCH_READ_TIMEOUT_SECONDS",
+    "SEARCH_DEADLINE_SECONDS",
+    "CHAT_CONNECT_TIMEOUT_SECONDS",
+    "CHAT_READ_TIMEOUT_SECONDS",
+    "SEARCH_HEDGE_PERCENTILE",
+    "CIRCUIT_FAILURE_THRESHOLD",
+    "CIRCUIT_RESET_SECONDS",
+    "BATCH_MAX_ITEMS",
+    "BATCH_DEADLINE_SECONDS",
+    "BATCH_SEARCH_CONCURRENCY",
+    "BATCH_CHAT_CONCURRENCY",
+    "SEARCH_SELECT",
+    "COALESCE_WAIT_SECONDS",
+    "QUERY_ROUTER_ENABLED",
+    "ROUTER_MODEL_PATH",
+    "SYSTEM_PROMPT_PATH",
+    "ADMISSION_ENABLED",
+    "ADMISSION_RATE_PER_MINUTE",
+    "ADMISSION_BURST",
+    "ADMISSION_MAX_IN_FLIGHT",
+    "ADMISSION_MAX_QUEUE",
+    "ADMISSION_QUEUE_TIMEOUT_SECONDS",
+    "ADMISSION_STORE_PATH",
+)
 
 
 class Config:
     """
     Mainly for testing, update env vars if needed
     """
+    _snapshot: Optional[Dict[str, Optional[str]]] = None
+
+    @staticmethod
+    def _get(name: str) -> Optional[str]:
+        snapshot = Config._snapshot
+        if snapshot is not None:
+            return snapshot.get(name)
+        return os.getenv(name)
+
+    @staticmethod
+    def load() -> None:
+        """
+        Read every setting once and check that numeric ones parse, so a
+        bad value fails at startup rather than on some later request.
+
+        Raises:
+            ValueError: If a setting has an invalid value.
+        """
+        snapshot = {name: os.getenv(name) for name in SETTINGS}
+        Config._snapshot = snapshot
+        for name, getter in vars(Config).items():
+            if not name.startswith("get_"):
+                continue
+            try:
+                getter.__func__()
+            except ValueError as e:
+                Config._snapshot = None
+                raise ValueError(f"Invalid setting for Config.{name}: "
+                                 f"{e}") from e
+        logging.info(f"Configuration loaded: {len(snapshot)} settings.")
+
+    @staticmethod
+    def reset() -> None:
+        """
+        Drop the snapshot so getters read the environment again.
+        """
+        Config._snapshot = None
+
     @staticmethod
     def get_chat_endpoint() -> str:
-        return os.getenv("AZURE_CHAT_AGENT_ENDPOINT",
-                         AZURE_CHAT_AGENT_ENDPOINT)
+        return Config._get("AZURE_CHAT_AGENT_ENDPOINT")
 
     @staticmethod
     def get_chat_api_key() -> str:
-        return os.getenv("AZURE_CHAT_API_KEY",
-                         AZURE_CHAT_API_KEY)
+        return Config._get("AZURE_CHAT_API_KEY")
 
     @staticmethod
     def get_search_endpoint() -> str:
-        return os.getenv("AZURE_SEARCH_ENDPOINT",
-                         AZURE_SEARCH_ENDPOINT)
+        return Config._get("AZURE_SEARCH_ENDPOINT")
 
     @staticmethod
     def get_search_api_key() -> str:
-        return os.getenv("AZURE_SEARCH_API_KEY",
-                         AZURE_SEARCH_API_KEY)
+        return Config._get("AZURE_SEARCH_API_KEY")
 
     @staticmethod
     def get_search_index_name() -> str:
-        return os.getenv("AZURE_SEARCH_INDEX_NAME",
-                         AZURE_SEARCH_INDEX_NAME)
+        return Config._get("AZURE_SEARCH_INDEX_NAME")
 
     @staticmethod
     def get_search_api_version() -> str:
-        return os.getenv("AZURE_SEARCH_API_VERSION",
-                         AZURE_SEARCH_API_VERSION)
+        return Config._get("AZURE_SEARCH_API_VERSION")
+
+    @staticmethod
+    def get_retrieval_budget() -> Optional[float]:
+        """
+        Seconds to wait for search before answering without context;
+        unset waits for the search however long it takes.
+        """
+        value = Config._get("RETRIEVAL_BUDGET_SECONDS")
+        return float(value) if value else None
+
+    @staticmethod
+    def get_local_search_index_path() -> Optional[str]:
+        """
+        Local BM25 index file; when set it replaces Azure AI Search.
+        """
+        return Config._get("LOCAL_SEARCH_INDEX_PATH")
+
+    @staticmethod
+    def get_search_top_k() -> int:
+        """
+        Search hits packed into the prompt.
+        """
+        value = Config._get("SEARCH_TOP_K")
+        return int(value) if value else 5
+
+    @staticmethod
+    def get_rerank_vectors_path() -> Optional[str]:
+        """
+        Prefix of precomputed document vectors (`<prefix>.npy`); when set,
+        search candidates are re-ranked before packing.
+        """
+        return Config._get("RERANK_VECTORS_PATH")
+
+    @staticmethod
+    def get_rerank_candidates() -> int:
+        value = Config._get("RERANK_CANDIDATES")
+        return int(value) if value else 50
+
+    @staticmethod
+    def get_context_token_budget() -> Optional[int]:
+        """
+        Total prompt plus answer tokens per request; when set, context is
+        packed to fit it instead of the character cap.
+        """
+        value = Config._get("CONTEXT_TOKEN_BUDGET")
+        return int(value) if value else None
+
+    @staticmethod
+    def get_conversation_store_path() -> Optional[str]:
+        """
+        SQLite file for conversation history; in memory when unset.
+        """
+        return Config._get("CONVERSATION_STORE_PATH")
+
+    @staticmethod
+    def get_conversation_max_count() -> int:
+        value = Config._get("CONVERSATION_MAX_COUNT")
+        return int(value) if value else 1000
+
+    @staticmethod
+    def get_conversation_idle_seconds() -> float:
+        value = Config._get("CONVERSATION_IDLE_SECONDS")
+        return float(value) if value else 1800.0
+
+    @staticmethod
+    def get_search_cache_ttl() -> Optional[float]:
+        """
+        Seconds a cached search result stays valid; unset disables the
+        search cache.
+        """
+        value = Config._get("SEARCH_CACHE_TTL_SECONDS")
+        return float(value) if value else None
+
+    @staticmethod
+    def get_search_cache_max_entries() -> int:
+        value = Config._get("SEARCH_CACHE_MAX_ENTRIES")
+        return int(value) if value else 256
+
+    @staticmethod
+    def get_search_cache_path() -> Optional[str]:
+        """
+        SQLite file for the on-disk search cache; unset keeps the cache
+        in memory.
+        """
+        return Config._get("SEARCH_CACHE_PATH")
+
+    @staticmethod
+    def get_answer_cache_ttl() -> Optional[float]:
+        """
+        Seconds a cached reply is served as fresh; unset disables the
+        answer cache.
+        """
+        value = Config._get("ANSWER_CACHE_TTL_SECONDS")
+        return float(value) if value else None
+
+    @staticmethod
+    def get_answer_cache_stale() -> float:
+        """
+        Extra seconds a stale reply may be served while it is refreshed.
+        """
+        value = Config._get("ANSWER_CACHE_STALE_SECONDS")
+        return float(value) if value else 0.0
+
+    @staticmethod
+    def get_answer_cache_max_entries() -> int:
+        value = Config._get("ANSWER_CACHE_MAX_ENTRIES")
+        return int(value) if value else 128
+
+    @staticmethod
+    def get_metrics_endpoint_enabled() -> bool:
+        """
+        Whether the metrics function serves the in-process histograms.
+        """
+        value = Config._get("METRICS_ENDPOINT_ENABLED")
+        return (value or "").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_metrics_log_requests() -> bool:
+        """
+        Whether each chat request logs one structured metrics line; on
+        unless set to a false value.
+        """
+        value = Config._get("METRICS_LOG_REQUESTS")
+        return (value or "true").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_outbound_retry_attempts() -> int:
+        """
+        Attempts per search or chat call, the first one included.
+        """
+        value = Config._get("OUTBOUND_RETRY_ATTEMPTS")
+        return int(value) if value else 3
+
+    @staticmethod
+    def get_search_connect_timeout() -> float:
+        value = Config._get("SEARCH_CONNECT_TIMEOUT_SECONDS")
+        return float(value) if value else 3.05
+
+    @staticmethod
+    def get_search_read_timeout() -> float:
+        value = Config._get("SEARCH_READ_TIMEOUT_SECONDS")
+        return float(value) if value else 10.0
+
+    @staticmethod
+    def get_search_deadline() -> float:
+        """
+        Seconds a search may take in all, retries and backoff included.
+        """
+        value = Config._get("SEARCH_DEADLINE_SECONDS")
+        return float(value) if value else 10.0
+
+    @staticmethod
+    def get_chat_connect_timeout() -> float:
+        value = Config._get("CHAT_CONNECT_TIMEOUT_SECONDS")
+        return float(value) if value else 3.05
+
+    @staticmethod
+    def get_chat_read_timeout() -> float:
+        value = Config._get("CHAT_READ_TIMEOUT_SECONDS")
+        return float(value) if value else 30.0
+
+    @staticmethod
+    def get_search_hedge_percentile() -> Optional[float]:
+        """
+        Latency percentile (e.g. 0.95) after which a second search is
+        sent; unset disables hedging.
+        """
+        value = Config._get("SEARCH_HEDGE_PERCENTILE")
+        return float(value) if value else None
+
+    @staticmethod
+    def get_circuit_failure_threshold() -> int:
+        """
+        Consecutive failed calls that open an endpoint's circuit breaker.
+        """
+        value = Config._get("CIRCUIT_FAILURE_THRESHOLD")
+        return int(value) if value else 5
+
+    @staticmethod
+    def get_circuit_reset_seconds() -> float:
+        """
+        Seconds an open breaker skips calls before trying again.
+        """
+        value = Config._get("CIRCUIT_RESET_SECONDS")
+        return float(value) if value else 30.0
+
+    @staticmethod
+    def get_batch_max_items() -> int:
+        """
+        Questions accepted by one batch request; at 4 chat calls at a
+        time, 100 typical questions are answered well within the 230 s
+        an Azure HTTP trigger may take.
+        """
+        value = Config._get("BATCH_MAX_ITEMS")
+        return int(value) if value else 100
+
+    @staticmethod
+    def get_batch_deadline() -> float:
+        """
+        Seconds a batch request may spend answering before the questions
+        left are reported as errors; kept under Azure's 230 s limit.
+        """
+        value = Config._get("BATCH_DEADLINE_SECONDS")
+        return float(value) if value else 200.0
+
+    @staticmethod
+    def get_batch_search_concurrency() -> int:
+        value = Config._get("BATCH_SEARCH_CONCURRENCY")
+        return int(value) if value else 4
+
+    @staticmethod
+    def get_batch_chat_concurrency() -> int:
+        value = Config._get("BATCH_CHAT_CONCURRENCY")
+        return int(value) if value else 4
+
+    @staticmethod
+    def get_search_semantic_select() -> Tuple[str, ...]:
+        """
+        Fields fetched by semantic searches, comma-separated in
+        SEARCH_SELECT; unset or "*" fetches every field.
+        """
+        value = Config._get("SEARCH_SELECT")
+        if not value or value.strip() == "*":
+            return ()
+        return tuple(f.strip() for f in value.split(",") if f.strip())
+
+    @staticmethod
+    def get_coalesce_wait_seconds() -> float:
+        """
+        Seconds a request waits on an identical in-flight search or
+        completion before calling on its own; 0 disables coalescing.
+        """
+        value = Config._get("COALESCE_WAIT_SECONDS")
+        return float(value) if value else 30.0
+
+    @staticmethod
+    def get_query_router_enabled() -> bool:
+        """
+        Skip the search for small talk and general questions and size
+        `top_k` per message (default off).
+        """
+        value = Config._get("QUERY_ROUTER_ENABLED")
+        return (value or "false").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_router_model_path() -> Optional[str]:
+        return Config._get("ROUTER_MODEL_PATH")
+
+    @staticmethod
+    def get_system_prompt_path() -> Optional[str]:
+        """
+        Text file replacing the built-in assistant instructions.
+        """
+        return Config._get("SYSTEM_PROMPT_PATH")
+
+    @staticmethod
+    def get_admission_enabled() -> bool:
+        """
+        Rate limit and queue chat requests before they reach the search
+        and chat endpoints (default off).
+        """
+        value = Config._get("ADMISSION_ENABLED")
+        return (value or "false").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_admission_rate_per_minute() -> float:
+        """
+        Sustained requests per minute for each client IP and each
+        conversation.
+        """
+        value = Config._get("ADMISSION_RATE_PER_MINUTE")
+        return float(value) if value else 20.0
+
+    @staticmethod
+    def get_admission_burst() -> int:
+        value = Config._get("ADMISSION_BURST")
+        return int(value) if value else 10
+
+    @staticmethod
+    def get_admission_max_in_flight() -> int:
+        """
+        Chat requests a worker answers at the same time.
+        """
+        value = Config._get("ADMISSION_MAX_IN_FLIGHT")
+        return int(value) if value else 16
+
+    @staticmethod
+    def get_admission_max_queue() -> int:
+        value = Config._get("ADMISSION_MAX_QUEUE")
+        return int(value) if value else 32
+
+    @staticmethod
+    def get_admission_queue_timeout() -> float:
+        value = Config._get("ADMISSION_QUEUE_TIMEOUT_SECONDS")
+        return float(value) if value else 10.0
+
+    @staticmethod
+    def get_admission_store_path() -> Optional[str]:
+        """
+        SQLite file sharing the rate limit buckets between the worker
+        processes on a machine; in-memory when unset.
+        """
+        return Config._get("ADMISSION_STORE_PATH")
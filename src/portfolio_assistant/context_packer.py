@@ -0,0 +1,206 @@
+"""
+Token-budget-aware packing of search hits into prompt context.
+
+The budget is one total for the request, split between the system
+prompt, the retrieved context and the reserved answer tokens. Repeated
+sentences across answers/captions/documents are dropped and snippets
+are cut on sentence boundaries.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from portfolio_assistant.search_client import first_text
+
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """
+    The tiktoken encoding, loaded on first use since loading it can take
+    longer than the rest of the cold start.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # tiktoken is optional, or its data unavailable
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count from tiktoken when it is installed, otherwise the usual
+    approximation of one token per four characters.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+@dataclass(frozen=True)
+class TokenBudget:
+    """
+    Split of a request's token budget.
+
+    Args:
+        total (int): Tokens allowed for prompt plus answer.
+        answer (int): Tokens reserved for the completion (`max_tokens`).
+    """
+    total: int = 3000
+    answer: int = 256
+
+    def for_context(self, system_prompt: str = "") -> int:
+        """
+        Tokens left for context once the system prompt and answer are
+        accounted for.
+        """
+        return max(0, self.total - self.answer - count_tokens(system_prompt))
+
+
+@dataclass
+class PackResult:
+    context: str
+    citations: List[Dict]
+    tokens_used: int
+    tokens_available: int
+    tokens_candidate: int
+
+    @property
+    def tokens_saved(self) -> int:
+        """
+        Tokens of candidate text left out by deduplication and the budget.
+        """
+        return max(0, self.tokens_candidate - self.tokens_used)
+
+
+class ContextPacker:
+    """
+    Pack search hits into context that fits a TokenBudget.
+
+    Args:
+        budget (TokenBudget): Request token budget.
+        content_fields (Sequence[str]): Fallback fields when a hit has no
+            semantic answer or caption.
+    """
+    def __init__(self, budget: TokenBudget = TokenBudget(),
+                 content_fields: Sequence[str] = ("topics", "notes",
+                                                  "content")):
+        self.budget = budget
+        self.content_fields = content_fields
+
+    def _hit_text(self, d: Dict) -> Optional[str]:
+        texts = [t for t in (first_text(d.get("_answers")),
+                             first_text(d.get("_captions"))) if t]
+        if texts:
+            return " ".join(texts)
+        for f in self.content_fields:
+            v = d.get(f)
+            if isinstance(v, str) and v.strip():
+                return v
+        return None
+
+    @staticmethod
+    def _fit(sentences: List[str], limit: int) -> Tuple[str, int, int]:
+        """
+        Longest run of whole sentences within `limit` tokens; a single
+        oversized first sentence is cut at a word boundary instead.
+
+        Returns:
+            Tuple[str, int, int]: The text, its tokens and how many whole
+                sentences it holds.
+        """
+        kept: List[str] = []
+        used = 0
+        for sentence in sentences:
+            cost = count_tokens(sentence) + (1 if kept else 0)
+            if used + cost > limit:
+                break
+            kept.append(sentence)
+            used += cost
+        if kept or not sentences:
+            return " ".join(kept), used, len(kept)
+        words = sentences[0].split(" ")
+        while words and count_tokens(" ".join(words) + "...") > limit:
+            words = words[: len(words) * 3 // 4]
+        if not words:
+            return "", 0, 0
+        text = " ".join(words) + "..."
+        return text, count_tokens(text), 0
+
+    def pack(self, docs: Iterable[Dict], system_prompt: str = "",
+             reserved_tokens: int = 0) -> PackResult:
+        """
+        Args:
+            docs: Search hits with `_score`, `_answers`, `_captions`.
+            system_prompt (str): Instructions sent alongside the context.
+            reserved_tokens (int): Tokens of the rest of the prompt, such
+                as the question and earlier turns, left out of the
+                context's share.
+
+        Returns:
+            PackResult: Context and citations in the same layout as
+                SearchClient.build_context, plus token accounting.
+        """
+        available = max(0, self.budget.for_context(system_prompt) -
+                        reserved_tokens)
+        parts: List[str] = []
+        citations: List[Dict] = []
+        seen = set()
+        used = 0
+        candidate = 0
+        ranked = sorted(docs, key=lambda d: d.get("_score") or 0,
+                        reverse=True)
+        full = False
+        for i, d in enumerate(ranked, start=1):
+            text = self._hit_text(d)
+            if not text:
+                continue
+            candidate += count_tokens(text)
+            if full:
+                continue
+            sentences = []
+            keys = set()
+            for sentence in _SENTENCE.split(_WHITESPACE.sub(" ", text)):
+                sentence = sentence.strip()
+                key = sentence.lower()
+                if sentence and key not in seen and key not in keys:
+                    keys.add(key)
+                    sentences.append(sentence)
+            if not sentences:
+                continue
+            source = d.get("path") or ""
+            header = f"[{i}] Source: {source}\n"
+            remaining = available - used - count_tokens(header)
+            body, cost, kept = self._fit(sentences, remaining) \
+                if remaining > 0 else ("", 0, 0)
+            if not body:
+                full = True
+                continue
+            # only sentences actually sent count as seen; ones the budget
+            # cut may still come from a later, shorter hit
+            seen.update(s.lower() for s in sentences[:kept])
+            parts.append(header + body)
+            used += count_tokens(header) + cost
+            citations.append({
+                "label": i,
+                "id": d.get("id") or d.get("key") or d.get("document_id"),
+                "source": d.get("source") or d.get("url") or d.get("path"),
+                "score": d.get("_score"),
+            })
+        result = PackResult("\n".join(parts), citations, used, available,
+                            candidate)
+        logging.info(f"Context packed: {result.tokens_used}/"
+                     f"{result.tokens_available} tokens, "
+                     f"{result.tokens_saved} saved.")
+        return result
@@ -0,0 +1,303 @@
+"""
+Bounded conversation memory so `conversation_id` carries history.
+
+Each conversation keeps its most recent turns plus the context and
+citations retrieved for the last question, so a follow-up can reuse
+them instead of searching again. `MemoryConversationStore` keeps
+conversations in the worker; `SQLiteConversationStore` keeps them in a
+local database file. Both evict idle conversations and enforce a hard
+cap on stored text.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from portfolio_assistant.context_packer import count_tokens
+
+_WORD = re.compile(r"[A-Za-z']+")
+_FOLLOW_UP_OPENERS = ("tell me more", "more about", "more on", "say more",
+                      "can you elaborate", "elaborate", "go on", "how so")
+# Pronouns and determiners standing in for something said earlier. "she"
+# and "her" are not among them: every question is about Victoria.
+_REFERRING_WORDS = frozenset(
+    "it its that this those these they them their one ones".split())
+# Names the assistant is asked about even when typed in lower case
+_ENTITY_WORDS = frozenset(["victoria"])
+# Ids whose history is kept: client-generated random tokens such as a
+# UUID, which one visitor cannot guess to read back another's turns
+_PRIVATE_ID = re.compile(r"[A-Za-z0-9_-]{16,128}")
+_MIN_DISTINCT_CHARS = 8
+
+
+def _names_entity(words: List[str]) -> bool:
+    """
+    Whether the message names something itself: a capitalized word other
+    than the first (a project, tool, employer...) or Victoria.
+    """
+    return any(w.lower() in _ENTITY_WORDS or
+               (i > 0 and w[0].isupper() and w != "I")
+               for i, w in enumerate(words))
+
+
+def is_follow_up(message: str) -> bool:
+    """
+    Cheap check for questions that lean on the previous turn, e.g.
+    "tell me more" or "what tools did she use for that project?": an
+    explicit request for more or a referring word in a short message,
+    and no name of its own. Anything else gets a fresh search.
+    """
+    text = (message or "").strip()
+    words = _WORD.findall(text)
+    if not words or _names_entity(words):
+        return False
+    if text.lower().startswith(_FOLLOW_UP_OPENERS):
+        return True
+    return len(words) <= 10 and \
+        any(w.lower() in _REFERRING_WORDS for w in words)
+
+
+def is_private_id(conversation_id: Optional[str]) -> bool:
+    """
+    Whether `conversation_id` looks like a random token (16 to 128
+    letters, digits, "-" or "_", with at least 8 different characters)
+    rather than a guessable name such as "default", "1" or "test".
+    """
+    return bool(conversation_id) and \
+        _PRIVATE_ID.fullmatch(conversation_id) is not None and \
+        len(set(conversation_id)) >= _MIN_DISTINCT_CHARS
+
+
+@dataclass
+class Conversation:
+    turns: List[Dict] = field(default_factory=list)
+    context: str = ""
+    citations: List[Dict] = field(default_factory=list)
+
+    def size(self) -> int:
+        """
+        Approximate stored characters, used for the memory cap.
+        """
+        return len(self.context) + sum(len(t["content"])
+                                       for t in self.turns)
+
+
+def trim_history(turns: List[Dict], max_tokens: int) -> List[Dict]:
+    """
+    Most recent turns that fit `max_tokens`, oldest first. Older turns
+    are dropped whole so the model never sees half a message.
+    """
+    kept: List[Dict] = []
+    used = 0
+    for turn in reversed(turns):
+        cost = count_tokens(turn["content"]) + 4
+        if used + cost > max_tokens:
+            break
+        kept.append(turn)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def _record(conversation: Conversation, user_message: str, reply: str,
+            context: str, citations: List[Dict], max_turns: int) -> None:
+    conversation.turns.extend([{"role": "user", "content": user_message},
+                               {"role": "assistant", "content": reply}])
+    del conversation.turns[:-max_turns * 2]
+    conversation.context = context
+    conversation.citations = citations
+
+
+class MemoryConversationStore:
+    """
+    In-process conversation store with LRU eviction.
+
+    Args:
+        max_conversations (int): Conversations kept at most.
+        max_turns (int): Question/answer pairs kept per conversation.
+        idle_ttl (float): Seconds without activity before a conversation
+            is forgotten.
+        max_chars (int): Hard cap on stored text across conversations.
+    """
+    blocking = False
+
+    def __init__(self, max_conversations: int = 1000, max_turns: int = 6,
+                 idle_ttl: float = 1800.0, max_chars: int = 5_000_000):
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_chars = max_chars
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _drop(self, conversation_id: str) -> None:
+        _, conversation = self._items.pop(conversation_id)
+        self._chars -= conversation.size()
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        with self._lock:
+            item = self._items.get(conversation_id)
+            if item is None:
+                return None
+            if time.monotonic() - item[0] > self.idle_ttl:
+                self._drop(conversation_id)
+                self.evictions += 1
+                return None
+            self._items.move_to_end(conversation_id)
+            conversation = item[1]
+            return Conversation(list(conversation.turns),
+                                conversation.context,
+                                list(conversation.citations))
+
+    def append(self, conversation_id: str, user_message: str, reply: str,
+               context: str = "", citations: Optional[List[Dict]] = None
+               ) -> None:
+        with self._lock:
+            item = self._items.get(conversation_id)
+            conversation = item[1] if item else Conversation()
+            if item:
+                self._drop(conversation_id)
+            _record(conversation, user_message, reply, context,
+                    citations or [], self.max_turns)
+            self._items[conversation_id] = (time.monotonic(), conversation)
+            self._chars += conversation.size()
+            self._evict()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._items:
+            oldest_id, (touched, _) = next(iter(self._items.items()))
+            if len(self._items) > self.max_conversations or \
+               self._chars > self.max_chars or \
+               now - touched > self.idle_ttl:
+                self._drop(oldest_id)
+                self.evictions += 1
+            else:
+                break
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"conversations": len(self._items), "chars": self._chars,
+                    "evictions": self.evictions}
+
+
+class SQLiteConversationStore:
+    """
+    Conversation store in a local SQLite file, shared by the worker
+    processes on one machine and surviving restarts. Same limits as
+    MemoryConversationStore.
+    """
+    # async callers run it in an executor (utils.run_blocking)
+    blocking = True
+
+    def __init__(self, path: str, max_conversations: int = 1000,
+                 max_turns: int = 6, idle_ttl: float = 1800.0,
+                 max_chars: int = 5_000_000):
+        self.path = path
+        self.max_conversations = max_conversations
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+            "chars INTEGER NOT NULL, touched REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS conversations_touched "
+                         "ON conversations (touched)")
+        self.evictions = 0
+
+    def _read(self, conversation_id: str, now: float) -> Optional[
+                                                        Conversation]:
+        """
+        The live conversation, dropping it if idle too long; called with
+        the lock held.
+        """
+        row = self._db.execute(
+            "SELECT data, touched FROM conversations WHERE id = ?",
+            (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.idle_ttl:
+            self._db.execute("DELETE FROM conversations WHERE id = ?",
+                             (conversation_id,))
+            self.evictions += 1
+            return None
+        return Conversation(**json.loads(row[0]))
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        now = time.time()
+        with self._lock:
+            conversation = self._read(conversation_id, now)
+            if conversation is not None:
+                self._db.execute(
+                    "UPDATE conversations SET touched = ? WHERE id = ?",
+                    (now, conversation_id))
+        return conversation
+
+    def append(self, conversation_id: str, user_message: str, reply: str,
+               context: str = "", citations: Optional[List[Dict]] = None
+               ) -> None:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock before the read, so a turn
+            # appended by another thread or process in between is not
+            # overwritten
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                conversation = self._read(conversation_id, now) or \
+                    Conversation()
+                _record(conversation, user_message, reply, context,
+                        citations or [], self.max_turns)
+                data = json.dumps({"turns": conversation.turns,
+                                   "context": conversation.context,
+                                   "citations": conversation.citations})
+                self._db.execute(
+                    "INSERT OR REPLACE INTO conversations (id, data, chars, "
+                    "touched) VALUES (?, ?, ?, ?)",
+                    (conversation_id, data, conversation.size(), now))
+                self._evict(now)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float) -> None:
+        cur = self._db.execute(
+            "DELETE FROM conversations WHERE touched < ?",
+            (now - self.idle_ttl,))
+        self.evictions += max(cur.rowcount, 0)
+        count, chars = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(chars), 0) "
+            "FROM conversations").fetchone()
+        while count > self.max_conversations or chars > self.max_chars:
+            row = self._db.execute(
+                "SELECT id, chars FROM conversations ORDER BY touched "
+                "LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM conversations WHERE id = ?",
+                             (row[0],))
+            count -= 1
+            chars -= row[1]
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, chars = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chars), 0) "
+                "FROM conversations").fetchone()
+        return {"conversations": count, "chars": chars,
+                "evictions": self.evictions}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,336 @@
+"""
+Offline ingestion of a document directory into Azure AI Search upload
+batches.
+
+Each document is split on sentence boundaries into overlapping chunks
+of about `chunk_tokens` tokens. Every chunk becomes one index document
+carrying its parent's `path`, `source`, `topics` and `notes`, so search
+returns short passages instead of whole files. A manifest of file and
+chunk hashes makes re-runs incremental: unchanged files are skipped,
+and only chunks whose text changed are uploaded. Chunks a document no
+longer has are deleted. The output is one or more
+`{"value": [...]}` files in the body format of the index's
+`docs/index` API, to be POSTed in order:
+
+    python -m portfolio_assistant.ingest <docs_dir> <out_dir>
+    curl -X POST -H "api-key: $KEY" -H "Content-Type: application/json" \\
+        "$ENDPOINT/indexes/$INDEX/docs/index?api-version=$VERSION" \\
+        -d @<out_dir>/batch-0001.json
+    python -m portfolio_assistant.ingest --commit <out_dir>
+
+Until `--commit` records the batches as uploaded, the new hashes are
+kept in a pending manifest and the batch files stay in place; a re-run
+in between adds batches for further changes after the pending ones.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from portfolio_assistant.context_packer import count_tokens
+from portfolio_assistant.local_search import iter_documents
+from portfolio_assistant.search_client import clean_text
+
+MANIFEST_NAME = "manifest.json"
+PENDING_NAME = "manifest.pending.json"
+# Documents per request accepted by the Azure AI Search index API
+MAX_BATCH_SIZE = 1000
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_BATCH_FILE = re.compile(r"batch-(\d+)\.json$")
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _sentences(text: str) -> List[str]:
+    """
+    Sentences and paragraphs of `text`, whitespace collapsed.
+    """
+    return [s for s in (clean_text(part) for part in _SENTENCE.split(text))
+            if s]
+
+
+def _split_long(sentence: str, chunk_tokens: int) -> List[str]:
+    """
+    Cut a sentence longer than a whole chunk at word boundaries.
+    """
+    pieces: List[str] = []
+    words: List[str] = []
+    used = 0
+    for word in sentence.split(" "):
+        cost = count_tokens(word) + 1
+        if words and used + cost > chunk_tokens:
+            pieces.append(" ".join(words))
+            words, used = [], 0
+        words.append(word)
+        used += cost
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+
+def chunk_text(text: str, chunk_tokens: int = 300,
+               overlap_tokens: int = 50) -> List[str]:
+    """
+    Split `text` into chunks of whole sentences of at most
+    `chunk_tokens` tokens. Each chunk after the first repeats up to
+    `overlap_tokens` tokens of trailing sentences from the one before.
+
+    Raises:
+        ValueError: If the overlap is not smaller than the chunk size.
+    """
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+    units: List[Tuple[str, int]] = []
+    for sentence in _sentences(text):
+        cost = count_tokens(sentence)
+        if cost > chunk_tokens:
+            units.extend((piece, count_tokens(piece))
+                         for piece in _split_long(sentence, chunk_tokens))
+        else:
+            units.append((sentence, cost))
+
+    chunks: List[str] = []
+    current: List[Tuple[str, int]] = []
+    used = 0
+    for unit in units:
+        if current and used + unit[1] > chunk_tokens:
+            chunks.append(" ".join(s for s, _ in current))
+            # carry trailing sentences over as the next chunk's overlap
+            carried: List[Tuple[str, int]] = []
+            kept = 0
+            for previous in reversed(current):
+                if kept + previous[1] > overlap_tokens or \
+                   kept + previous[1] + unit[1] > chunk_tokens:
+                    break
+                carried.insert(0, previous)
+                kept += previous[1]
+            current, used = carried, kept
+        current.append(unit)
+        used += unit[1]
+    if current:
+        chunks.append(" ".join(s for s, _ in current))
+    return chunks
+
+
+def chunk_document(doc: Dict, chunk_tokens: int = 300,
+                   overlap_tokens: int = 50) -> Iterator[Dict]:
+    """
+    Index documents for the chunks of one document from
+    `local_search.read_document`.
+    """
+    chunks = chunk_text(doc.get("content") or "", chunk_tokens,
+                        overlap_tokens)
+    for number, text in enumerate(chunks):
+        yield {"id": f"{doc['id']}-{number}", "parent_id": doc["id"],
+               "chunk": number, "path": doc["path"],
+               "source": doc.get("source") or doc["path"],
+               "topics": doc.get("topics") or "",
+               "notes": doc.get("notes") or "", "content": text}
+
+
+class Manifest:
+    """
+    File and chunk hashes of the last ingestion run, keyed by path.
+    """
+    def __init__(self, files: Optional[Dict[str, Dict]] = None,
+                 settings: Optional[Dict] = None):
+        self.files: Dict[str, Dict] = files or {}
+        self.settings = settings or {}
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("files"), data.get("settings"))
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings, "files": self.files}, f,
+                      indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+
+def plan_actions(docs: Iterable[Dict], manifest: Manifest,
+                 chunk_tokens: int = 300, overlap_tokens: int = 50,
+                 stats: Optional[Dict[str, int]] = None) -> Iterator[Dict]:
+    """
+    Index actions bringing the index from `manifest` up to `docs`, which
+    are streamed: uploads for new or changed chunks and deletes for
+    chunks that are gone. `manifest` is updated in place.
+
+    Args:
+        docs: Documents from `local_search.iter_documents`.
+        manifest (Manifest): Hashes of the previous run.
+        chunk_tokens (int): Chunk size in tokens.
+        overlap_tokens (int): Tokens repeated between adjacent chunks.
+        stats (dict): Filled with file and chunk counts.
+    """
+    stats = stats if stats is not None else {}
+    for key in ("files", "skipped", "uploads", "deletes"):
+        stats.setdefault(key, 0)
+    settings = {"chunk_tokens": chunk_tokens,
+                "overlap_tokens": overlap_tokens}
+    if manifest.settings != settings:
+        # re-chunk every file; chunk hashes still tell what to upload
+        for entry in manifest.files.values():
+            entry["hash"] = None
+        manifest.settings = settings
+
+    seen = set()
+    for doc in docs:
+        stats["files"] += 1
+        seen.add(doc["path"])
+        previous = manifest.files.get(doc["path"], {})
+        file_hash = _sha256(json.dumps(doc, sort_keys=True))
+        if previous.get("hash") == file_hash:
+            stats["skipped"] += 1
+            continue
+        old_chunks: Dict[str, str] = previous.get("chunks", {})
+        new_chunks: Dict[str, str] = {}
+        for chunk in chunk_document(doc, chunk_tokens, overlap_tokens):
+            chunk_hash = _sha256(json.dumps(chunk, sort_keys=True))
+            new_chunks[chunk["id"]] = chunk_hash
+            if old_chunks.get(chunk["id"]) != chunk_hash:
+                stats["uploads"] += 1
+                yield dict(chunk, **{"@search.action": "mergeOrUpload"})
+        for chunk_id in sorted(old_chunks.keys() - new_chunks.keys()):
+            stats["deletes"] += 1
+            yield {"@search.action": "delete", "id": chunk_id}
+        manifest.files[doc["path"]] = {"hash": file_hash,
+                                       "chunks": new_chunks}
+
+    for path in sorted(manifest.files.keys() - seen):
+        for chunk_id in sorted(manifest.files[path]["chunks"]):
+            stats["deletes"] += 1
+            yield {"@search.action": "delete", "id": chunk_id}
+        del manifest.files[path]
+
+
+def write_batches(actions: Iterable[Dict], out_dir: str,
+                  batch_size: int = MAX_BATCH_SIZE) -> List[str]:
+    """
+    Write `actions` to `batch-0001.json`, ... files of at most
+    `batch_size` actions each, holding one batch in memory at a time.
+    Batch files already in `out_dir` are kept, and numbering continues
+    after them.
+
+    Returns:
+        List[str]: Paths of the files written.
+    """
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f"batch_size must be 1-{MAX_BATCH_SIZE}")
+    os.makedirs(out_dir, exist_ok=True)
+    start = max((int(m.group(1)) for m in map(_BATCH_FILE.match,
+                                              os.listdir(out_dir)) if m),
+                default=0)
+    paths: List[str] = []
+    batch: List[Dict] = []
+
+    def flush():
+        number = start + len(paths) + 1
+        path = os.path.join(out_dir, f"batch-{number:04d}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"value": batch}, f)
+        paths.append(path)
+
+    for action in actions:
+        batch.append(action)
+        if len(batch) == batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return paths
+
+
+def ingest(docs_dir: str, out_dir: str, chunk_tokens: int = 300,
+           overlap_tokens: int = 50, batch_size: int = MAX_BATCH_SIZE,
+           manifest_path: Optional[str] = None) -> Dict[str, int]:
+    """
+    Write upload batches for the changes in `docs_dir` since the last
+    run and record the new state in the pending manifest, next to the
+    manifest. Changes are planned from the pending manifest when there
+    is one, so batches not yet uploaded are neither lost nor repeated.
+    The pending manifest is only saved once every batch is written, so
+    an interrupted run is redone.
+
+    Returns:
+        dict: Counts of files seen and skipped, uploads, deletes and
+            batch files written.
+    """
+    manifest_path = manifest_path or os.path.join(out_dir, MANIFEST_NAME)
+    pending_path = _pending_path(manifest_path)
+    manifest = Manifest.load(pending_path if os.path.exists(pending_path)
+                             else manifest_path)
+    stats: Dict[str, int] = {}
+    actions = plan_actions(iter_documents(docs_dir), manifest,
+                           chunk_tokens, overlap_tokens, stats)
+    stats["batches"] = len(write_batches(actions, out_dir, batch_size))
+    manifest.save(pending_path)
+    logging.info(f"Ingested {docs_dir}: {stats}")
+    return stats
+
+
+def _pending_path(manifest_path: str) -> str:
+    return os.path.join(os.path.dirname(manifest_path), PENDING_NAME)
+
+
+def commit(out_dir: str, manifest_path: Optional[str] = None) -> int:
+    """
+    Record the batch files in `out_dir` as uploaded: the pending
+    manifest replaces the manifest and the batch files are removed.
+
+    Returns:
+        int: Batch files removed.
+    """
+    manifest_path = manifest_path or os.path.join(out_dir, MANIFEST_NAME)
+    pending_path = _pending_path(manifest_path)
+    if os.path.exists(pending_path):
+        os.replace(pending_path, manifest_path)
+    names = [name for name in os.listdir(out_dir) if _BATCH_FILE.match(name)]
+    for name in names:
+        os.remove(os.path.join(out_dir, name))
+    logging.info(f"Committed {len(names)} batch files in {out_dir}")
+    return len(names)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Chunk a directory of documents into Azure AI Search "
+                    "upload batches, re-processing only changed files.")
+    parser.add_argument("docs_dir", nargs="?")
+    parser.add_argument("out_dir")
+    parser.add_argument("--commit", action="store_true",
+                        help="record the batch files in out_dir as "
+                             "uploaded and remove them")
+    parser.add_argument("--chunk-tokens", type=int, default=300)
+    parser.add_argument("--overlap-tokens", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--manifest",
+                        help=f"hash manifest (default <out_dir>/"
+                             f"{MANIFEST_NAME})")
+    args = parser.parse_args(argv)
+
+    if args.commit:
+        count = commit(args.out_dir, args.manifest)
+        print(f"Committed {count} batch files under {args.out_dir}")
+        return
+    if args.docs_dir is None:
+        parser.error("docs_dir is required unless --commit is given")
+    stats = ingest(args.docs_dir, args.out_dir, args.chunk_tokens,
+                   args.overlap_tokens, args.batch_size, args.manifest)
+    print(f"{stats['files']} files ({stats['skipped']} unchanged): "
+          f"{stats['uploads']} chunks to upload, {stats['deletes']} to "
+          f"delete, in {stats['batches']} new batch files under "
+          f"{args.out_dir}; run with --commit once they are uploaded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+In-process BM25 retrieval as a drop-in alternative to Azure AI Search.
+
+The index is built offline from a directory of markdown/text documents
+and saved as one compact file: a JSON header (documents and vocabulary)
+followed by packed uint32 postings that are memory-mapped at load time,
+so a worker starts without re-parsing any documents.
+
+    python -m portfolio_assistant.local_search build <docs_dir> <index>
+    python -m portfolio_assistant.local_search query <index> "question"
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from portfolio_assistant.search_client import SearchClient
+
+MAGIC = b"PAIDX001"
+DOCUMENT_EXTENSIONS = (".md", ".markdown", ".txt")
+_TOKEN = re.compile(r"[a-z0-9]+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_FRONT_MATTER = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.S)
+_STOPWORDS = frozenset(
+    "a an and are as at be by do does for from has have how i in is it "
+    "its me of on or she that the to was what when where which who why "
+    "with you your".split())
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Lowercase word tokens with common stopwords removed.
+    """
+    return [t for t in _TOKEN.findall((text or "").lower())
+            if t not in _STOPWORDS]
+
+
+def read_document(path: str, root: str) -> Dict:
+    """
+    Load one document in the index's field layout. A leading
+    `---`-delimited block of `key: value` lines sets `topics`, `notes`
+    or `source`.
+    """
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    rel = os.path.relpath(path, root).replace(os.sep, "/")
+    doc = {"id": hashlib.sha1(rel.encode("utf-8")).hexdigest(),
+           "path": rel, "topics": "", "notes": "", "source": rel}
+    match = _FRONT_MATTER.match(text)
+    if match:
+        for line in match.group(1).splitlines():
+            key, _, value = line.partition(":")
+            if key.strip() in ("topics", "notes", "source"):
+                doc[key.strip()] = value.strip()
+        text = text[match.end():]
+    doc["content"] = text.strip()
+    return doc
+
+
+def iter_documents(root: str) -> Iterator[Dict]:
+    """
+    Walk `root` for supported documents in a stable order.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                yield read_document(path, root)
+            else:
+                logging.debug(f"Skipping unsupported document: {path}")
+
+
+def build_index(docs: Iterable[Dict], index_path: str,
+                k1: float = 1.2, b: float = 0.75) -> int:
+    """
+    Write a BM25 index for `docs` to `index_path`.
+
+    Args:
+        docs: Documents with `id`, `path`, `topics`, `notes`, `content`.
+        index_path (str): Output file.
+        k1 (float): BM25 term-frequency saturation.
+        b (float): BM25 length normalization.
+
+    Returns:
+        int: Number of documents indexed.
+    """
+    stored: List[Dict] = []
+    postings: Dict[str, List[int]] = {}
+    lengths: List[int] = []
+    for doc_id, doc in enumerate(docs):
+        tokens = tokenize(" ".join(
+            str(doc.get(f) or "") for f in ("topics", "notes", "content")))
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).extend((doc_id, tf))
+        stored.append(dict(doc))
+
+    n_docs = len(stored)
+    avgdl = (sum(lengths) / n_docs) if n_docs else 0.0
+    for doc, length in zip(stored, lengths):
+        doc["_norm"] = k1 * (1 - b + b * length / avgdl) if avgdl else k1
+    terms = {}
+    packed = array("I")
+    for term in sorted(postings):
+        pairs = postings[term]
+        df = len(pairs) // 2
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        terms[term] = [len(packed), df, idf]
+        packed.extend(pairs)
+    if packed.itemsize != 4:
+        raise RuntimeError("Unsupported platform: uint32 arrays required.")
+
+    header = json.dumps({"k1": k1, "b": b, "docs": stored,
+                         "terms": terms}).encode("utf-8")
+    # pad so the postings that follow start on a 4-byte boundary
+    header += b" " * (-len(header) % 4)
+    with open(index_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(packed.tobytes())
+    return n_docs
+
+
+class LocalSearchClient:
+    """
+    Search a local BM25 index with the same `search`/`build_context`
+    interface as SearchClient.
+    """
+    # Context packing is identical for local and remote hits
+    build_context = SearchClient.build_context
+    _extract_text = staticmethod(SearchClient._extract_text)
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._file = open(index_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Local search index is empty: {index_path}")
+        if self._map[:8] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a local search index: {index_path}")
+        (size,) = struct.unpack_from("<Q", self._map, 8)
+        header = json.loads(self._map[16:16 + size])
+        self.k1 = header["k1"]
+        self._docs: List[Dict] = header["docs"]
+        self._terms: Dict[str, List] = header["terms"]
+        self._postings = memoryview(self._map)[16 + size:].cast("I")
+        self._sentences: Dict[int, List] = {}
+
+    def close(self) -> None:
+        if getattr(self, "_postings", None) is not None:
+            self._postings.release()
+            self._postings = None
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+        self._file.close()
+
+    def _caption(self, doc_id: int, terms: Sequence[str]) -> Optional[str]:
+        """
+        Sentence of the content sharing the most terms with the query,
+        standing in for Azure's extractive captions. Sentences are split
+        once per document and kept for later queries.
+        """
+        sentences = self._sentences.get(doc_id)
+        if sentences is None:
+            sentences = [(s.strip(), s.lower()) for s in
+                         _SENTENCE.split(self._docs[doc_id].get("content")
+                                         or "") if s.strip()]
+            self._sentences[doc_id] = sentences
+        best, best_hits = None, 0
+        wanted = set(terms)
+        for sentence, lowered in sentences:
+            hits = sum(1 for t in wanted if t in lowered)
+            if hits > best_hits:
+                best, best_hits = sentence, hits
+        return best
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        select: Optional[Sequence[str]] = None,
+        filter: Optional[str] = None,
+        semantic: bool = False,
+        semantic_config: Optional[str] = None,
+    ) -> List[Dict]:
+        if filter:
+            logging.warning("Local search ignores OData filters.")
+        terms = tokenize(query)
+        scores: Dict[int, float] = {}
+        postings = self._postings
+        k1 = self.k1
+        docs = self._docs
+        for term in set(terms):
+            entry = self._terms.get(term)
+            if entry is None:
+                continue
+            offset, df, idf = entry
+            for i in range(offset, offset + 2 * df, 2):
+                doc_id, tf = postings[i], postings[i + 1]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * (
+                    tf * (k1 + 1) / (tf + docs[doc_id]["_norm"]))
+
+        items: List[Dict] = []
+        for doc_id, score in heapq.nlargest(top_k, scores.items(),
+                                            key=lambda kv: kv[1]):
+            doc = docs[doc_id]
+            d = {k: v for k, v in doc.items() if k != "_norm" and
+                 (not select or k in select)}
+            d["@search.score"] = score
+            d["_score"] = score
+            caption = self._caption(doc_id, terms) if semantic else None
+            d["_captions"] = [{"text": caption}] if caption else []
+            d["_answers"] = []
+            items.append(d)
+        return items
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Build or query a local BM25 search index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="index a directory of documents")
+    build.add_argument("docs_dir")
+    build.add_argument("index_path")
+    query = sub.add_parser("query", help="search an index")
+    query.add_argument("index_path")
+    query.add_argument("text")
+    query.add_argument("--top", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build_index(iter_documents(args.docs_dir), args.index_path)
+        print(f"Indexed {count} documents into {args.index_path}")
+    else:
+        client = LocalSearchClient(args.index_path)
+        for hit in client.search(args.text, top_k=args.top, semantic=True):
+            print(f"{hit['_score']:.3f}  {hit['path']}")
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
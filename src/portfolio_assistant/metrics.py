@@ -0,0 +1,177 @@
+"""
+Per-stage latency spans and in-process metrics for the chat pipeline.
+
+Stages are timed with `span(...)`; sizes and counters are recorded with
+`observe(...)`/`incr(...)`. Everything lands in process-wide histograms
+(p50/p95/p99 over a bounded window of recent samples) and, inside a
+`request_scope()`, in a per-request record that is logged as one JSON
+line when the request ends. Span hooks forward every span to external
+tracing without code changes:
+
+    def forward(name, seconds, attributes): ...
+    add_span_hook(forward)
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+SpanHook = Callable[[str, float, Dict], None]
+
+_request: contextvars.ContextVar = contextvars.ContextVar(
+    "portfolio_assistant_request", default=None)
+
+
+class Histogram:
+    """
+    Count, sum and percentiles over the most recent `window` samples.
+    """
+    def __init__(self, window: int = 2048):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> Dict[str, float]:
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"count": 0}
+
+        def pct(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+        return {"count": self.count, "mean": self.total / self.count,
+                "p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+                "max": ordered[-1]}
+
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of histograms, counters and span hooks.
+    """
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._hooks: List[SpanHook] = []
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.window)
+            histogram.add(value)
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def add_hook(self, hook: SpanHook) -> None:
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: SpanHook) -> None:
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def emit(self, name: str, seconds: float, attributes: Dict) -> None:
+        for hook in list(self._hooks):
+            try:
+                hook(name, seconds, attributes)
+            except Exception as e:
+                logging.warning(f"Span hook {hook!r} failed: {e}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "histograms": {name: h.snapshot() for name, h in
+                               sorted(self._histograms.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+
+def current_request() -> Optional[Dict]:
+    """
+    The record of the request being handled, if inside request_scope().
+    """
+    return _request.get()
+
+
+def observe(name: str, value: float) -> None:
+    """
+    Record a measurement (size, count, ...) in its histogram and in the
+    current request record.
+    """
+    REGISTRY.observe(name, value)
+    record = _request.get()
+    if record is not None:
+        record["values"][name] = value
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """
+    Add to a counter and to the current request record.
+    """
+    REGISTRY.incr(name, amount)
+    record = _request.get()
+    if record is not None:
+        counters = record["counters"]
+        counters[name] = counters.get(name, 0) + amount
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict]:
+    """
+    Time a pipeline stage. The yielded dict may be filled with extra
+    attributes for the span hooks.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        seconds = time.perf_counter() - start
+        REGISTRY.observe(f"{name}.seconds", seconds)
+        record = _request.get()
+        if record is not None:
+            record["spans"][name] = record["spans"].get(name, 0.0) + seconds
+        REGISTRY.emit(name, seconds, attributes)
+
+
+@contextmanager
+def request_scope(name: str = "request", log: bool = True) -> Iterator[Dict]:
+    """
+    Collect the spans, values and counters of one request and log them
+    as a single structured line when it ends.
+    """
+    record = {"name": name, "spans": {}, "values": {}, "counters": {}}
+    token = _request.set(record)
+    try:
+        with span(name):
+            yield record
+    finally:
+        _request.reset(token)
+        if log:
+            logging.info(f"request_metrics {json.dumps(record)}")
+
+
+add_span_hook = REGISTRY.add_hook
+remove_span_hook = REGISTRY.remove_hook
+snapshot = REGISTRY.snapshot
+reset = REGISTRY.reset
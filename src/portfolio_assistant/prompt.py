@@ -0,0 +1,83 @@
+"""
+Layout of the chat prompt.
+
+The instructions are sent first, as a system message of their own that
+is built once per template, so every request starts with the same bytes
+and the chat endpoint's prompt cache can reuse that prefix. The
+retrieved context, which changes with the question, follows in a second
+system message when there is any, then the earlier turns and the
+question.
+"""
+from typing import Dict, List, Sequence
+
+SYSTEM_PROMPT = ("Identity: Lenny the Portfolio Assistant, "
+                 "an AI Agent that answers questions users "
+                 "have about Victoria's professional experience, "
+                 "projects, and expertise."
+                 "Additional Instructions:"
+                 "It is permitted to request clarification from "
+                 "the user if there is very high ambiguity in the "
+                 "user message meaning or intent. "
+                 "Use only the context below to answer. "
+                 "If the answer pertains to Victoria, specifically, "
+                 "but is not in the context, specify "
+                 "that there is uncertainty about "
+                 "the response, and simply suggest contacting "
+                 "Victoria for clarification. If the question is "
+                 "basic or factual and can be reasonably answered "
+                 "from general knowledge or context, it is permitted "
+                 "to answer directly.")
+
+
+class PromptTemplate:
+    """
+    Builds the chat messages for a question around a fixed set of
+    instructions.
+
+    Args:
+        instructions (str): System prompt sent ahead of the context.
+        context_prefix (str): Text starting the context message.
+    """
+    def __init__(self, instructions: str = SYSTEM_PROMPT,
+                 context_prefix: str = "Context:\n"):
+        self.instructions = instructions
+        self.context_prefix = context_prefix
+        # Shared by every request; never modified
+        self._instructions_message = {"role": "system",
+                                      "content": instructions}
+
+    @classmethod
+    def load(cls, path: str) -> "PromptTemplate":
+        """
+        Template whose instructions are the text of the file at `path`.
+        """
+        with open(path, encoding="utf-8") as f:
+            return cls(f.read().strip())
+
+    @property
+    def static_text(self) -> str:
+        """
+        Text sent with every context besides the context itself, for
+        token budgeting.
+        """
+        return self.instructions + self.context_prefix
+
+    def messages(self, user_message: str, context: str,
+                 history: Sequence[Dict] = ()) -> List[Dict]:
+        """
+        Chat messages for `user_message`; without context the context
+        message is left out, but the instructions are still sent.
+        Args:
+            user_message (str): The user's input message.
+            context (str): Retrieved document context, may be empty.
+            history (Sequence[Dict]): Earlier user/assistant messages.
+        Returns:
+            List[Dict]: Chat messages for the completion request.
+        """
+        messages = [self._instructions_message]
+        if context:
+            messages.append({"role": "system",
+                             "content": self.context_prefix + context})
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_message})
+        return messages
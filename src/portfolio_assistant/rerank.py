@@ -0,0 +1,224 @@
+"""
+Hybrid re-ranking of search hits with precomputed document vectors.
+
+A larger candidate set from the lexical search is scored against the
+query with one batched matrix-vector product over a contiguous float32
+matrix, and the vector ranking is fused with the lexical ranking by
+reciprocal rank fusion. Requires NumPy, which is an optional dependency.
+
+Vectors are keyed by the index's key field so search hits find them:
+`build` embeds the chunks `ingest` uploads for a document directory
+(same chunk settings), and `build-jsonl` embeds documents exported from
+an existing index.
+
+    python -m portfolio_assistant.rerank build <docs_dir> <vectors_prefix>
+    python -m portfolio_assistant.rerank build-jsonl <docs.jsonl> \\
+        <vectors_prefix> --key-field <key>
+"""
+import argparse
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from portfolio_assistant.ingest import chunk_document
+from portfolio_assistant.local_search import iter_documents, tokenize
+
+try:
+    import numpy as np
+except ImportError as e:  # pragma: no cover - depends on the environment
+    raise ImportError("Re-ranking requires NumPy: pip install numpy") from e
+
+DEFAULT_FIELDS = ("topics", "notes", "content")
+
+
+class HashingEmbedder:
+    """
+    Dependency-free text embedder: word unigrams and bigrams hashed into
+    a fixed number of signed buckets, L2-normalized. Any object with the
+    same `dim` attribute and `embed` method can replace it.
+
+    Args:
+        dim (int): Vector dimension.
+    """
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        dim = self.dim
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in
+                                 zip(tokens, tokens[1:])]
+            vec = out[row]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vec[h % dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+def doc_text(doc: Dict, fields: Sequence[str] = DEFAULT_FIELDS) -> str:
+    return " ".join(str(doc.get(f) or "") for f in fields)
+
+
+class VectorStore:
+    """
+    Document vectors as one C-contiguous float32 matrix plus the ids of
+    its rows. Saved as `<prefix>.npy` and `<prefix>.ids.json`; loading
+    memory-maps the matrix.
+    """
+    def __init__(self, ids: Sequence[str], matrix: "np.ndarray",
+                 key_field: str = "id"):
+        if len(ids) != matrix.shape[0]:
+            raise ValueError("One id is required per matrix row.")
+        self.ids = list(ids)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.key_field = key_field
+        self._rows = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    @classmethod
+    def build(cls, docs: Iterable[Dict], embedder,
+              key_field: str = "id",
+              fields: Sequence[str] = DEFAULT_FIELDS) -> "VectorStore":
+        docs = list(docs)
+        matrix = embedder.embed([doc_text(d, fields) for d in docs])
+        return cls([str(d.get(key_field)) for d in docs], matrix, key_field)
+
+    def row(self, doc_id) -> Optional[int]:
+        return self._rows.get(str(doc_id))
+
+    def save(self, prefix: str) -> None:
+        np.save(f"{prefix}.npy", self.matrix)
+        with open(f"{prefix}.ids.json", "w", encoding="utf-8") as f:
+            json.dump({"key_field": self.key_field, "ids": self.ids}, f)
+
+    @classmethod
+    def load(cls, prefix: str) -> "VectorStore":
+        with open(f"{prefix}.ids.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(f"{prefix}.npy", mmap_mode="r")
+        return cls(meta["ids"], matrix, meta.get("key_field", "id"))
+
+
+class Reranker:
+    """
+    Fuse lexical and vector rankings of search hits.
+
+    Args:
+        store (VectorStore): Precomputed document vectors.
+        embedder: Embeds queries (and hits missing from the store); must
+            match the embedder the store was built with.
+        rrf_k (int): Reciprocal rank fusion constant.
+        vector_weight (float): Weight of the vector ranking in the fusion.
+    """
+    def __init__(self, store: VectorStore, embedder=None, rrf_k: int = 60,
+                 vector_weight: float = 1.0):
+        self.store = store
+        self.embedder = embedder or HashingEmbedder(store.matrix.shape[1])
+        if self.embedder.dim != store.matrix.shape[1]:
+            raise ValueError("Embedder and vector store dimensions differ.")
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+
+    def vector_scores(self, query: str, docs: Sequence[Dict]) -> "np.ndarray":
+        """
+        Cosine similarity of every candidate to the query.
+        """
+        q = self.embedder.embed([query])[0]
+        rows = [self.store.row(d.get(self.store.key_field)) for d in docs]
+        known = [i for i, r in enumerate(rows) if r is not None]
+        scores = np.zeros(len(docs), dtype=np.float32)
+        if known:
+            index = np.fromiter((rows[i] for i in known), dtype=np.intp,
+                                count=len(known))
+            scores[known] = self.store.matrix[index] @ q
+        missing = [i for i, r in enumerate(rows) if r is None]
+        if missing:
+            vectors = self.embedder.embed([doc_text(docs[i])
+                                           for i in missing])
+            scores[missing] = vectors @ q
+        return scores
+
+    def rerank(self, query: str, docs: Sequence[Dict],
+               top_k: int = 5) -> List[Dict]:
+        """
+        Args:
+            query (str): The user's question.
+            docs: Candidate hits from `search`, with `_score`.
+            top_k (int): Hits to keep.
+
+        Returns:
+            List[Dict]: Copies of the best hits, best first, whose `_score`
+                is the fused score; the search score moves to
+                `_lexical_score`.
+        """
+        docs = list(docs)
+        if not docs:
+            return []
+        n = len(docs)
+        lexical = np.fromiter((d.get("_score") or 0.0 for d in docs),
+                              dtype=np.float64, count=n)
+        vector = self.vector_scores(query, docs)
+        ranks = np.arange(1, n + 1, dtype=np.float64)
+        fused = np.zeros(n, dtype=np.float64)
+        reciprocal = 1.0 / (self.rrf_k + ranks)
+        fused[np.argsort(-lexical, kind="stable")] += reciprocal
+        fused[np.argsort(-vector, kind="stable")] += \
+            self.vector_weight * reciprocal
+        k = min(top_k, n)
+        best = np.argpartition(-fused, k - 1)[:k]
+        best = best[np.argsort(-fused[best], kind="stable")]
+        out: List[Dict] = []
+        for i in best:
+            d = dict(docs[i])
+            d["_lexical_score"] = d.get("_score")
+            d["_vector_score"] = float(vector[i])
+            d["_score"] = float(fused[i])
+            out.append(d)
+        return out
+
+
+def _read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Precompute document vectors for re-ranking.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser(
+        "build", help="embed the chunks `ingest` uploads for a directory "
+                      "of documents, keyed by their index `id`")
+    build.add_argument("docs_dir")
+    build.add_argument("prefix")
+    build.add_argument("--chunk-tokens", type=int, default=300)
+    build.add_argument("--overlap-tokens", type=int, default=50)
+    export = sub.add_parser(
+        "build-jsonl", help="embed documents exported from an existing "
+                            "index, one JSON object per line")
+    export.add_argument("documents")
+    export.add_argument("prefix")
+    export.add_argument("--key-field", required=True,
+                        help="the index's key field")
+    for command in (build, export):
+        command.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        docs = (chunk for doc in iter_documents(args.docs_dir)
+                for chunk in chunk_document(doc, args.chunk_tokens,
+                                            args.overlap_tokens))
+        key_field = "id"
+    else:
+        docs, key_field = _read_jsonl(args.documents), args.key_field
+    store = VectorStore.build(docs, HashingEmbedder(args.dim), key_field)
+    store.save(args.prefix)
+    print(f"Saved {len(store.ids)} vectors to {args.prefix}.npy")
+
+
+if __name__ == "__main__":
+    main()
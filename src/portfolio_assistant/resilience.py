@@ -0,0 +1,487 @@
+"""
+Shared policy for outbound calls to the Azure services.
+
+Each remote endpoint gets an `OutboundPolicy` combining jittered
+exponential retries that honour `Retry-After` on 429/503, a circuit
+breaker, separate connect and read timeouts, an optional deadline for
+the whole call including its retries and, optionally, hedging of
+idempotent calls that run slower than the recent latency percentile.
+
+Clients wrap one attempt as `send` and run it with `policy.call(send)`
+or `await policy.acall(send)`; `send` raises on failure (e.g. through
+`raise_for_status`). While a breaker is open, calls raise
+CircuitOpenError immediately so the caller can take its degraded path
+instead of waiting out a timeout.
+"""
+import asyncio
+import contextvars
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from portfolio_assistant import metrics
+
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+
+# Second attempts of hedged sync calls; the slower attempt is left to
+# finish on its own.
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+# monotonic time by which the policy call in progress must finish
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "outbound_deadline", default=None)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a `Retry-After` header given as seconds or as an
+    HTTP date; None when absent or unparseable.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _status(error: Exception) -> Optional[int]:
+    """
+    HTTP status carried by a requests.HTTPError or an
+    aiohttp.ClientResponseError.
+    """
+    status = getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code",
+                         None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    return parse_retry_after(headers.get("Retry-After")) if headers else None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Args:
+        attempts (int): Attempts per call, the first one included.
+        base_delay (float): Backoff before the second attempt; doubles
+            with each further attempt and is fully jittered.
+        max_delay (float): Cap on the backoff.
+        max_retry_after (float): Longest `Retry-After` honoured; a longer
+            one fails the call instead of holding the worker.
+        statuses (frozenset): HTTP statuses worth retrying.
+    """
+    attempts: int = 3
+    base_delay: float = 0.1
+    max_delay: float = 2.0
+    max_retry_after: float = 5.0
+    statuses: frozenset = RETRY_STATUSES
+
+    def delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Seconds to wait before retrying after `attempt` (0-based) failed
+        with `error`, or None to give up.
+        """
+        if attempt + 1 >= self.attempts:
+            return None
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after \
+                else None
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+
+@dataclass(frozen=True)
+class Timeouts:
+    """
+    Separate limits for opening a connection and for waiting on the
+    response, so an unreachable host fails fast while slow completions
+    still get time to finish.
+    """
+    connect: float = 3.05
+    read: float = 30.0
+    # whole-attempt limit, set from a policy deadline; aiohttp only, as
+    # requests has no such timeout and relies on the capped read timeout
+    total: Optional[float] = None
+
+    def for_requests(self) -> Tuple[float, float]:
+        return (self.connect, self.read)
+
+    def for_aiohttp(self):
+        import aiohttp
+        return aiohttp.ClientTimeout(total=self.total,
+                                     sock_connect=self.connect,
+                                     sock_read=self.read)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects
+    calls for `reset_timeout` seconds; then one trial call is let
+    through, closing the breaker on success and reopening it on failure.
+    """
+    def __init__(self, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and \
+               now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_at = None
+            # a trial abandoned without an outcome (e.g. cancelled) must
+            # not keep the breaker half-open forever
+            if self.state == "half_open" and (
+                    self._trial_at is None or
+                    now - self._trial_at >= self.reset_timeout):
+                self._trial_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self) -> bool:
+        """
+        Returns:
+            bool: Whether this failure opened the breaker.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or \
+               (self.state == "closed" and
+                    self.failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                return True
+            return False
+
+
+class OutboundPolicy:
+    """
+    Retries, circuit breaking, timeouts and hedging for one endpoint.
+
+    Args:
+        name (str): Dependency name used for metrics, e.g. "search".
+        endpoint (str): Endpoint the breaker tracks.
+        retry (RetryPolicy): Retry settings.
+        timeouts (Timeouts): Connect and read timeouts.
+        failure_threshold (int): Consecutive failed calls opening the
+            breaker.
+        reset_timeout (float): Seconds the breaker stays open.
+        hedge_percentile (float): Start a second attempt once the first
+            has run longer than this percentile of recent latencies;
+            None disables hedging. Only for idempotent calls.
+        hedge_min_samples (int): Latencies needed before hedging.
+        deadline (float): Seconds the whole call may take, retries and
+            backoff included; attempts see it through `attempt_timeouts`.
+            None leaves each attempt its full timeouts.
+    """
+    def __init__(self, name: str, endpoint: str = "",
+                 retry: RetryPolicy = RetryPolicy(),
+                 timeouts: Timeouts = Timeouts(),
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 hedge_percentile: Optional[float] = None,
+                 hedge_min_samples: int = 20,
+                 deadline: Optional[float] = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.retry = retry
+        self.timeouts = timeouts
+        self.deadline = deadline
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=200)
+        self._throttled_until = 0.0
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0,
+                       "short_circuits": 0, "failures": 0, "throttled": 0}
+
+    def _count(self, key: str) -> None:
+        self.counts[key] += 1
+        metrics.incr(f"{self.name}.{key}")
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Seconds after which a second attempt is started, or None.
+        """
+        if self.hedge_percentile is None or \
+           len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1,
+                    int(self.hedge_percentile * len(ordered)))
+        return ordered[index]
+
+    def throttle_delay(self) -> float:
+        """
+        Seconds left of the endpoint's last 429 back-off, so callers
+        sending many requests can hold new ones instead of adding load.
+        """
+        return max(0.0, self._throttled_until - time.monotonic())
+
+    def _throttle(self, error: Exception) -> None:
+        self._count("throttled")
+        wait = _retry_after(error)
+        until = time.monotonic() + (wait if wait is not None
+                                    else self.retry.max_delay)
+        self._throttled_until = max(self._throttled_until, until)
+
+    def attempt_timeouts(self) -> Timeouts:
+        """
+        Timeouts for the attempt being made: the configured ones, cut to
+        what is left of the call's deadline.
+        """
+        until = _deadline.get()
+        if until is None:
+            return self.timeouts
+        left = max(0.001, until - time.monotonic())
+        return Timeouts(min(self.timeouts.connect, left),
+                        min(self.timeouts.read, left), left)
+
+    def _start_deadline(self) -> Optional[contextvars.Token]:
+        if self.deadline is None:
+            return None
+        return _deadline.set(time.monotonic() + self.deadline)
+
+    def _admit(self) -> None:
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("short_circuits")
+            raise CircuitOpenError(f"{self.name} circuit is open for "
+                                   f"{self.endpoint}")
+
+    def _retry_delay(self, attempt: int, error: Exception,
+                     transient: Tuple[type, ...]) -> Optional[float]:
+        """
+        Backoff before the next attempt, or None after recording the
+        call's outcome with the breaker.
+        """
+        status = _status(error)
+        if status == 429:
+            self._throttle(error)
+        if status is not None:
+            retryable = status in self.retry.statuses
+            failure = status >= 500 or status == 429
+        else:
+            retryable = isinstance(error, transient)
+            failure = True
+        delay = self.retry.delay(attempt, error) if retryable else None
+        until = _deadline.get()
+        if delay is not None and until is not None and \
+           time.monotonic() + delay >= until:
+            delay = None
+        if delay is not None:
+            self._count("retries")
+            logging.warning(f"{self.name} call failed ({error}); retry "
+                            f"{attempt + 1} in {delay:.2f}s.")
+            return delay
+        if failure:
+            self._count("failures")
+            if self.breaker.record_failure():
+                metrics.incr(f"{self.name}.circuit_opened")
+                logging.error(f"{self.name} circuit opened for "
+                              f"{self.endpoint} for "
+                              f"{self.breaker.reset_timeout}s.")
+        else:
+            self.breaker.record_success()
+        return None
+
+    def _succeeded(self, started: float) -> None:
+        self._latencies.append(time.perf_counter() - started)
+        self.breaker.record_success()
+
+    def call(self, send: Callable[[], Any],
+             transient: Tuple[type, ...] = ()) -> Any:
+        """
+        Run `send` under the policy.
+
+        Args:
+            send: Performs one attempt and returns its result.
+            transient: Exception types (connection errors, timeouts)
+                worth retrying; HTTP errors are judged by status.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+        """
+        self._admit()
+        token = self._start_deadline()
+        try:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    result = self._attempt(send)
+                except Exception as e:
+                    delay = self._retry_delay(attempt, e, transient)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(started)
+                return result
+        finally:
+            if token is not None:
+                _deadline.reset(token)
+
+    def _attempt(self, send: Callable[[], Any]) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return send()
+        first = _hedge_pool.submit(contextvars.copy_context().run, send)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = _hedge_pool.submit(contextvars.copy_context().run, send)
+        done, pending = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            return pending.pop().result()
+        return winner.result()
+
+    async def acall(self, send: Callable[[], Awaitable],
+                    transient: Tuple[type, ...] = ()) -> Any:
+        """
+        Async counterpart of `call`; `send` is a coroutine function.
+        """
+        self._admit()
+        token = self._start_deadline()
+        try:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    result = await self._aattempt(send)
+                except Exception as e:
+                    delay = self._retry_delay(attempt, e, transient)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(started)
+                return result
+        finally:
+            if token is not None:
+                _deadline.reset(token)
+
+    async def _aattempt(self, send: Callable[[], Awaitable]) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await send()
+        first = asyncio.ensure_future(send())
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        self._count("hedges")
+        second = asyncio.ensure_future(send())
+        done, pending = await asyncio.wait({first, second},
+                                           return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            return await pending.pop()
+        for task in pending:
+            task.cancel()
+        return winner.result()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counts, state=self.breaker.state,
+                    consecutive_failures=self.breaker.failures,
+                    opened=self.breaker.opened,
+                    hedge_delay=self.hedge_delay(),
+                    throttle_delay=self.throttle_delay())
+
+
+_lock = threading.Lock()
+_policies: Dict[Tuple[str, str], OutboundPolicy] = {}
+_settings: Dict[str, Dict[str, Any]] = {
+    "search": {"timeouts": Timeouts(read=10.0), "deadline": 10.0},
+    "chat": {"timeouts": Timeouts(read=30.0)},
+}
+
+
+def get_policy(name: str, endpoint: str) -> OutboundPolicy:
+    """
+    Return the shared policy for `endpoint`, creating it on first use
+    with the settings configured for `name`.
+
+    Args:
+        name (str): Dependency name, "search" or "chat".
+        endpoint (str): Endpoint URL; each one has its own breaker.
+    """
+    key = (name, endpoint)
+    policy = _policies.get(key)
+    if policy is not None:
+        return policy
+    with _lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = OutboundPolicy(name, endpoint,
+                                    **_settings.get(name, {}))
+            _policies[key] = policy
+        return policy
+
+
+def configure_policy(name: str, **settings) -> None:
+    """
+    Set the OutboundPolicy arguments used for `name` and drop existing
+    policies for it so new calls pick the settings up.
+    """
+    with _lock:
+        _settings[name] = dict(_settings.get(name, {}), **settings)
+        for key in [k for k in _policies if k[0] == name]:
+            del _policies[key]
+
+
+def reset_policies() -> None:
+    """
+    Forget every policy, closing all breakers.
+    """
+    with _lock:
+        _policies.clear()
+
+
+def policy_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Breaker state and call counts of every policy, keyed by
+    "<name> <endpoint>".
+    """
+    return {f"{name} {endpoint}": policy.stats()
+            for (name, endpoint), policy in list(_policies.items())}
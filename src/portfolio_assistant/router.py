@@ -0,0 +1,209 @@
+"""
+In-process query routing: decide per message whether document retrieval
+is needed and how many hits to fetch.
+
+Greetings, thanks and small talk, and generic definition questions that
+do not mention the portfolio, are answered without a search. Broad
+questions ("list her projects") get more hits and short factual ones
+("what is her email?") fewer. Messages no rule decides go to an
+optional tiny logistic model over word tokens, trained from labelled
+messages, and otherwise to retrieval. Each decision is logged as one
+`route {...}` JSON line so the rules and the model can be tuned; the
+message text is only included at DEBUG level, when collecting examples:
+
+    python -m portfolio_assistant.router route "hi there"
+    python -m portfolio_assistant.router fit labelled.jsonl model.json
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+from portfolio_assistant import metrics
+
+_WORD = re.compile(r"[a-z0-9']+")
+_SMALL_TALK = re.compile(
+    r"^(hi|hello|hey|hiya|howdy|yo|greetings|good (morning|afternoon|"
+    r"evening)|thanks?|thank you|thx|cheers|ok(ay)?|cool|great|nice|bye|"
+    r"goodbye|see you|how are you|how's it going|what's up|who are you|"
+    r"what are you|what can you do|are you (a )?(bot|human|real))"
+    r"( (there|so much|a lot|again|today|lenny))?[\s!.?,]*$")
+_DEFINITION = re.compile(
+    r"^(what (is|are) (a|an|the)\b|what does .+ mean|define\b|"
+    r"explain (what|how)\b|how does (a|an)\b)")
+_PORTFOLIO_WORDS = frozenset(
+    "victoria she her hers portfolio project projects experience resume cv "
+    "skill skills work worked job jobs role roles career research paper "
+    "papers publication publications education degree university study "
+    "studied built build teach taught hire hiring contact email linkedin "
+    "github background".split())
+_BROAD_WORDS = frozenset(
+    "all list projects overview summary summarize summarise background "
+    "experience compare everything various examples".split())
+_NARROW_WORDS = frozenset(
+    "email contact linkedin github phone where when which website".split())
+
+
+def _words(message: str) -> Sequence[str]:
+    return _WORD.findall((message or "").lower())
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Routing decision for one message.
+
+    Args:
+        retrieve (bool): Whether to search for document context.
+        top_k (int): Hits to pack into the prompt; 0 without retrieval.
+        reason (str): Rule or model that decided, for tuning.
+    """
+    retrieve: bool
+    top_k: int
+    reason: str
+
+
+class RouterModel:
+    """
+    Logistic model over word tokens giving the probability that a
+    message needs retrieval.
+    """
+    def __init__(self, weights: Dict[str, float], bias: float = 0.0):
+        self.weights = weights
+        self.bias = bias
+
+    def predict(self, message: str) -> float:
+        score = self.bias + sum(self.weights.get(w, 0.0)
+                                for w in set(_words(message)))
+        return 1 / (1 + math.exp(-max(-30.0, min(30.0, score))))
+
+    @classmethod
+    def fit(cls, examples: Iterable[Tuple[str, bool]], epochs: int = 20,
+            learning_rate: float = 0.5, seed: int = 0) -> "RouterModel":
+        """
+        Train with stochastic gradient descent on (message, retrieve)
+        pairs.
+        """
+        data = [(set(_words(m)), 1.0 if label else 0.0)
+                for m, label in examples]
+        model = cls({}, 0.0)
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for words, label in data:
+                score = model.bias + sum(model.weights.get(w, 0.0)
+                                         for w in words)
+                error = label - 1 / (1 + math.exp(-max(-30.0,
+                                                       min(30.0, score))))
+                model.bias += learning_rate * error
+                for w in words:
+                    model.weights[w] = model.weights.get(w, 0.0) + \
+                        learning_rate * error
+        return model
+
+    @classmethod
+    def load(cls, path: str) -> "RouterModel":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["weights"], data.get("bias", 0.0))
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"bias": self.bias, "weights": self.weights}, f)
+
+
+class QueryRouter:
+    """
+    Rule-based router with an optional RouterModel fallback.
+
+    Args:
+        top_k (int): Hits for an ordinary question.
+        max_top_k (int): Hits for a broad question; defaults to twice
+            `top_k`.
+        model (RouterModel): Decides messages no rule matches.
+        threshold (float): Model probability at or above which the
+            message is retrieved for.
+        log (bool): Log each decision as a `route {...}` line.
+    """
+    def __init__(self, top_k: int = 5, max_top_k: Optional[int] = None,
+                 model: Optional[RouterModel] = None,
+                 threshold: float = 0.5, log: bool = True):
+        self.top_k = top_k
+        self.max_top_k = max_top_k or 2 * top_k
+        self.model = model
+        self.threshold = threshold
+        self.log = log
+
+    def _decide(self, message: str) -> Route:
+        text = (message or "").strip().lower()
+        words = _words(text)
+        if not words or _SMALL_TALK.match(text):
+            return Route(False, 0, "small_talk")
+        about_portfolio = any(w in _PORTFOLIO_WORDS for w in words)
+        if not about_portfolio and _DEFINITION.match(text):
+            return Route(False, 0, "general_knowledge")
+        if any(w in _BROAD_WORDS for w in words):
+            return Route(True, self.max_top_k, "broad")
+        if len(words) <= 8 and any(w in _NARROW_WORDS for w in words):
+            return Route(True, max(1, (self.top_k + 1) // 2), "narrow")
+        if about_portfolio or self.model is None:
+            return Route(True, self.top_k, "default")
+        probability = self.model.predict(text)
+        if probability >= self.threshold:
+            return Route(True, self.top_k, f"model:{probability:.2f}")
+        return Route(False, 0, f"model:{probability:.2f}")
+
+    def route(self, message: str) -> Route:
+        """
+        Decide retrieval and `top_k` for `message`, counting the decision
+        in the metrics and logging it when enabled.
+        """
+        route = self._decide(message)
+        metrics.incr("router.retrieve" if route.retrieve
+                     else "router.skip")
+        record = metrics.current_request()
+        if record is not None:
+            record["route"] = route.reason
+        if self.log:
+            entry = asdict(route)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("route " + json.dumps(
+                    dict(entry, message=(message or "")[:200])))
+            else:
+                logging.info("route " + json.dumps(entry))
+        return route
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Try the query router or train its model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    route = sub.add_parser("route", help="show the decision for a message")
+    route.add_argument("message")
+    route.add_argument("--model", help="RouterModel JSON file")
+    fit = sub.add_parser(
+        "fit", help="train a model from JSON lines with `message` and a "
+                    "boolean `retrieve`, e.g. reviewed route log lines")
+    fit.add_argument("examples")
+    fit.add_argument("model_path")
+    fit.add_argument("--epochs", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == "route":
+        model = RouterModel.load(args.model) if args.model else None
+        router = QueryRouter(model=model, log=False)
+        print(json.dumps(asdict(router.route(args.message))))
+    else:
+        with open(args.examples, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        model = RouterModel.fit(((r["message"], r["retrieve"]) for r in rows),
+                                epochs=args.epochs)
+        model.save(args.model_path)
+        print(f"Trained on {len(rows)} messages; saved {args.model_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,133 @@ Client for searching documents in Azure AI Search to build response context.
 """
 import logging
 import requests
-import re
-from typing import Iterable, List, Tuple, Sequence, Optional, Dict
+from collections.abc import Mapping
+from typing import (Any, Iterable, Iterator, List, Tuple, Sequence, Optional,
+                    Dict)
+from portfolio_assistant import metrics
+from portfolio_assistant.cache import make_key, normalize_query
+from portfolio_assistant.coalesce import SingleFlight
 from portfolio_assistant.config import Config
+from portfolio_assistant.resilience import (CircuitOpenError, OutboundPolicy,
+                                            get_policy)
+from portfolio_assistant.sessions import get_session
+
+
+_DERIVED = ("_score", "_captions", "_answers")
+
+
+class SearchHit(Mapping):
+    """
+    One search result, wrapping the hit as decoded from the response
+    instead of copying it. Reads like the dicts hits used to be, e.g.
+    `hit["id"]` or `hit.get("_score")`, with `_score`, `_captions` and
+    `_answers` taken from the `@search.*` fields.
+    """
+    __slots__ = ("fields", "score", "captions", "answers")
+
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = fields
+        self.score = fields.get("@search.score")
+        self.captions = fields.get("@search.captions") or []
+        self.answers = fields.get("@search.answers") or []
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "_score":
+            return self.score
+        if key == "_captions":
+            return self.captions
+        if key == "_answers":
+            return self.answers
+        return self.fields[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _DERIVED:
+            return self[key]
+        return self.fields.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        return key in _DERIVED or key in self.fields
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.fields
+        yield from _DERIVED
+
+    def __len__(self) -> int:
+        return len(self.fields) + len(_DERIVED)
+
+    def __repr__(self) -> str:
+        return f"SearchHit(id={self.fields.get('id')!r}, score={self.score})"
+
+
+def clean_text(text: str) -> str:
+    """
+    Collapse runs of whitespace to single spaces and trim the ends, in
+    one pass without a regular expression.
+    """
+    return " ".join(text.split())
+
+
+def first_text(items) -> Optional[str]:
+    """
+    Text of the first semantic answer or caption in `items`, if any.
+    """
+    if items and isinstance(items[0], dict):
+        return items[0].get("text")
+    return None
+
+
+def _unpack(d) -> Tuple[Dict, Any, Any, Any]:
+    """
+    Fields, answers, captions and score of a SearchHit, or of a plain
+    hit dict such as LocalSearchClient returns.
+    """
+    if isinstance(d, SearchHit):
+        return d.fields, d.answers, d.captions, d.score
+    return d, d.get("_answers"), d.get("_captions"), d.get("_score")
+
+
+def _rank(hit: Tuple) -> float:
+    return hit[3] or 0
 
 
 class SearchClient:
     """
     Handle communication with Azure AI Search.
+
+    Args:
+        semantic_select (Sequence[str]): Fields fetched by semantic
+            searches that name no `select`, plus `content` for hits that
+            come back without a caption. Empty fetches every field.
+            Defaults to Config.get_search_semantic_select().
+        coalesce_wait (float): Identical concurrent searches share one
+            call, waiting up to this many seconds for it; 0 disables
+            coalescing. Defaults to Config.get_coalesce_wait_seconds().
     """
+    _flight_class = SingleFlight
+
     def __init__(self, endpoint: str = None, index_name: str = None,
-                 api_key: str = None, api_version: str = None):
+                 api_key: str = None, api_version: str = None,
+                 session: Optional[requests.Session] = None,
+                 cache=None, policy: Optional[OutboundPolicy] = None,
+                 semantic_select: Optional[Sequence[str]] = None,
+                 coalesce_wait: Optional[float] = None):
         self.endpoint = endpoint or Config.get_search_endpoint()
         self.api_key = api_key or Config.get_search_api_key()
         self.index_name = index_name or Config.get_search_index_name()
         self.api_version = api_version or Config.get_search_api_version()
+        self._session = session
+        # Optional MemoryCache/DiskCache for search results
+        self.cache = cache
+        self._policy = policy
+        self.semantic_select = tuple(
+            semantic_select if semantic_select is not None
+            else Config.get_search_semantic_select())
+        if self.semantic_select and "content" not in self.semantic_select:
+            self.semantic_select += ("content",)
+        if coalesce_wait is None:
+            coalesce_wait = Config.get_coalesce_wait_seconds()
+        self._flight = self._flight_class("search", coalesce_wait) \
+            if coalesce_wait else None
 
         if not self.endpoint or not self.index_name or not self.api_key \
            or not self.api_version:
@@ -32,15 +144,27 @@ class SearchClient:
             "api-key": self.api_key,
         }
 
-    def search(
-        self,
-        query: str,
-        top_k: int = 5,
-        select: Optional[Sequence[str]] = None,
-        filter: Optional[str] = None,
-        semantic: bool = False,
-        semantic_config: Optional[str] = None,
-    ) -> List[Dict]:
+    @property
+    def session(self) -> requests.Session:
+        """
+        Session used for search calls; the shared "search" pool unless one
+        was passed in.
+        """
+        return self._session or get_session("search")
+
+    @property
+    def policy(self) -> OutboundPolicy:
+        """
+        Retry/breaker/timeout policy; the shared one for this endpoint
+        unless one was passed in.
+        """
+        return self._policy or get_policy("search", self.endpoint)
+
+    @staticmethod
+    def _request_body(query: str, top_k: int,
+                      select: Optional[Sequence[str]],
+                      filter: Optional[str], semantic: bool,
+                      semantic_config: Optional[str]) -> Dict:
         body: Dict = {"search": query or "*", "top": top_k}
         if select:
             body["select"] = ",".join(select)
@@ -52,22 +176,96 @@ class SearchClient:
                 body["semanticConfiguration"] = semantic_config
             body["captions"] = "extractive"
             body["answers"] = "extractive"
+        return body
+
+    def _cache_key(self, query: str, top_k: int,
+                   select: Optional[Sequence[str]], filter: Optional[str],
+                   semantic: bool, semantic_config: Optional[str]) -> str:
+        return make_key("search", self.endpoint, self.index_name,
+                        normalize_query(query), top_k,
+                        list(select) if select else None, filter, semantic,
+                        semantic_config)
+
+    def invalidate_cache(self) -> None:
+        """
+        Forget every cached result, e.g. after the index is re-indexed.
+        """
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    @staticmethod
+    def _normalize_hits(payload: Dict) -> List[SearchHit]:
+        return [SearchHit(v) for v in payload.get("value", [])]
+
+    def _select(self, select: Optional[Sequence[str]],
+                semantic: bool) -> Optional[Sequence[str]]:
+        if select is None and semantic and self.semantic_select:
+            return self.semantic_select
+        return select
+
+    def _cached_hits(self, key: str) -> Optional[List[SearchHit]]:
+        cached = self.cache.get(key)
+        metrics.incr("search_cache.hits" if cached is not None
+                     else "search_cache.misses")
+        if cached is None:
+            return None
+        logging.info("Search cache hit.")
+        return [SearchHit(fields) for fields in cached]
+
+    def _cache_hits(self, key: str, items: List[SearchHit]) -> None:
+        # the raw fields, so either cache backend can serialize them
+        self.cache.set(key, [hit.fields for hit in items])
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        select: Optional[Sequence[str]] = None,
+        filter: Optional[str] = None,
+        semantic: bool = False,
+        semantic_config: Optional[str] = None,
+    ) -> List[SearchHit]:
+        select = self._select(select, semantic)
+        key = None
+        if self.cache is not None or self._flight is not None:
+            key = self._cache_key(query, top_k, select, filter, semantic,
+                                  semantic_config)
+        if self.cache is not None:
+            cached = self._cached_hits(key)
+            if cached is not None:
+                return cached
+        body = self._request_body(query, top_k, select, filter, semantic,
+                                  semantic_config)
+        if self._flight is None:
+            return self._fetch(body, key)
+        return list(self._flight.do(key, lambda: self._fetch(body, key)))
+
+    def _fetch(self, body: Dict, key: Optional[str]) -> List[SearchHit]:
+        """
+        Run one search request, caching the hits under `key`.
+        """
         logging.info(f"Search request body: {body}")
-        try:
-            resp = requests.post(self._url, headers=self._headers,
-                                 json=body, timeout=15)
+        policy = self.policy
+
+        def send() -> List[SearchHit]:
+            timeouts = policy.attempt_timeouts()
+            resp = self.session.post(self._url, headers=self._headers,
+                                     json=body,
+                                     timeout=timeouts.for_requests())
             resp.raise_for_status()
-            payload = resp.json()
-            values = payload.get("value", [])
-            items: List[Dict] = []
-            for v in values:
-                d = dict(v)
-                d["_score"] = v.get("@search.score")
-                d["_captions"] = v.get("@search.captions", [])
-                d["_answers"] = v.get("@search.answers", [])
-                items.append(d)
+            return self._normalize_hits(resp.json())
+
+        try:
+            items = policy.call(send, transient=(requests.ConnectionError,
+                                                 requests.Timeout))
+            if self.cache is not None:
+                self._cache_hits(key, items)
             return items
+        except CircuitOpenError as e:
+            logging.warning(f"Skipping search: {e}")
+            return []
         except requests.RequestException as e:
+            metrics.incr("search.errors")
             logging.error(f"Search request failed: {e}")
             return []
 
@@ -81,26 +279,24 @@ class SearchClient:
         citations: List[Dict] = []
         total = 0
 
-        sorted_results = sorted(docs, key=lambda d: d.get("_score", 0),
-                                reverse=True)
-        logging.info(f"Top search results: {sorted_results[:3]}")
-        for i, d in enumerate(sorted_results, start=1):
-            answer_text = (d.get("_answers")[0]["text"] if
-                           d.get("_answers") and
-                           isinstance(d.get("_answers")[0], dict) and
-                           "text" in d.get("_answers")[0] else None)
-            caption_text = (d.get("_captions")[0]["text"] if
-                            d.get("_captions") and
-                            isinstance(d.get("_captions")[0], dict) and
-                            "text" in d.get("_captions")[0] else None)
-            texts = [t for t in [answer_text, caption_text] if t]
-            text = " | ".join(texts) if texts else self._extract_text(
-                   d, content_fields) or None
+        sorted_results = sorted(map(_unpack, docs), key=_rank, reverse=True)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            top = [(d.get("id"), d.get("path"), score)
+                   for d, _, _, score in sorted_results[:3]]
+            logging.debug(f"Top search results: {top}")
+        for i, (d, answers, captions, score) in enumerate(
+                sorted_results, start=1):
+            answer_text = first_text(answers)
+            caption_text = first_text(captions)
+            if answer_text and caption_text:
+                text = f"{answer_text} | {caption_text}"
+            else:
+                text = answer_text or caption_text or self._extract_text(
+                    d, content_fields)
             if not text:
                 continue
             source = d.get("path") or ""
-            clean_text = re.sub(r"\s+", " ", text).strip()
-            snippet = f"Source: {source}\n{clean_text}"
+            snippet = f"Source: {source}\n{clean_text(text)}"
             if total + len(snippet) > max_chars:
                 snippet = f"{snippet[: max(0, max_chars - total)]}..."
             if not snippet:
@@ -110,7 +306,7 @@ class SearchClient:
                 "label": i,
                 "id": d.get("id") or d.get("key") or d.get("document_id"),
                 "source": d.get("source") or d.get("url") or d.get("path"),
-                "score": d.get("_score"),
+                "score": score,
             })
             total += len(snippet)
             if total >= max_chars:
@@ -0,0 +1,139 @@
+"""
+Process-wide pooled HTTP sessions shared by the outbound clients.
+
+A single `requests.Session` (or `aiohttp.ClientSession` for the async
+clients) per worker keeps TCP/TLS connections to the Azure endpoints
+alive between chat turns instead of paying a fresh handshake on every
+call.
+"""
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Optional
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_async_sessions: Dict[str, Any] = {}
+_settings = {
+    "pool_connections": DEFAULT_POOL_CONNECTIONS,
+    "pool_maxsize": DEFAULT_POOL_MAXSIZE,
+    "pool_block": False,
+}
+
+
+def _new_session() -> requests.Session:
+    """
+    Build a session whose adapters use the current pool settings.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=_settings["pool_connections"],
+                          pool_maxsize=_settings["pool_maxsize"],
+                          pool_block=_settings["pool_block"])
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_session(name: str = "default") -> requests.Session:
+    """
+    Return the shared session registered under `name`, creating it on
+    first use.
+
+    Args:
+        name (str): Pool name, e.g. "chat" or "search", so each remote
+            service gets its own connection pool.
+
+    Returns:
+        requests.Session: Session that lives as long as the worker.
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _new_session()
+            _sessions[name] = session
+        return session
+
+
+def get_async_session(name: str = "default"):
+    """
+    Return the shared `aiohttp.ClientSession` registered under `name` for
+    the running event loop, creating it on first use.
+
+    Must be called from inside a coroutine. A session left over from a
+    different (or closed) loop is replaced.
+
+    Args:
+        name (str): Pool name, e.g. "chat" or "search".
+
+    Returns:
+        aiohttp.ClientSession: Session backed by a keep-alive connector.
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    owner, session = _async_sessions.get(name, (None, None))
+    if session is not None and not session.closed and owner is loop:
+        return session
+    connector = aiohttp.TCPConnector(
+        limit=_settings["pool_maxsize"] * _settings["pool_connections"],
+        limit_per_host=_settings["pool_maxsize"],
+        keepalive_timeout=30,
+    )
+    session = aiohttp.ClientSession(connector=connector)
+    _async_sessions[name] = (loop, session)
+    return session
+
+
+async def close_async_sessions() -> None:
+    """
+    Close every shared async session; call before the event loop ends.
+    """
+    sessions = [session for _, session in _async_sessions.values()]
+    _async_sessions.clear()
+    for session in sessions:
+        if not session.closed:
+            await session.close()
+
+
+def configure_sessions(pool_connections: Optional[int] = None,
+                       pool_maxsize: Optional[int] = None,
+                       pool_block: Optional[bool] = None) -> None:
+    """
+    Change the adapter pool settings and drop existing sessions so the
+    next `get_session` call picks the new settings up.
+
+    Args:
+        pool_connections (int): Number of host pools to cache.
+        pool_maxsize (int): Maximum connections kept alive per host.
+        pool_block (bool): Block when the pool is exhausted instead of
+            opening throwaway connections.
+    """
+    with _lock:
+        if pool_connections is not None:
+            _settings["pool_connections"] = pool_connections
+        if pool_maxsize is not None:
+            _settings["pool_maxsize"] = pool_maxsize
+        if pool_block is not None:
+            _settings["pool_block"] = pool_block
+    reset_sessions()
+
+
+def reset_sessions() -> None:
+    """
+    Close and forget every shared session. Async sessions are only
+    forgotten; close them with `close_async_sessions` from their loop.
+    """
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        _async_sessions.clear()
+    for session in sessions:
+        session.close()
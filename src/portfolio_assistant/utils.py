@@ -1,8 +1,13 @@
 """
 Miscelelaneous support functions
 """
+import asyncio
+import contextvars
 import logging
 import sys
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
 
 
 def configure_logging(level: str = "INFO"):
@@ -15,3 +20,17 @@ def configure_logging(level: str = "INFO"):
         stream=sys.stdout,
     )
     return logging.getLogger("portfolio-assistant")
+
+
+async def run_blocking(owner: Any, func: Callable[..., T], *args: Any) -> T:
+    """
+    Call `func(*args)` on behalf of `owner`, a store or cache, from the
+    event loop. Unless `owner.blocking` is false (in-memory stores), the
+    call runs in the loop's default executor so SQLite locks or network
+    round trips cannot stall other requests; the caller's context
+    variables, such as the metrics request record, go along.
+    """
+    if not getattr(owner, "blocking", True):
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(
+        None, contextvars.copy_context().run, func, *args)
@@ -0,0 +1,29 @@
+"""Shared fixtures: local stub servers standing in for the Azure services"""
+import pytest
+from benchmarks.stubs import StubServer
+from portfolio_assistant.config import Config
+from portfolio_assistant.resilience import reset_policies
+from portfolio_assistant.sessions import reset_sessions
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def _fresh_sessions():
+    reset_sessions()
+    reset_policies()
+    yield
+    reset_sessions()
+    reset_policies()
+
+
+@pytest.fixture(autouse=True)
+def _fresh_config():
+    Config.reset()
+    yield
+    Config.reset()
@@ -0,0 +1,196 @@
+"""Tests for admission.py and admission control in the chat function"""
+import asyncio
+import json
+import pytest
+from portfolio_assistant import metrics
+from portfolio_assistant.admission import (AdmissionController,
+                                           AdmissionRejected,
+                                           MemoryBucketStore,
+                                           SQLiteBucketStore)
+from portfolio_assistant.sessions import close_async_sessions
+
+
+@pytest.fixture(autouse=True)
+def _fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class Request:
+    def __init__(self, body, headers=None):
+        self._body = body
+        self.headers = headers or {}
+    def get_json(self): return self._body
+    def get_body(self): return json.dumps(self._body).encode()
+
+
+def _stub_env(monkeypatch, url):
+    monkeypatch.setenv("ADMISSION_ENABLED", "true")
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", url + "/chat")
+    monkeypatch.setenv("AZURE_CHAT_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_SEARCH_ENDPOINT", url)
+    monkeypatch.setenv("AZURE_SEARCH_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_SEARCH_INDEX_NAME", "test-index")
+    monkeypatch.setenv("AZURE_SEARCH_API_VERSION", "test-version")
+
+
+def test_token_bucket_limits_and_refills():
+    store = MemoryBucketStore()
+    assert store.take(["ip:a"], rate=10.0, burst=2) == 0
+    assert store.take(["ip:a"], rate=10.0, burst=2) == 0
+    assert 0 < store.take(["ip:a"], rate=10.0, burst=2) <= 0.1
+    assert store.take(["ip:b"], rate=10.0, burst=2) == 0
+    store = MemoryBucketStore(max_keys=1)
+    store.take(["ip:a"], rate=0.001, burst=1)
+    store.take(["ip:b"], rate=0.001, burst=1)
+    # evicted buckets start full again
+    assert store.take(["ip:a"], rate=0.001, burst=1) == 0
+
+def test_rejected_take_spends_no_tokens(tmp_path):
+    stores = [MemoryBucketStore(),
+              SQLiteBucketStore(str(tmp_path / "buckets.db"))]
+    for store in stores:
+        assert store.take(["conversation:c"], rate=0.01, burst=1) == 0
+        # the empty conversation bucket must not drain the IP bucket
+        for _ in range(3):
+            assert store.take(["ip:a", "conversation:c"], rate=0.01,
+                              burst=1) > 90
+        assert store.take(["ip:a"], rate=0.01, burst=1) == 0
+    stores[1].close()
+
+def test_sqlite_buckets_shared_between_stores(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    try:
+        assert first.take(["ip:a"], rate=0.01, burst=1) == 0
+        assert second.take(["ip:a"], rate=0.01, burst=1) > 90
+    finally:
+        first.close()
+        second.close()
+
+def test_rate_limited_request_rejected():
+    controller = AdmissionController(rate_per_minute=60, burst=1)
+    async def scenario():
+        async with controller.admit(["ip:a"]):
+            pass
+        with pytest.raises(AdmissionRejected) as raised:
+            async with controller.admit(["ip:a"]):
+                pass
+        return raised.value
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == "rate_limited"
+    assert rejected.retry_after_header == "1"
+    assert controller.stats() == {"in_flight": 0, "queued": 0}
+
+def test_sqlite_store_called_off_the_loop(tmp_path):
+    store = SQLiteBucketStore(str(tmp_path / "buckets.db"))
+    controller = AdmissionController(store, rate_per_minute=60, burst=1)
+    async def scenario():
+        async with controller.admit(["ip:a"]):
+            pass
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit(["ip:a"]):
+                pass
+    try:
+        asyncio.run(scenario())
+    finally:
+        store.close()
+
+def test_admission_off_by_default(monkeypatch):
+    from portfolio_assistant.app import _build_admission, reset_clients
+    monkeypatch.delenv("ADMISSION_ENABLED", raising=False)
+    reset_clients()
+    assert _build_admission() is None
+
+def test_queue_bounds_in_flight_requests():
+    controller = AdmissionController(max_in_flight=1, max_queue=1,
+                                     queue_timeout=1.0)
+    order = []
+    async def request(name):
+        try:
+            async with controller.admit([]):
+                order.append(name)
+                await asyncio.sleep(0.05)
+        except AdmissionRejected as e:
+            order.append(e.reason)
+    async def scenario():
+        await asyncio.gather(request("first"), request("second"),
+                             request("third"))
+    asyncio.run(scenario())
+    assert order == ["first", "queue_full", "second"]
+    assert controller.stats() == {"in_flight": 0, "queued": 0}
+    counters = metrics.snapshot()["counters"]
+    assert counters["admission.queued"] == counters["admission.queue_full"] \
+        == 1
+
+def test_queue_timeout_and_cancelled_waiters_release_nothing():
+    controller = AdmissionController(max_in_flight=1, max_queue=5,
+                                     queue_timeout=0.02)
+    async def scenario():
+        async with controller.admit([]):
+            with pytest.raises(AdmissionRejected) as raised:
+                async with controller.admit([]):
+                    pass
+            assert raised.value.reason == "queue_timeout"
+            waiter = asyncio.ensure_future(controller.admit([]).__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.sleep(0)
+        async with controller.admit([]):
+            assert controller.stats() == {"in_flight": 1, "queued": 0}
+    asyncio.run(scenario())
+    assert controller.stats() == {"in_flight": 0, "queued": 0}
+
+def test_chat_function_returns_429_when_full(stub_server, monkeypatch):
+    from chat_function import main
+    from portfolio_assistant.app import reset_clients
+    stub_server.latency = 0.2
+    _stub_env(monkeypatch, stub_server.url)
+    monkeypatch.setenv("ADMISSION_MAX_IN_FLIGHT", "1")
+    monkeypatch.setenv("ADMISSION_MAX_QUEUE", "0")
+    reset_clients()
+    async def scenario():
+        try:
+            return await asyncio.gather(*(
+                main(Request({"message": f"Question {n}?"}))
+                for n in range(3)))
+        finally:
+            await close_async_sessions()
+    try:
+        responses = asyncio.run(scenario())
+    finally:
+        reset_clients()
+    assert sorted(r.status_code for r in responses) == [200, 429, 429]
+    rejected = [r for r in responses if r.status_code == 429][0]
+    assert rejected.headers["Retry-After"] == "1"
+    assert json.loads(rejected.get_body())["reason"] == "queue_full"
+    # one search and one chat call for the admitted request only
+    assert stub_server.requests == 2
+
+def test_chat_function_limits_each_client(stub_server, monkeypatch):
+    from chat_function import main
+    from portfolio_assistant.app import reset_clients
+    _stub_env(monkeypatch, stub_server.url)
+    monkeypatch.setenv("ADMISSION_RATE_PER_MINUTE", "6")
+    monkeypatch.setenv("ADMISSION_BURST", "1")
+    reset_clients()
+    async def scenario():
+        try:
+            return [await main(Request({"message": "Hi?"}, headers))
+                    for headers in ({"x-forwarded-for": "203.0.113.7:5123"},
+                                    # a spoofed first entry changes nothing
+                                    {"x-forwarded-for":
+                                     "10.9.8.7, 203.0.113.7:6001"},
+                                    {"x-forwarded-for": "198.51.100.2"},
+                                    {"x-client-ip": "198.51.100.3",
+                                     "x-forwarded-for": "198.51.100.2"})]
+        finally:
+            await close_async_sessions()
+    try:
+        responses = asyncio.run(scenario())
+    finally:
+        reset_clients()
+    assert [r.status_code for r in responses] == [200, 429, 200, 200]
+    assert 1 <= int(responses[1].headers["Retry-After"]) <= 10
+    assert metrics.snapshot()["counters"]["responses.429"] == 1
@@ -1,7 +1,12 @@
 """Tests for agent_client.py"""
+import time
 import pytest
 import requests
+from benchmarks.stubs import StubServer
 from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.cache import MemoryCache, ResponseCache
+from portfolio_assistant.context_packer import ContextPacker, TokenBudget
+from portfolio_assistant.search_client import SearchClient
 
 def test_init_with_args():
     client = AgentClient(endpoint="https://test-endpoint", api_key="test-key")
@@ -16,7 +21,7 @@ def test_ask_success(monkeypatch):
     class MockResponse:
         def raise_for_status(self): pass
         def json(self): return {"reply": "Debateable..."}
-    monkeypatch.setattr("requests.post", lambda *a, **kw: MockResponse())
+    monkeypatch.setattr("requests.Session.post", lambda *a, **kw: MockResponse())
     client = AgentClient(endpoint="https://test-endpoint", api_key="test-key")
     result = client.ask("Is anybody there?")
     assert result == {"reply": "Debateable..."}
@@ -24,7 +29,7 @@ def test_ask_success(monkeypatch):
 def test_ask_failure(monkeypatch):
     class MockResponse:
         def raise_for_status(self): raise requests.RequestException("fail")
-    monkeypatch.setattr("requests.post", lambda *a, **kw: MockResponse())
+    monkeypatch.setattr("requests.Session.post", lambda *a, **kw: MockResponse())
     client = AgentClient(endpoint="https://test-endpoint", api_key="test-key")
     result = client.ask("Is anybody there?")
     assert "error" in result
@@ -35,4 +40,123 @@ def test_init_with_env(monkeypatch):
     monkeypatch.setenv("AZURE_CHAT_API_KEY", "test-key")
     client = AgentClient()
     assert client.endpoint == "https://test-endpoint"
-    assert client.api_key == "test-key"
\ No newline at end of file
+    assert client.api_key == "test-key"
+
+class SlowSearchClient:
+    """Stands in for SearchClient with a fixed retrieval delay"""
+    def __init__(self, delay):
+        self.delay = delay
+
+    def search(self, query, **kwargs):
+        time.sleep(self.delay)
+        return [{"id": "1", "path": "/a", "_score": 1, "content": "alpha"}]
+
+    def build_context(self, docs):
+        return "[1] Source: /a\nalpha", [{"label": 1, "id": "1"}]
+
+
+class ChatResponse:
+    def raise_for_status(self): pass
+    def json(self): return {"choices": [{"message": {"content": "hi"}}]}
+
+
+def test_budgeted_ask_within_budget(monkeypatch):
+    sent = {}
+    def fake_post(self, url, json=None, **kw):
+        sent.update(json)
+        return ChatResponse()
+    monkeypatch.setattr("requests.Session.post", fake_post)
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=SlowSearchClient(0.01),
+                         retrieval_budget=1.0)
+    result = client.ask("What projects?")
+    assert result["citations"] == [{"label": 1, "id": "1"}]
+    assert "context_timeout" not in result
+    assert sent["messages"][0]["role"] == "system"
+
+def test_budgeted_ask_budget_exceeded(monkeypatch):
+    sent = {}
+    def fake_post(self, url, json=None, **kw):
+        sent.update(json)
+        return ChatResponse()
+    monkeypatch.setattr("requests.Session.post", fake_post)
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=SlowSearchClient(0.5),
+                         retrieval_budget=0.05)
+    start = time.perf_counter()
+    result = client.ask("What projects?")
+    assert time.perf_counter() - start < 0.4
+    assert result == {"reply": "hi", "context_timeout": True}
+    assert sent["messages"][1:] == [{"role": "user",
+                                     "content": "What projects?"}]
+    assert sent["messages"][0]["role"] == "system"
+
+
+def test_answer_cache_hit_same_shape(stub_server):
+    search = SearchClient(endpoint=stub_server.url, index_name="test-index",
+                          api_key="test-key", api_version="test-version")
+    client = AgentClient(endpoint=stub_server.url + "/chat",
+                         api_key="test-key", search_client=search,
+                         answer_cache=ResponseCache(MemoryCache(), ttl=60))
+    first = client.ask("What projects?")
+    second = client.ask("what projects")
+    assert first == second
+    assert set(second) == {"reply", "citations"}
+    # two searches, but only one chat completion
+    assert stub_server.requests == 3
+
+def test_answer_cache_skips_errors(monkeypatch):
+    class MockResponse:
+        def raise_for_status(self): raise requests.RequestException("fail")
+    monkeypatch.setattr("requests.Session.post", lambda *a, **kw: MockResponse())
+    cache = ResponseCache(MemoryCache(), ttl=60)
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         answer_cache=cache)
+    assert "error" in client.ask("Is anybody there?")
+    assert cache.stats()["size"] == 0
+
+def test_answer_cache_stale_while_revalidate(stub_server):
+    client = AgentClient(endpoint=stub_server.url + "/chat",
+                         api_key="test-key",
+                         answer_cache=ResponseCache(MemoryCache(), ttl=0,
+                                                    stale_ttl=60))
+    assert client.ask("Hello")["reply"] == "stub reply"
+    assert client.ask("Hello")["reply"] == "stub reply"
+    deadline = time.time() + 2
+    while stub_server.requests < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert stub_server.requests == 2
+
+
+def test_ask_stream_time_to_first_byte():
+    with StubServer(chunk_delay=0.05) as server:
+        server.responder = lambda path, body: (200, {"choices": [
+            {"message": {"content": "one two three four five six"}}]})
+        client = AgentClient(endpoint=server.url + "/chat",
+                             api_key="test-key")
+        start = time.perf_counter()
+        events = client.ask_stream("Hello")
+        assert next(events) == {"citations": []}
+        first = next(events)
+        ttfb = time.perf_counter() - start
+        rest = list(events)
+        total = time.perf_counter() - start
+    assert first == {"delta": "one"}
+    assert "".join(e["delta"] for e in [first] + rest) == \
+        "one two three four five six"
+    assert total >= 0.25
+    assert ttfb < total / 2
+
+def test_ask_stream_failure():
+    client = AgentClient(endpoint="http://127.0.0.1:9", api_key="test-key")
+    events = list(client.ask_stream("Hello"))
+    assert events[0] == {"citations": []}
+    assert "error" in events[-1]
+
+def test_context_packer_replaces_build_context():
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=SlowSearchClient(0),
+                         context_packer=ContextPacker(TokenBudget(total=600)))
+    context, citations = client._retrieve_context("alpha?")
+    assert context == "[1] Source: /a\nalpha"
+    assert citations == [{"label": 1, "id": "1", "source": "/a", "score": 1}]
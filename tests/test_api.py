@@ -1,8 +1,16 @@
 """Tests for Chat API"""
 
+import asyncio
 import json
+import os
+import subprocess
+import sys
+import pytest
 from unittest.mock import patch
 from chat_function import main
+from portfolio_assistant.app import reset_clients
+from portfolio_assistant.config import Config
+from portfolio_assistant.sessions import close_async_sessions
 
 class MockRequest:
     """Mimics HttpRequest for testing"""
@@ -15,7 +23,13 @@ class MockRequest:
     def get_body(self):
         return json.dumps(self._body).encode()
 
-@patch("portfolio_assistant.agent_client.AgentClient.ask")
+@pytest.fixture(autouse=True)
+def _fresh_clients():
+    reset_clients()
+    yield
+    reset_clients()
+
+@patch("portfolio_assistant.async_agent_client.AsyncAgentClient.ask")
 def test_api_success(mock_ask, monkeypatch):
     monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", "https://test-endpoint")
     monkeypatch.setenv("AZURE_CHAT_API_KEY", "test-key")
@@ -28,34 +42,104 @@ def test_api_success(mock_ask, monkeypatch):
     mock_ask.return_value = {"reply": "Hmmm, I hear she is pretty bad at sports!"}
 
     req = MockRequest({"message": "Is there anything Victoria can't do?"})
-    response = main(req)
+    response = asyncio.run(main(req))
     data = json.loads(response.get_body())
 
 
     assert response.status_code == 200
     assert data["reply"] == "Hmmm, I hear she is pretty bad at sports!"
 
-@patch("portfolio_assistant.agent_client.AgentClient.ask")
+@patch("portfolio_assistant.async_agent_client.AsyncAgentClient.ask")
 def test_api_error(monkeypatch):
     monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", "https://test-endpoint")
     monkeypatch.setenv("AZURE_CHAT_API_KEY", "test-key")
 
     req = MockRequest({"message": None})
-    response = main(req)
+    response = asyncio.run(main(req))
     data = json.loads(response.get_body())
 
     assert response.status_code == 400
     assert "Missing user message" in data["error"]
 
-@patch("portfolio_assistant.agent_client.AgentClient.ask")
+@patch("portfolio_assistant.async_agent_client.AsyncAgentClient.ask")
 def test_api_exception(mock_ask):
     # a little redundant since no env vars set triggers 
     # exception anyway, but...
     mock_ask.side_effect = Exception("Test error!")
 
     req = MockRequest({"message": "Trigger exception"})
-    response = main(req)
+    response = asyncio.run(main(req))
 
     assert response.status_code == 500
 
 
+def test_api_does_not_stream():
+    async def fake_ask(self, message, conversation_id):
+        return {"reply": "Hello"}
+
+    with patch("portfolio_assistant.async_agent_client."
+               "AsyncAgentClient.ask", fake_ask), \
+            patch("chat_function.get_admission", return_value=None), \
+            patch("chat_function.get_agent_client") as get_client:
+        from portfolio_assistant.async_agent_client import AsyncAgentClient
+        get_client.return_value = AsyncAgentClient(
+            endpoint="https://test-endpoint", api_key="test-key")
+        req = MockRequest({"message": "Hi", "stream": True})
+        response = asyncio.run(main(req))
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert json.loads(response.get_body()) == {"reply": "Hello"}
+
+def test_import_defers_clients():
+    code = ("import sys, chat_function; "
+            "print('aiohttp' in sys.modules, 'requests' in sys.modules)")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                         text=True, check=True, env=env).stdout
+    assert out.split() == ["False", "False"]
+
+def test_warm_up_builds_client_and_connects(stub_server, monkeypatch):
+    from portfolio_assistant.app import get_agent_client, warm_up
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", stub_server.url + "/chat")
+    monkeypatch.setenv("AZURE_CHAT_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_SEARCH_ENDPOINT", stub_server.url)
+    monkeypatch.setenv("AZURE_SEARCH_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_SEARCH_INDEX_NAME", "test-index")
+    monkeypatch.setenv("AZURE_SEARCH_API_VERSION", "test-version")
+
+    async def go():
+        await warm_up()
+        await close_async_sessions()
+    asyncio.run(go())
+    assert stub_server.connections >= 2
+    client = get_agent_client()
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", "https://elsewhere")
+    assert get_agent_client() is client
+    assert Config.get_chat_endpoint() == stub_server.url + "/chat"
+
+def test_warm_up_and_chat_share_client(stub_server, monkeypatch):
+    import warmup
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", stub_server.url + "/chat")
+    monkeypatch.setenv("AZURE_CHAT_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_SEARCH_ENDPOINT", stub_server.url)
+    monkeypatch.setenv("AZURE_SEARCH_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_SEARCH_INDEX_NAME", "test-index")
+    monkeypatch.setenv("AZURE_SEARCH_API_VERSION", "test-version")
+    from portfolio_assistant.app import get_agent_client
+    answered_by = []
+    async def fake_ask(self, message, conversation_id):
+        answered_by.append(self)
+        return {"response": "hi", "citations": []}
+
+    async def go():
+        await warmup.main(None)
+        warmed = get_agent_client()
+        with patch("portfolio_assistant.async_agent_client."
+                   "AsyncAgentClient.ask", fake_ask):
+            response = await main(MockRequest({"message": "hello"}))
+        await close_async_sessions()
+        return warmed, response
+    warmed, response = asyncio.run(go())
+    assert response.status_code == 200
+    assert answered_by == [warmed]
@@ -0,0 +1,116 @@
+"""Tests for async_agent_client.py and async_search_client.py"""
+import asyncio
+import threading
+import time
+from benchmarks.stubs import StubServer
+from portfolio_assistant import metrics
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.sessions import close_async_sessions
+
+
+def run(coro):
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await close_async_sessions()
+    return asyncio.run(wrapper())
+
+def make_client(url, **kwargs):
+    search = AsyncSearchClient(endpoint=url, index_name="test-index",
+                               api_key="test-key", api_version="test-version")
+    return AsyncAgentClient(endpoint=url + "/chat", api_key="test-key",
+                            search_client=search, **kwargs)
+
+def test_async_search_shape(stub_server):
+    client = AsyncSearchClient(endpoint=stub_server.url,
+                               index_name="test-index", api_key="test-key",
+                               api_version="test-version")
+    results = run(client.search("test"))
+    assert results[0]["id"] == "1"
+    assert results[0]["_score"] == 1.0
+    context, citations = client.build_context(results)
+    assert "Source: /a\nalpha" in context
+
+def test_disk_cache_used_off_the_loop(stub_server, tmp_path):
+    from portfolio_assistant.cache import DiskCache
+    threads = []
+    class RecordingCache(DiskCache):
+        def get(self, key):
+            threads.append(threading.get_ident())
+            return super().get(key)
+        def set(self, key, value, ttl=None):
+            threads.append(threading.get_ident())
+            super().set(key, value, ttl)
+    cache = RecordingCache(str(tmp_path / "search.db"))
+    client = AsyncSearchClient(endpoint=stub_server.url,
+                               index_name="test-index", api_key="test-key",
+                               api_version="test-version", cache=cache)
+    async def scenario():
+        with metrics.request_scope(log=False) as record:
+            first = await client.search("test")
+            second = await client.search("test")
+        return threading.get_ident(), first, second, record
+    loop_thread, first, second, record = run(scenario())
+    cache.close()
+    assert first[0]["id"] == second[0]["id"] == "1"
+    assert stub_server.requests == 1
+    assert len(threads) == 3 and loop_thread not in threads
+    assert record["counters"]["search_cache.hits"] == 1
+
+def test_async_search_failure_returns_empty():
+    client = AsyncSearchClient(endpoint="http://127.0.0.1:9",
+                               index_name="test-index", api_key="test-key",
+                               api_version="test-version")
+    assert run(client.search("test")) == []
+
+def test_async_ask_same_shape_as_sync(stub_server):
+    result = run(make_client(stub_server.url).ask("Is anybody there?"))
+    assert result == {"reply": "stub reply", "citations": [
+        {"label": 1, "id": "1", "source": "/a", "score": 1.0}]}
+
+def test_async_ask_failure():
+    client = AsyncAgentClient(endpoint="http://127.0.0.1:9", api_key="k")
+    assert "error" in run(client.ask("Is anybody there?"))
+
+def test_async_ask_budget_exceeded():
+    with StubServer(latency=0.5) as search, StubServer() as chat:
+        client = AsyncAgentClient(
+            endpoint=chat.url + "/chat", api_key="test-key",
+            search_client=AsyncSearchClient(
+                endpoint=search.url, index_name="test-index",
+                api_key="test-key", api_version="test-version"),
+            retrieval_budget=0.05)
+        result = run(client.ask("What projects?"))
+    assert result == {"reply": "stub reply", "context_timeout": True}
+
+def test_concurrent_asks_overlap():
+    with StubServer(latency=0.1) as server:
+        client = make_client(server.url)
+        n = 10
+        start = time.perf_counter()
+        async def burst():
+            return await asyncio.gather(
+                *(client.ask(f"question {i}") for i in range(n)))
+        results = run(burst())
+        elapsed = time.perf_counter() - start
+    assert all(r["reply"] == "stub reply" for r in results)
+    # serial execution would take n * 2 * 0.1s
+    assert elapsed < 0.8
+
+def test_async_ask_stream_time_to_first_byte():
+    with StubServer(chunk_delay=0.05) as server:
+        client = make_client(server.url)
+
+        async def consume():
+            start = time.perf_counter()
+            stamps = []
+            async for event in client.ask_stream("Hello"):
+                stamps.append((time.perf_counter() - start, event))
+            return stamps
+        stamps = run(consume())
+    assert stamps[0][1]["citations"][0]["id"] == "1"
+    deltas = [(t, e["delta"]) for t, e in stamps if "delta" in e]
+    assert "".join(d for _, d in deltas) == "stub reply"
+    assert deltas[0][0] < deltas[-1][0] - 0.03
@@ -0,0 +1,174 @@
+"""Tests for batch.py and the batch function"""
+import asyncio
+import json
+import time
+import pytest
+from azure.functions import HttpRequest
+from benchmarks.stubs import StubServer, default_responder
+from portfolio_assistant import metrics
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.batch import BatchRunner, ChatGate, SharedSearch
+from portfolio_assistant.resilience import OutboundPolicy
+from portfolio_assistant.sessions import close_async_sessions
+
+
+def _run(runner, messages):
+    async def scenario():
+        try:
+            return [r async for r in runner.run(
+                [{"message": m} for m in messages])]
+        finally:
+            await close_async_sessions()
+    return asyncio.run(scenario())
+
+
+class CountingResponder:
+    def __init__(self, fail_on=None):
+        self.searches = []
+        self.chats = 0
+        self.fail_on = fail_on
+
+    def __call__(self, path, body):
+        if "/docs/search" in path:
+            self.searches.append(body["search"])
+        else:
+            self.chats += 1
+            if self.fail_on and self.fail_on in json.dumps(body):
+                return 400, {"error": "bad request"}
+        return default_responder(path, body)
+
+
+def _agent(url):
+    search = AsyncSearchClient(endpoint=url, index_name="idx",
+                               api_key="key", api_version="v1")
+    return AsyncAgentClient(endpoint=url + "/chat", api_key="key",
+                            search_client=search)
+
+
+def test_batch_dedupes_and_shares_searches():
+    responder = CountingResponder()
+    with StubServer(responder) as server:
+        results = _run(BatchRunner(_agent(server.url)),
+                       ["What is Python?", "What is Python?",
+                        "what is python", "Who is Victoria?"])
+    assert sorted(r["index"] for r in results) == [0, 1, 2, 3]
+    assert all(r["reply"] == "stub reply" for r in results)
+    assert all(r["citations"][0]["source"] == "/a" for r in results)
+    # three distinct questions, two distinct searches; the near-duplicate
+    # pair gets the same context, so its completion is coalesced too
+    assert responder.chats == 2
+    assert sorted(responder.searches) == ["What is Python?",
+                                          "Who is Victoria?"]
+    counters = metrics.snapshot()["counters"]
+    assert counters["batch.shared_searches"] == 1
+    assert counters["chat.coalesced"] == 1
+
+def test_batch_reports_item_errors():
+    responder = CountingResponder(fail_on="broken")
+    with StubServer(responder) as server:
+        results = _run(BatchRunner(_agent(server.url)),
+                       ["fine question", "broken question"])
+    by_index = {r["index"]: r for r in results}
+    assert by_index[0]["reply"] == "stub reply"
+    assert "400" in by_index[1]["error"]
+
+def test_batch_deadline_reports_unanswered():
+    class SlowAgent:
+        policy = OutboundPolicy("chat")
+        search_client = None
+        async def ask(self, message, conversation_id):
+            await asyncio.sleep(0 if message == "fast" else 5)
+            return {"reply": message}
+    started = time.perf_counter()
+    results = _run(BatchRunner(SlowAgent(), deadline=0.1),
+                   ["fast", "slow", "slow"])
+    assert time.perf_counter() - started < 1
+    assert results[0] == {"index": 0, "reply": "fast"}
+    assert [r["error"] for r in results[1:]] == \
+        ["Batch deadline exceeded"] * 2
+    assert metrics.snapshot()["counters"]["batch.deadline_exceeded"] == 1
+
+def test_shared_search_limits_concurrency():
+    class SlowSearch:
+        active = peak = 0
+        async def search(self, query, **kwargs):
+            SlowSearch.active += 1
+            SlowSearch.peak = max(SlowSearch.peak, SlowSearch.active)
+            await asyncio.sleep(0.01)
+            SlowSearch.active -= 1
+            return [{"id": query}]
+    async def scenario():
+        shared = SharedSearch(SlowSearch(), concurrency=2)
+        return await asyncio.gather(*(shared.search(f"q{i}", top_k=5)
+                                      for i in range(6)))
+    results = asyncio.run(scenario())
+    assert [r[0]["id"] for r in results] == [f"q{i}" for i in range(6)]
+    assert SlowSearch.peak == 2
+
+def test_chat_gate_waits_for_rate_limit():
+    policy = OutboundPolicy("chat")
+    policy._throttled_until = time.monotonic() + 0.2
+    async def send():
+        return "ok"
+    async def scenario():
+        started = time.perf_counter()
+        assert await ChatGate(policy).acall(send) == "ok"
+        return time.perf_counter() - started
+    assert asyncio.run(scenario()) >= 0.15
+    assert metrics.snapshot()["counters"]["batch.throttle_waits"] == 1
+
+def test_429_sets_throttle():
+    with StubServer(lambda path, body: (429, {})) as server:
+        policy = OutboundPolicy("chat", server.url)
+        agent = _agent(server.url)
+        agent._policy = policy
+        agent.search_client = None
+        results = _run(BatchRunner(agent), ["hello"])
+    assert "429" in results[0]["error"]
+    assert policy.counts["throttled"] == 3
+    assert policy.throttle_delay() > 0
+
+
+@pytest.fixture
+def batch_main(monkeypatch):
+    from portfolio_assistant.app import reset_clients
+    from batch_function import main
+    reset_clients()
+    yield main
+    reset_clients()
+
+
+def _request(body):
+    return HttpRequest(method="POST", url="/api/chat/batch",
+                       body=json.dumps(body).encode())
+
+
+def test_batch_function_streams_ndjson(batch_main, stub_server,
+                                       monkeypatch):
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", stub_server.url + "/chat")
+    monkeypatch.setenv("AZURE_CHAT_API_KEY", "key")
+    monkeypatch.setenv("AZURE_SEARCH_ENDPOINT", stub_server.url)
+    monkeypatch.setenv("AZURE_SEARCH_API_KEY", "key")
+    monkeypatch.setenv("AZURE_SEARCH_INDEX_NAME", "idx")
+    monkeypatch.setenv("AZURE_SEARCH_API_VERSION", "v1")
+    async def call():
+        try:
+            return await batch_main(_request({"messages": [
+                "hi", {"id": "faq-2", "message": "who?"}]}))
+        finally:
+            await close_async_sessions()
+    response = asyncio.run(call())
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in
+             response.get_body().decode().splitlines()]
+    assert {line["index"] for line in lines} == {0, 1}
+    assert [line["id"] for line in lines if line["index"] == 1] == ["faq-2"]
+
+def test_batch_function_validates_body(batch_main, monkeypatch):
+    monkeypatch.setenv("BATCH_MAX_ITEMS", "2")
+    bad = [({}, 400), ({"messages": ["ok", {"id": 1}]}, 400),
+           ({"messages": ["a", "b", "c"]}, 413)]
+    for body, status in bad:
+        assert asyncio.run(batch_main(_request(body))).status_code == status
@@ -0,0 +1,61 @@
+"""Tests for the benchmark suite and its stub servers"""
+import copy
+import logging
+import requests
+import pytest
+from benchmarks import hits, suite
+from benchmarks.stubs import StubServer, sized_responder
+
+
+@pytest.fixture(autouse=True)
+def _quiet_logging():
+    logging.disable(logging.ERROR)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def test_stub_error_rate_and_payload_size():
+    with StubServer(sized_responder(docs=3, doc_chars=200),
+                    error_rate=0.5, seed=1) as server:
+        statuses = [requests.post(f"{server.url}/indexes/x/docs/search",
+                                  json={"top": 2}).status_code
+                    for _ in range(40)]
+        ok = requests.post(f"{server.url}/indexes/x/docs/search",
+                           json={"top": 2})
+    assert 0 < statuses.count(503) < 40
+    assert server.errors == statuses.count(503) + (ok.status_code == 503)
+    if ok.status_code == 200:
+        hits = ok.json()["value"]
+        assert len(hits) == 2
+        assert len(hits[0]["content"]) <= 200
+
+def test_suite_reports_every_scenario(monkeypatch):
+    monkeypatch.delenv("METRICS_LOG_REQUESTS", raising=False)
+    settings = suite.Settings(search_latency=0, chat_latency=0, requests=6,
+                              levels=(1, 3), allocation_requests=2)
+    report = suite.run(settings)
+    assert set(report["scenarios"]) == set(suite.SCENARIOS)
+    for result in report["scenarios"].values():
+        assert set(result["levels"]) == {"1", "3"}
+        stats = result["levels"]["3"]
+        assert stats["requests"] == 6 and stats["errors"] == 0
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        assert result["allocations"]["peak_kib"] > 0
+    assert suite.compare(report, report) == []
+
+    slower = copy.deepcopy(report)
+    slower["scenarios"]["main"]["levels"]["1"]["p95_ms"] *= 3
+    assert suite.compare(slower, report)[0].startswith("main@1: p95")
+
+def test_suite_counts_errors():
+    settings = suite.Settings(search_latency=0, chat_latency=0, requests=4,
+                              levels=(2,), allocation_requests=1,
+                              error_rate=1.0)
+    report = suite.run(settings, ["async_client"])
+    assert report["scenarios"]["async_client"]["levels"]["2"]["errors"] == 4
+
+def test_hits_microbenchmark():
+    client = hits.SearchClient(endpoint="https://bench", index_name="bench",
+                               api_key="bench", api_version="bench")
+    micros, peak_kib = hits.measure(client, hits._payload(5, 400, True), 10)
+    assert micros > 0 and peak_kib > 0
@@ -0,0 +1,87 @@
+"""Tests for cache.py"""
+import time
+import pytest
+from portfolio_assistant.cache import (MemoryCache, DiskCache, make_key,
+                                       normalize_query)
+from portfolio_assistant.search_client import SearchClient
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryCache(max_entries=2, ttl=60)
+    else:
+        disk = DiskCache(str(tmp_path / "cache.sqlite"), max_entries=2,
+                         ttl=60)
+        yield disk
+        disk.close()
+
+def test_normalize_query():
+    assert normalize_query("  What projects has Victoria done?? ") == \
+        normalize_query("what projects  has victoria done")
+
+def test_make_key_differs_by_parts():
+    assert make_key("q", 5) != make_key("q", 3)
+
+def test_get_set_and_counters(cache):
+    assert cache.get("a") is None
+    cache.set("a", [{"id": "1"}])
+    assert cache.get("a") == [{"id": "1"}]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_lru_eviction(cache):
+    cache.set("a", 1)
+    time.sleep(0.01)
+    cache.set("b", 2)
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry(cache):
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.03)
+    assert cache.get("a") is None
+
+def test_invalidate(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
+
+def test_disk_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = DiskCache(path)
+    first.set("a", {"value": 1})
+    first.close()
+    second = DiskCache(path)
+    assert second.get("a") == {"value": 1}
+    second.close()
+
+def test_search_client_uses_cache(stub_server):
+    client = SearchClient(endpoint=stub_server.url, index_name="test-index",
+                          api_key="test-key", api_version="test-version",
+                          cache=MemoryCache())
+    first = client.search("What projects?", top_k=5)
+    second = client.search("what projects", top_k=5)
+    assert first == second
+    assert stub_server.requests == 1
+    client.search("what projects", top_k=3)
+    assert stub_server.requests == 2
+    client.invalidate_cache()
+    client.search("what projects", top_k=5)
+    assert stub_server.requests == 3
+
+def test_search_client_does_not_cache_failures():
+    cache = MemoryCache()
+    client = SearchClient(endpoint="http://127.0.0.1:9",
+                          index_name="test-index", api_key="test-key",
+                          api_version="test-version", cache=cache)
+    assert client.search("test") == []
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,156 @@
+"""Tests for coalesce.py"""
+import asyncio
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.stubs import StubServer
+from portfolio_assistant import metrics
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.coalesce import AsyncSingleFlight, SingleFlight
+from portfolio_assistant.search_client import SearchClient
+from portfolio_assistant.sessions import close_async_sessions
+
+
+@pytest.fixture(autouse=True)
+def _fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_threads_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+    release = threading.Event()
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return "result"
+    with ThreadPoolExecutor(5) as pool:
+        futures = [pool.submit(flight.do, "k", slow) for _ in range(5)]
+        while metrics.snapshot()["counters"].get("test.coalesced", 0) < 4:
+            time.sleep(0.005)
+        release.set()
+        assert [f.result() for f in futures] == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.do("k", lambda: "again") == "again"
+
+def test_threads_share_errors():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    def fail():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("boom")
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flight.do, "k", fail)
+        started.wait(1)
+        follower = pool.submit(flight.do, "k", lambda: "unused")
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+
+def test_thread_waiter_gives_up_after_wait():
+    flight = SingleFlight("test", wait=0.05)
+    started = threading.Event()
+    def stuck():
+        started.set()
+        time.sleep(0.5)
+        return "late"
+    with ThreadPoolExecutor(2) as pool:
+        pool.submit(flight.do, "k", stuck)
+        started.wait(1)
+        assert flight.do("k", lambda: "own") == "own"
+    assert metrics.snapshot()["counters"]["test.coalesce_timeouts"] == 1
+
+def test_async_share_errors_and_timeouts():
+    flight = AsyncSingleFlight("test", wait=0.05)
+    calls = []
+    async def slow(value, delay=0.02):
+        calls.append(value)
+        await asyncio.sleep(delay)
+        if value == "bad":
+            raise ValueError("boom")
+        return value
+    async def scenario():
+        shared = await asyncio.gather(*(flight.do("a", lambda: slow("ok"))
+                                        for _ in range(4)))
+        errors = await asyncio.gather(
+            *(flight.do("b", lambda: slow("bad")) for _ in range(2)),
+            return_exceptions=True)
+        leader = asyncio.ensure_future(
+            flight.do("c", lambda: slow("late", 0.3)))
+        await asyncio.sleep(0)
+        own = await flight.do("c", lambda: slow("own", 0))
+        leader.cancel()
+        return shared, errors, own
+    shared, errors, own = asyncio.run(scenario())
+    assert shared == ["ok"] * 4
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert own == "own"
+    assert calls == ["ok", "bad", "late", "own"]
+    counters = metrics.snapshot()["counters"]
+    assert counters["test.coalesced"] == 5
+    assert counters["test.coalesce_timeouts"] == 1
+
+def test_async_call_cancelled_with_last_waiter():
+    flight = AsyncSingleFlight("test")
+    cancelled = []
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(flight.do("k", slow), 0.02)
+        await asyncio.sleep(0)
+    asyncio.run(scenario())
+    assert cancelled == [True]
+
+def test_concurrent_identical_questions_share_calls():
+    with StubServer(latency=0.05) as server:
+        search = SearchClient(endpoint=server.url, index_name="idx",
+                              api_key="key", api_version="v1")
+        client = AgentClient(endpoint=server.url + "/chat", api_key="key",
+                             search_client=search)
+        with ThreadPoolExecutor(6) as pool:
+            results = list(pool.map(lambda _: client.ask("What is new?"),
+                                    range(6)))
+    assert all(r["reply"] == "stub reply" for r in results)
+    assert server.requests == 2
+    counters = metrics.snapshot()["counters"]
+    assert counters["search.coalesced"] == counters["chat.coalesced"] == 5
+
+def test_async_identical_questions_share_calls():
+    async def scenario(url):
+        search = AsyncSearchClient(endpoint=url, index_name="idx",
+                                   api_key="key", api_version="v1")
+        client = AsyncAgentClient(endpoint=url + "/chat", api_key="key",
+                                  search_client=search)
+        try:
+            return await asyncio.gather(*(client.ask("What is new?")
+                                          for _ in range(6)))
+        finally:
+            await close_async_sessions()
+    with StubServer(latency=0.05) as server:
+        results = asyncio.run(scenario(server.url))
+    assert all(r["reply"] == "stub reply" for r in results)
+    assert server.requests == 2
+    results[0]["reply"] = "changed"
+    assert results[1]["reply"] == "stub reply"
+
+def test_coalescing_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("COALESCE_WAIT_SECONDS", "0")
+    with StubServer(latency=0.05) as server:
+        search = SearchClient(endpoint=server.url, index_name="idx",
+                              api_key="key", api_version="v1")
+        client = AgentClient(endpoint=server.url + "/chat", api_key="key",
+                             search_client=search)
+        with ThreadPoolExecutor(3) as pool:
+            list(pool.map(lambda _: client.ask("What is new?"), range(3)))
+    assert server.requests == 6
@@ -0,0 +1,28 @@
+"""Tests for config.py"""
+import pytest
+from portfolio_assistant.config import Config
+
+
+def test_getters_read_environment(monkeypatch):
+    monkeypatch.setenv("SEARCH_TOP_K", "7")
+    assert Config.get_search_top_k() == 7
+    monkeypatch.setenv("SEARCH_TOP_K", "9")
+    assert Config.get_search_top_k() == 9
+
+def test_load_snapshots_settings(monkeypatch):
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", "https://first")
+    monkeypatch.setenv("SEARCH_TOP_K", "7")
+    Config.load()
+    monkeypatch.setenv("AZURE_CHAT_AGENT_ENDPOINT", "https://second")
+    monkeypatch.delenv("SEARCH_TOP_K")
+    assert Config.get_chat_endpoint() == "https://first"
+    assert Config.get_search_top_k() == 7
+    Config.reset()
+    assert Config.get_chat_endpoint() == "https://second"
+    assert Config.get_search_top_k() == 5
+
+def test_load_rejects_invalid_values(monkeypatch):
+    monkeypatch.setenv("RERANK_CANDIDATES", "lots")
+    with pytest.raises(ValueError, match="get_rerank_candidates"):
+        Config.load()
+    assert Config._snapshot is None
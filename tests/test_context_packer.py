@@ -0,0 +1,68 @@
+"""Tests for context_packer.py"""
+from portfolio_assistant.context_packer import (ContextPacker, TokenBudget,
+                                                count_tokens)
+
+LONG = ("Victoria built a drone swarm simulator. It ran on a GPU cluster. "
+        "The project took two years. It was published in 2021. ") * 20
+
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+    assert count_tokens("a few words here") > 0
+
+def test_budget_reserves_system_and_answer():
+    budget = TokenBudget(total=1000, answer=200)
+    assert budget.for_context("") == 800
+    assert budget.for_context("x" * 400) < 800
+
+def test_pack_matches_build_context_layout():
+    docs = [
+        {"id": "1", "path": "/a", "_score": 1, "_answers": [{"text": "answer1."}],
+         "_captions": [{"text": "caption1."}]},
+        {"id": "2", "path": "/b", "_score": 2, "_captions": [{"text": "caption2."}]},
+    ]
+    result = ContextPacker().pack(docs)
+    assert result.context == ("[1] Source: /b\ncaption2.\n"
+                              "[2] Source: /a\nanswer1. caption1.")
+    assert [c["id"] for c in result.citations] == ["2", "1"]
+
+def test_pack_dedupes_repeated_sentences():
+    docs = [
+        {"id": "1", "path": "/a", "_score": 2,
+         "_answers": [{"text": "Victoria knows Python."}],
+         "_captions": [{"text": "Victoria knows Python. She teaches."}]},
+        {"id": "2", "path": "/b", "_score": 1,
+         "_captions": [{"text": "Victoria knows Python."}]},
+    ]
+    result = ContextPacker().pack(docs)
+    assert result.context.count("Victoria knows Python.") == 1
+    assert "/b" not in result.context
+
+def test_pack_respects_budget_on_sentence_boundaries():
+    docs = [{"id": str(i), "path": f"/{i}", "_score": i, "content": LONG}
+            for i in range(5)]
+    packer = ContextPacker(TokenBudget(total=400, answer=256))
+    result = packer.pack(docs, system_prompt="Be brief.")
+    assert result.tokens_used <= result.tokens_available
+    assert count_tokens(result.context) <= result.tokens_available + 5
+    assert result.context.endswith(".")
+    assert result.tokens_saved > 0
+
+def test_pack_cuts_oversized_sentence():
+    docs = [{"id": "1", "path": "/a", "_score": 1,
+             "content": "word " * 500}]
+    result = ContextPacker(TokenBudget(total=300, answer=256)).pack(docs)
+    assert result.context.endswith("...")
+    assert result.tokens_used <= result.tokens_available
+
+def test_sentences_cut_by_budget_can_come_from_later_hits():
+    long = "Bravo " + "filler words " * 40 + "end."
+    docs = [{"id": "1", "path": "/a", "_score": 2,
+             "content": f"Short alpha. {long} Short charlie."},
+            {"id": "2", "path": "/b", "_score": 1,
+             "content": "Short charlie."}]
+    budget = count_tokens("[1] Source: /a\nShort alpha.") + \
+        count_tokens("[2] Source: /b\nShort charlie.") + 2
+    result = ContextPacker(TokenBudget(total=budget, answer=0)).pack(docs)
+    assert "Bravo" not in result.context
+    assert result.context.endswith("[2] Source: /b\nShort charlie.")
@@ -0,0 +1,217 @@
+"""Tests for conversation.py"""
+import asyncio
+import threading
+import time
+import pytest
+from benchmarks.stubs import StubServer
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.context_packer import (ContextPacker, TokenBudget,
+                                                count_tokens)
+from portfolio_assistant.conversation import (MemoryConversationStore,
+                                              SQLiteConversationStore,
+                                              is_follow_up, is_private_id,
+                                              trim_history)
+from portfolio_assistant.sessions import close_async_sessions
+
+CONVERSATION_ID = "3f2b9c4e-8a61-4d2e-9b7f-1c5a6e0d4b21"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+    def make(**kwargs):
+        if request.param == "memory":
+            store = MemoryConversationStore(**kwargs)
+        else:
+            store = SQLiteConversationStore(
+                str(tmp_path / f"conv{len(stores)}.sqlite"), **kwargs)
+        stores.append(store)
+        return store
+    yield make
+    for store in stores:
+        if hasattr(store, "close"):
+            store.close()
+
+def test_is_follow_up():
+    assert is_follow_up("Tell me more")
+    assert is_follow_up("Which languages did that project use?")
+    assert is_follow_up("can you elaborate on it?")
+    assert not is_follow_up("What projects has Victoria done?")
+    assert not is_follow_up("Where did she study?")
+    assert not is_follow_up("What is her email?")
+    assert not is_follow_up("Why did Victoria pick Python?")
+    assert not is_follow_up("why did victoria leave?")
+    assert not is_follow_up("Tell me more about the Orbit project")
+    assert not is_follow_up("")
+
+def test_trim_history_keeps_recent_whole_turns():
+    turns = [{"role": "user", "content": "x" * 400},
+             {"role": "assistant", "content": "y" * 40},
+             {"role": "user", "content": "z" * 40}]
+    assert trim_history(turns, 40) == turns[1:]
+    assert trim_history(turns, 1) == []
+
+def test_append_and_get(make_store):
+    store = make_store(max_turns=2)
+    for i in range(3):
+        store.append("c1", f"q{i}", f"a{i}", context=f"ctx{i}",
+                     citations=[{"label": i}])
+    conversation = store.get("c1")
+    assert [t["content"] for t in conversation.turns] == \
+        ["q1", "a1", "q2", "a2"]
+    assert conversation.context == "ctx2"
+    assert conversation.citations == [{"label": 2}]
+    assert store.get("missing") is None
+
+def test_lru_cap(make_store):
+    store = make_store(max_conversations=2)
+    store.append("a", "q", "r")
+    time.sleep(0.01)
+    store.append("b", "q", "r")
+    time.sleep(0.01)
+    store.get("a")
+    time.sleep(0.01)
+    store.append("c", "q", "r")
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.stats()["conversations"] == 2
+
+def test_memory_cap(make_store):
+    store = make_store(max_chars=100)
+    store.append("a", "q" * 40, "r" * 40)
+    store.append("b", "q" * 40, "r" * 40)
+    assert store.get("a") is None
+    assert store.stats()["chars"] <= 100
+
+def test_idle_eviction(make_store):
+    store = make_store(idle_ttl=0.01)
+    store.append("a", "q", "r")
+    time.sleep(0.03)
+    assert store.get("a") is None
+
+def test_sqlite_concurrent_appends_keep_every_turn(tmp_path):
+    path = str(tmp_path / "conv.sqlite")
+    stores = [SQLiteConversationStore(path, max_turns=100) for _ in range(2)]
+    def append_turns(store, worker):
+        for i in range(10):
+            store.append("c1", f"q{worker}-{i}", "a")
+    threads = [threading.Thread(target=append_turns, args=(stores[n % 2], n))
+               for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stores[0].get("c1").turns) == 80
+    for store in stores:
+        store.close()
+
+
+class CountingSearch:
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query, **kwargs):
+        self.calls += 1
+        return [{"id": "1", "path": "/a", "_score": 1, "content": "alpha"}]
+
+    def build_context(self, docs):
+        return "[1] Source: /a\nalpha", [{"label": 1, "id": "1"}]
+
+
+def test_follow_up_reuses_context(monkeypatch):
+    sent = []
+    class ChatResponse:
+        def raise_for_status(self): pass
+        def json(self): return {"choices": [{"message": {"content": "hi"}}]}
+    def fake_post(self, url, json=None, **kw):
+        sent.append(json["messages"])
+        return ChatResponse()
+    monkeypatch.setattr("requests.Session.post", fake_post)
+    search = CountingSearch()
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=search,
+                         conversation_store=MemoryConversationStore())
+    client.ask("What projects has Victoria done?", CONVERSATION_ID)
+    result = client.ask("Tell me more about it", CONVERSATION_ID)
+    assert search.calls == 1
+    assert result["citations"] == [{"label": 1, "id": "1"}]
+    assert [m["role"] for m in sent[1]] == \
+        ["system", "system", "user", "assistant", "user"]
+    # the shared default conversation has no memory
+    client.ask("What projects has Victoria done?")
+    client.ask("Tell me more about it")
+    assert search.calls == 3
+    assert [m["role"] for m in sent[3]] == ["system", "system", "user"]
+def test_is_private_id():
+    assert is_private_id(CONVERSATION_ID)
+    assert is_private_id("k9Qz2LmX_4vTb7Wp")
+    for guessable in [None, "", "default", "1", "test", "a" * 32,
+                      "0123456789" * 20, "user@example.com1234"]:
+        assert not is_private_id(guessable)
+def test_guessable_id_gets_no_history(monkeypatch):
+    class ChatResponse:
+        def raise_for_status(self): pass
+        def json(self): return {"choices": [{"message": {"content": "hi"}}]}
+    monkeypatch.setattr("requests.Session.post",
+                        lambda self, url, **kw: ChatResponse())
+    store = MemoryConversationStore()
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=CountingSearch(),
+                         conversation_store=store)
+    for conversation_id in ["1", "test", "default"]:
+        client.ask("What projects has Victoria done?", conversation_id)
+        assert store.get(conversation_id) is None
+def test_history_counts_against_context_budget(monkeypatch):
+    sent = []
+    class ChatResponse:
+        def raise_for_status(self): pass
+        def json(self):
+            return {"choices": [{"message": {"content": "word " * 150}}]}
+    def fake_post(self, url, json=None, **kw):
+        sent.append(json["messages"])
+        return ChatResponse()
+    class LongSearch:
+        def search(self, query, **kwargs):
+            return [{"id": str(i), "path": f"/{i}", "_score": 10 - i,
+                     "content": " ".join(f"Fact {i}.{j} about her work."
+                                         for j in range(40))}
+                    for i in range(10)]
+    monkeypatch.setattr("requests.Session.post", fake_post)
+    budget = TokenBudget(total=1200, answer=200)
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=LongSearch(),
+                         context_packer=ContextPacker(budget),
+                         conversation_store=MemoryConversationStore())
+    client.ask("What did Victoria build?", CONVERSATION_ID)
+    client.ask("Which employers did Victoria work for?", CONVERSATION_ID)
+    client.ask("Tell me more about that", CONVERSATION_ID)
+    for messages in sent:
+        prompt = sum(count_tokens(m["content"]) for m in messages)
+        assert prompt <= budget.total - budget.answer
+    assert len(sent[1]) == 5 and len(sent[2]) >= 3
+
+def test_async_client_uses_sqlite_store_off_the_loop(tmp_path):
+    threads = []
+    class RecordingStore(SQLiteConversationStore):
+        def get(self, conversation_id):
+            threads.append(threading.get_ident())
+            return super().get(conversation_id)
+        def append(self, *args, **kwargs):
+            threads.append(threading.get_ident())
+            super().append(*args, **kwargs)
+    store = RecordingStore(str(tmp_path / "conv.sqlite"))
+    async def scenario(url):
+        client = AsyncAgentClient(endpoint=url + "/chat", api_key="key",
+                                  conversation_store=store)
+        try:
+            await client.ask("What has she built?", CONVERSATION_ID)
+            await client.ask("Which languages did that use?", CONVERSATION_ID)
+            return threading.get_ident()
+        finally:
+            await close_async_sessions()
+    with StubServer() as server:
+        loop_thread = asyncio.run(scenario(server.url))
+    assert threads and loop_thread not in threads
+    assert len(store.get(CONVERSATION_ID).turns) == 4
+    store.close()
@@ -0,0 +1,112 @@
+"""Tests for ingest.py"""
+import json
+import pytest
+from portfolio_assistant.context_packer import count_tokens
+from portfolio_assistant.ingest import (chunk_text, commit, ingest, main,
+                                        write_batches)
+
+
+def _sentences(n):
+    return " ".join(f"Sentence number {i} is about drones." for i in range(n))
+
+
+def _actions(out_dir):
+    """Read the batches as an upload would, then commit them"""
+    actions = []
+    for path in sorted(out_dir.glob("batch-*.json")):
+        actions.extend(json.loads(path.read_text())["value"])
+    commit(str(out_dir))
+    return actions
+
+
+@pytest.fixture
+def docs(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "drones.md").write_text(
+        "---\ntopics: robotics\nsource: https://example.com/d\n---\n" +
+        _sentences(40))
+    (docs / "notes.txt").write_text("Gardening notes about tomatoes.")
+    return docs
+
+
+def test_chunks_fit_and_overlap():
+    chunks = chunk_text(_sentences(40), chunk_tokens=60, overlap_tokens=15)
+    assert len(chunks) > 3
+    assert all(count_tokens(c) <= 60 for c in chunks)
+    for first, second in zip(chunks, chunks[1:]):
+        last = first.rsplit(". ", 1)[-1]
+        assert second.startswith(last)
+    assert "Sentence number 39" in chunks[-1]
+
+def test_long_sentence_is_split():
+    chunks = chunk_text("word " * 500, chunk_tokens=50, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(count_tokens(c) <= 50 for c in chunks)
+
+def test_rejects_overlap_not_below_size():
+    with pytest.raises(ValueError):
+        chunk_text("text", chunk_tokens=10, overlap_tokens=10)
+
+def test_ingest_emits_chunks_with_metadata(docs, tmp_path):
+    out = tmp_path / "out"
+    stats = ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    actions = _actions(out)
+    assert stats["files"] == 2 and stats["uploads"] == len(actions)
+    drones = [a for a in actions if a["path"] == "drones.md"]
+    assert len(drones) > 1
+    assert {a["@search.action"] for a in actions} == {"mergeOrUpload"}
+    assert drones[0]["topics"] == "robotics"
+    assert drones[0]["source"] == "https://example.com/d"
+    assert drones[1]["id"] == drones[0]["parent_id"] + "-1"
+
+def test_ingest_is_incremental(docs, tmp_path):
+    out = tmp_path / "out"
+    ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    first = _actions(out)
+
+    stats = ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    assert stats["skipped"] == 2 and _actions(out) == []
+
+    # a changed ending re-uploads only the chunks whose text changed
+    (docs / "drones.md").write_text(
+        "---\ntopics: robotics\nsource: https://example.com/d\n---\n" +
+        _sentences(38))
+    (docs / "notes.txt").unlink()
+    ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    changes = _actions(out)
+    uploads = [a["id"] for a in changes
+               if a["@search.action"] == "mergeOrUpload"]
+    deletes = {a["id"] for a in changes if a["@search.action"] == "delete"}
+    drones = [a["id"] for a in first if a["path"] == "drones.md"]
+    assert 0 < len(uploads) < len(drones)
+    notes = {a["id"] for a in first if a["path"] == "notes.txt"}
+    assert notes <= deletes
+
+def test_uncommitted_batches_are_kept(docs, tmp_path, capsys):
+    out = tmp_path / "out"
+    ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    first = (out / "batch-0001.json").read_text()
+    # not uploaded yet: a re-run keeps the batch and adds nothing
+    stats = ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    assert stats["batches"] == 0
+    assert (out / "batch-0001.json").read_text() == first
+    assert not (out / "manifest.json").exists()
+    (docs / "notes.txt").write_text("Gardening notes about peppers.")
+    ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    later = json.loads((out / "batch-0002.json").read_text())["value"]
+    assert [a["path"] for a in later] == ["notes.txt"]
+    main(["--commit", str(out)])
+    assert sorted(p.name for p in out.iterdir()) == ["manifest.json"]
+    assert "Committed 2 batch files" in capsys.readouterr().out
+    stats = ingest(str(docs), str(out), chunk_tokens=60, overlap_tokens=10)
+    assert stats["skipped"] == 2 and stats["batches"] == 0
+
+def test_write_batches_splits(tmp_path):
+    paths = write_batches(({"id": str(i)} for i in range(5)),
+                          str(tmp_path), batch_size=2)
+    sizes = [len(json.loads(open(p).read())["value"]) for p in paths]
+    assert sizes == [2, 2, 1]
+    # earlier batches are kept and numbering continues after them
+    write_batches([{"id": "x"}], str(tmp_path), batch_size=2)
+    assert sorted(p.name for p in tmp_path.iterdir())[-1] == "batch-0004.json"
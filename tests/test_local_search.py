@@ -0,0 +1,67 @@
+"""Tests for local_search.py"""
+import time
+import pytest
+from portfolio_assistant.local_search import (LocalSearchClient, build_index,
+                                              iter_documents, tokenize)
+
+
+@pytest.fixture
+def index(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "drones.md").write_text(
+        "---\ntopics: robotics, drones\nsource: https://example.com/d\n---\n"
+        "Victoria built a drone swarm simulator. It ran on a GPU cluster.")
+    (docs / "climate.md").write_text(
+        "Agent-based climate model of household adaptation. "
+        "Written in Python with Mesa.")
+    (docs / "notes.txt").write_text("Gardening notes about tomatoes.")
+    (docs / "slides.pdf").write_bytes(b"%PDF-1.4")
+    path = str(tmp_path / "portfolio.idx")
+    assert build_index(iter_documents(str(docs)), path) == 3
+    client = LocalSearchClient(path)
+    yield client
+    client.close()
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("What is the Drone project?") == ["drone", "project"]
+
+def test_front_matter_fields(tmp_path, index):
+    hit = index.search("drone swarm", top_k=1)[0]
+    assert hit["path"] == "drones.md"
+    assert hit["topics"] == "robotics, drones"
+    assert hit["source"] == "https://example.com/d"
+
+def test_search_ranks_and_shapes(index):
+    results = index.search("climate model python", top_k=5, semantic=True)
+    assert results[0]["path"] == "climate.md"
+    assert results[0]["_score"] == results[0]["@search.score"] > 0
+    assert "climate model" in results[0]["_captions"][0]["text"]
+    assert all("_norm" not in r for r in results)
+
+def test_search_no_match(index):
+    assert index.search("quantum chromodynamics") == []
+
+def test_select_limits_fields(index):
+    hit = index.search("tomatoes", select=["id", "path"])[0]
+    assert set(hit) == {"id", "path", "@search.score", "_score",
+                        "_captions", "_answers"}
+
+def test_build_context_compatible(index):
+    context, citations = index.build_context(
+        index.search("drone", semantic=True))
+    assert context.startswith("[1] Source: drones.md\n")
+    assert citations[0]["source"] == "https://example.com/d"
+
+def test_rejects_foreign_file(tmp_path):
+    path = tmp_path / "bogus.idx"
+    path.write_bytes(b"not an index at all")
+    with pytest.raises(ValueError):
+        LocalSearchClient(str(path))
+
+def test_search_is_sub_millisecond(index):
+    n = 500
+    start = time.perf_counter()
+    for _ in range(n):
+        index.search("drone climate python", semantic=True)
+    assert (time.perf_counter() - start) / n < 0.001
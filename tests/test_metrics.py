@@ -0,0 +1,139 @@
+"""Tests for metrics.py and the metrics function"""
+import asyncio
+import json
+import logging
+import pytest
+from portfolio_assistant import metrics
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.cache import MemoryCache
+from portfolio_assistant.search_client import SearchClient
+
+
+@pytest.fixture(autouse=True)
+def _fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class ChatResponse:
+    def raise_for_status(self): pass
+    def json(self): return {"choices": [{"message": {"content": "hi"}}]}
+
+
+class StaticSearchClient:
+    def search(self, query, **kwargs):
+        return [{"id": "1", "path": "/a", "_score": 1.0,
+                 "content": "Victoria built a search service."}]
+
+    build_context = SearchClient.build_context
+    _extract_text = staticmethod(SearchClient._extract_text)
+
+
+def test_histogram_percentiles():
+    histogram = metrics.Histogram()
+    for value in range(1, 101):
+        histogram.add(value)
+    stats = histogram.snapshot()
+    assert stats["count"] == 100
+    assert stats["p50"] == 51
+    assert stats["p95"] == 96
+    assert stats["p99"] == 100
+    assert stats["max"] == 100
+
+def test_histogram_window_is_bounded():
+    histogram = metrics.Histogram(window=10)
+    for value in range(100):
+        histogram.add(value)
+    assert histogram.snapshot()["p50"] >= 90
+    assert histogram.count == 100
+
+def test_span_hooks_and_request_record(caplog):
+    seen = []
+    def hook(name, seconds, attributes):
+        seen.append((name, attributes))
+    def broken(name, seconds, attributes):
+        raise RuntimeError("tracing down")
+    metrics.add_span_hook(hook)
+    metrics.add_span_hook(broken)
+    try:
+        with caplog.at_level(logging.INFO):
+            with metrics.request_scope() as record:
+                with metrics.span("search", index="docs"):
+                    pass
+                metrics.observe("prompt.chars", 120)
+                metrics.incr("answer_cache.hits")
+    finally:
+        metrics.remove_span_hook(hook)
+        metrics.remove_span_hook(broken)
+    assert [name for name, _ in seen] == ["search", "request"]
+    assert seen[0][1] == {"index": "docs"}
+    assert set(record["spans"]) == {"search", "request"}
+    assert record["values"] == {"prompt.chars": 120}
+    assert record["counters"] == {"answer_cache.hits": 1}
+    lines = [r.getMessage() for r in caplog.records
+             if r.getMessage().startswith("request_metrics ")]
+    assert json.loads(lines[0].split(" ", 1)[1])["counters"] == \
+        {"answer_cache.hits": 1}
+    assert metrics.current_request() is None
+
+def test_pipeline_stages_recorded(monkeypatch):
+    monkeypatch.setattr("requests.Session.post",
+                        lambda *a, **kw: ChatResponse())
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=StaticSearchClient(),
+                         retrieval_budget=1.0)
+    with metrics.request_scope(log=False) as record:
+        client.ask("What has she built?")
+    # search ran on the retrieval pool but still counts for the request
+    assert {"search", "build_context", "chat"} <= set(record["spans"])
+    assert record["values"]["search.hits"] == 1
+    assert record["values"]["context.chars"] > 0
+    assert record["values"]["prompt.chars"] > record["values"]["context.chars"]
+    histograms = metrics.snapshot()["histograms"]
+    assert histograms["chat.seconds"]["count"] == 1
+
+def test_search_cache_counters(monkeypatch):
+    class SearchResponse:
+        def raise_for_status(self): pass
+        def json(self): return {"value": [{"id": "1", "@search.score": 1}]}
+    monkeypatch.setattr("requests.Session.post",
+                        lambda *a, **kw: SearchResponse())
+    client = SearchClient(endpoint="https://search", index_name="idx",
+                          api_key="key", api_version="v1",
+                          cache=MemoryCache())
+    client.search("python")
+    client.search("Python?")
+    counters = metrics.snapshot()["counters"]
+    assert counters["search_cache.hits"] == 1
+    assert counters["search_cache.misses"] == 1
+    assert counters["search.calls"] == 1
+
+def test_metrics_endpoint(monkeypatch):
+    from metrics_function import main
+    monkeypatch.delenv("METRICS_ENDPOINT_ENABLED", raising=False)
+    assert main(None).status_code == 404
+
+    monkeypatch.setenv("METRICS_ENDPOINT_ENABLED", "true")
+    metrics.observe("prompt.chars", 10)
+    response = main(None)
+    data = json.loads(response.get_body())
+    assert response.status_code == 200
+    assert data["histograms"]["prompt.chars"]["p50"] == 10
+    assert data["circuits"] == {}
+
+def test_chat_function_logs_request(monkeypatch, caplog):
+    from chat_function import main
+    from portfolio_assistant.app import reset_clients
+    class Request:
+        def get_json(self): return {"message": None}
+        def get_body(self): return b'{"message": null}'
+    reset_clients()
+    with caplog.at_level(logging.INFO):
+        response = asyncio.run(main(Request()))
+    assert response.status_code == 400
+    line = [r.getMessage() for r in caplog.records
+            if r.getMessage().startswith("request_metrics ")][-1]
+    record = json.loads(line.split(" ", 1)[1])
+    assert record["status"] == 400
+    assert "parse_body" in record["spans"]
@@ -0,0 +1,75 @@
+"""Tests for prompt.py and the prompt usage metrics"""
+import json
+import pytest
+from portfolio_assistant import metrics
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.prompt import SYSTEM_PROMPT, PromptTemplate
+
+
+@pytest.fixture(autouse=True)
+def _fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class StaticSearchClient:
+    def __init__(self):
+        self.queries = []
+
+    def search(self, query, **kwargs):
+        self.queries.append(query)
+        return [{"id": str(len(self.queries)), "path": "/a",
+                 "content": f"passage for {query}"}]
+
+    def build_context(self, docs):
+        return docs[0]["content"], [{"label": 1, "id": docs[0]["id"]}]
+
+
+def test_instructions_are_a_stable_prefix():
+    template = PromptTemplate()
+    first = template.messages("What has she built?", "ctx one")
+    second = template.messages("Where did she study?", "ctx two",
+                               [{"role": "user", "content": "hi"},
+                                {"role": "assistant", "content": "hello"}])
+    assert json.dumps(first[0]) == json.dumps(second[0])
+    assert first[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert first[1] == {"role": "system", "content": "Context:\nctx one"}
+    assert [m["role"] for m in second] == \
+        ["system", "system", "user", "assistant", "user"]
+    # no context: the instructions still lead, without a context message
+    assert template.messages("hi", "") == [
+        first[0], {"role": "user", "content": "hi"}]
+
+def test_instructions_from_file(tmp_path, monkeypatch):
+    path = tmp_path / "prompt.txt"
+    path.write_text("Answer in one sentence.\n")
+    monkeypatch.setenv("SYSTEM_PROMPT_PATH", str(path))
+    client = AgentClient(endpoint="https://test-endpoint", api_key="key")
+    assert client.prompt.instructions == "Answer in one sentence."
+    assert client.prompt.static_text == "Answer in one sentence.Context:\n"
+
+def test_cached_prompt_tokens_recorded(monkeypatch):
+    sent = []
+    class ChatResponse:
+        def raise_for_status(self): pass
+        def json(self):
+            return {"choices": [{"message": {"content": "ok"}}],
+                    "usage": {"prompt_tokens": 2000,
+                              "prompt_tokens_details": {"cached_tokens": 1536},
+                              "completion_tokens": 10}}
+    def fake_post(self, url, json=None, **kw):
+        sent.append(json["messages"])
+        return ChatResponse()
+    monkeypatch.setattr("requests.Session.post", fake_post)
+    client = AgentClient(endpoint="https://test-endpoint", api_key="key",
+                         search_client=StaticSearchClient())
+    with metrics.request_scope(log=False) as record:
+        client.ask("What has she built?")
+    client.ask("Where did she study?")
+    assert sent[0][0] is sent[1][0]
+    assert sent[0][1] != sent[1][1]
+    assert record["counters"]["prompt.cached_tokens"] == 1536
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["prompt.tokens"] == 4000
+    assert snapshot["histograms"]["prompt.cached_ratio"]["p50"] == 0.768
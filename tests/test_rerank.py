@@ -0,0 +1,104 @@
+"""Tests for rerank.py"""
+import json
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.rerank import HashingEmbedder, Reranker, VectorStore
+
+DOCS = [
+    {"id": "1", "content": "Gardening notes about tomatoes and basil."},
+    {"id": "2", "content": "Agent-based climate model of household "
+                           "adaptation written in Python."},
+    {"id": "3", "content": "Drone swarm simulator on a GPU cluster."},
+]
+
+
+@pytest.fixture
+def reranker():
+    return Reranker(VectorStore.build(DOCS, HashingEmbedder(64)),
+                    vector_weight=2.0)
+
+def test_embedder_normalizes():
+    vectors = HashingEmbedder(32).embed(["climate model", ""])
+    assert vectors.shape == (2, 32)
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[1].any()
+
+def test_store_roundtrip(tmp_path):
+    store = VectorStore.build(DOCS, HashingEmbedder(16))
+    store.save(str(tmp_path / "vectors"))
+    loaded = VectorStore.load(str(tmp_path / "vectors"))
+    assert loaded.ids == ["1", "2", "3"]
+    assert np.array_equal(loaded.matrix, store.matrix)
+
+def test_rerank_promotes_semantic_match(reranker):
+    # lexical order puts the gardening doc first
+    hits = [dict(d, _score=s) for d, s in zip(DOCS, (3.0, 2.0, 1.0))]
+    ranked = reranker.rerank("climate model python", hits, top_k=2)
+    assert [d["id"] for d in ranked] == ["2", "1"]
+    assert ranked[0]["_lexical_score"] == 2.0
+    assert hits[1]["_score"] == 2.0
+
+def test_rerank_embeds_unknown_docs(reranker):
+    hits = [{"id": "x", "content": "drone swarm simulator", "_score": 1.0},
+            dict(DOCS[0], _score=2.0)]
+    assert reranker.rerank("drone swarm", hits, top_k=1)[0]["id"] == "x"
+
+def test_rerank_empty(reranker):
+    assert reranker.rerank("anything", []) == []
+
+def test_agent_client_reranks_candidates(reranker):
+    class FakeSearch:
+        def search(self, query, top_k=5, **kwargs):
+            self.top_k = top_k
+            return [dict(d, _score=1.0) for d in DOCS]
+
+        def build_context(self, docs):
+            return "ctx", [{"id": d["id"]} for d in docs]
+
+    search = FakeSearch()
+    client = AgentClient(endpoint="https://test-endpoint", api_key="test-key",
+                         search_client=search, reranker=reranker, top_k=1,
+                         rerank_candidates=30)
+    context, citations = client._retrieve_context("drone swarm")
+    assert search.top_k == 30
+    assert citations == [{"id": "3"}]
+
+def test_build_keys_vectors_by_ingested_chunk_ids(tmp_path):
+    from portfolio_assistant.ingest import ingest
+    from portfolio_assistant.rerank import main
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "drones.md").write_text(" ".join(
+        f"Sentence {i} is about drones." for i in range(40)))
+    ingest(str(docs), str(tmp_path / "out"), chunk_tokens=60,
+           overlap_tokens=10)
+    uploaded = [a["id"] for path in sorted((tmp_path / "out").glob(
+        "batch-*.json")) for a in json.loads(path.read_text())["value"]]
+    main(["build", str(docs), str(tmp_path / "vectors"),
+          "--chunk-tokens", "60", "--overlap-tokens", "10"])
+    assert VectorStore.load(str(tmp_path / "vectors")).ids == uploaded
+
+def test_build_jsonl_requires_key_field(tmp_path):
+    from portfolio_assistant.rerank import main
+    export = tmp_path / "docs.jsonl"
+    export.write_text("\n".join(json.dumps(d) for d in
+                                [{"key": "a", "content": "drones"},
+                                 {"key": "b", "content": "tomatoes"}]))
+    with pytest.raises(SystemExit):
+        main(["build-jsonl", str(export), str(tmp_path / "v")])
+    main(["build-jsonl", str(export), str(tmp_path / "v"),
+          "--key-field", "key"])
+    store = VectorStore.load(str(tmp_path / "v"))
+    assert (store.ids, store.key_field) == (["a", "b"], "key")
+
+def test_missing_numpy_is_a_config_error(monkeypatch):
+    import sys
+    from portfolio_assistant.app import _build_reranker
+    monkeypatch.setenv("RERANK_VECTORS_PATH", "/tmp/vectors")
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.delitem(sys.modules, "portfolio_assistant.rerank")
+    with pytest.raises(ValueError, match="RERANK_VECTORS_PATH"):
+        _build_reranker()
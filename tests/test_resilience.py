@@ -0,0 +1,176 @@
+"""Tests for resilience.py"""
+import asyncio
+import time
+import pytest
+import requests
+from email.utils import formatdate
+from benchmarks.stubs import StubServer
+from portfolio_assistant import metrics
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.resilience import (CircuitBreaker, CircuitOpenError,
+                                            OutboundPolicy, RetryPolicy,
+                                            Timeouts, get_policy,
+                                            parse_retry_after, policy_stats)
+from portfolio_assistant.sessions import close_async_sessions
+from portfolio_assistant.search_client import SearchClient
+
+
+def _search_client(url, policy=None):
+    return SearchClient(endpoint=url, index_name="idx", api_key="key",
+                        api_version="v1", policy=policy)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 50 < parse_retry_after(formatdate(time.time() + 60,
+                                             usegmt=True)) <= 60
+
+def test_retry_delay_backoff_and_retry_after():
+    retry = RetryPolicy(attempts=3, base_delay=0.1, max_delay=0.15,
+                        max_retry_after=5)
+    error = Exception("boom")
+    assert 0 <= retry.delay(0, error) <= 0.1
+    assert 0 <= retry.delay(1, error) <= 0.15
+    assert retry.delay(2, error) is None
+    error.headers = {"Retry-After": "3"}
+    assert retry.delay(0, error) == 3
+    error.headers = {"Retry-After": "60"}
+    assert retry.delay(0, error) is None
+
+def test_retries_503_honouring_retry_after():
+    with StubServer(error_rate=0.5, seed=3, retry_after="0") as server:
+        policy = OutboundPolicy("search", server.url,
+                                retry=RetryPolicy(attempts=10))
+        client = _search_client(server.url, policy)
+        results = [client.search(f"query {i}") for i in range(10)]
+    assert all(len(hits) == 1 for hits in results)
+    assert server.errors > 0
+    assert policy.counts["retries"] == server.errors
+    assert policy.counts["failures"] == 0
+    assert policy.breaker.state == "closed"
+
+def test_client_errors_are_not_retried():
+    calls = []
+    def send():
+        calls.append(1)
+        response = requests.Response()
+        response.status_code = 404
+        response.raise_for_status()
+    policy = OutboundPolicy("search")
+    with pytest.raises(requests.HTTPError):
+        policy.call(send)
+    assert len(calls) == 1
+    assert policy.breaker.failures == 0
+
+def test_hung_chat_is_not_retried():
+    policy = OutboundPolicy("chat", timeouts=Timeouts(read=0.1))
+    with StubServer(latency=0.5) as server:
+        client = AgentClient(endpoint=server.url + "/chat", api_key="key",
+                             policy=policy)
+        assert "error" in client.ask("Hi?")
+    assert server.requests == 1
+    async def scenario(url):
+        client = AsyncAgentClient(endpoint=url + "/chat", api_key="key",
+                                  policy=policy)
+        try:
+            return await client.ask("Hi?")
+        finally:
+            await close_async_sessions()
+    with StubServer(latency=0.5) as server:
+        assert "error" in asyncio.run(scenario(server.url))
+    assert server.requests == 1
+    assert policy.counts["retries"] == 0
+
+def test_search_retries_stay_within_deadline():
+    policy = OutboundPolicy("search", retry=RetryPolicy(attempts=5),
+                            timeouts=Timeouts(read=0.2), deadline=0.3)
+    with StubServer(latency=1.0) as server:
+        started = time.perf_counter()
+        assert _search_client(server.url, policy).search("python") == []
+        elapsed = time.perf_counter() - started
+    assert elapsed < 0.6
+    assert 1 <= server.requests <= 2
+
+def test_breaker_opens_and_short_circuits():
+    with StubServer(error_rate=1.0) as server:
+        policy = OutboundPolicy("search", server.url,
+                                retry=RetryPolicy(attempts=1),
+                                failure_threshold=2, reset_timeout=60)
+        client = _search_client(server.url, policy)
+        assert [client.search(f"q{i}") for i in range(4)] == [[]] * 4
+    assert server.requests == 2
+    assert policy.breaker.state == "open"
+    assert policy.counts["short_circuits"] == 2
+    assert metrics.snapshot()["counters"]["search.circuit_opened"] == 1
+
+def test_breaker_half_open_recovery(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    assert breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 10
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()  # only one trial at a time
+    assert breaker.record_failure() and breaker.state == "open"
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_shared_policy_per_endpoint():
+    assert get_policy("search", "a") is get_policy("search", "a")
+    assert get_policy("search", "a") is not get_policy("search", "b")
+    assert get_policy("search", "a").timeouts.read == 10
+    assert set(policy_stats()) == {"search a", "search b"}
+
+def test_hedging_beats_slow_attempt():
+    policy = OutboundPolicy("search", hedge_percentile=0.5,
+                            hedge_min_samples=5)
+    for _ in range(5):
+        policy._latencies.append(0.01)
+    delays = iter([0.5, 0.0])
+    def send():
+        time.sleep(next(delays))
+        return "ok"
+    started = time.perf_counter()
+    assert policy.call(send) == "ok"
+    assert time.perf_counter() - started < 0.3
+    assert policy.counts["hedges"] == 1
+
+def test_async_hedging_and_breaker():
+    policy = OutboundPolicy("search", retry=RetryPolicy(attempts=1),
+                            failure_threshold=1, hedge_percentile=0.5,
+                            hedge_min_samples=1)
+    policy._latencies.append(0.01)
+    delays = iter([0.5, 0.0])
+    async def send():
+        await asyncio.sleep(next(delays))
+        return "ok"
+    async def fail():
+        raise ConnectionError("down")
+    async def scenario():
+        assert await policy.acall(send) == "ok"
+        with pytest.raises(ConnectionError):
+            await policy.acall(fail, transient=(ConnectionError,))
+        with pytest.raises(CircuitOpenError):
+            await policy.acall(send)
+    asyncio.run(scenario())
+    assert policy.counts["hedges"] == 1
+    assert policy.breaker.state == "open"
+
+def test_async_search_degrades_when_open():
+    async def scenario(url):
+        client = AsyncSearchClient(endpoint=url, index_name="idx",
+                                   api_key="key", api_version="v1")
+        for _ in range(client.policy.breaker.failure_threshold):
+            client.policy.breaker.record_failure()
+        return await client.search("python")
+    with StubServer() as server:
+        assert asyncio.run(scenario(server.url)) == []
+    assert server.requests == 0
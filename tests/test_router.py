@@ -0,0 +1,122 @@
+"""Tests for router.py"""
+import asyncio
+import json
+import logging
+import pytest
+from benchmarks.stubs import StubServer, default_responder
+from portfolio_assistant import metrics
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.async_agent_client import AsyncAgentClient
+from portfolio_assistant.async_search_client import AsyncSearchClient
+from portfolio_assistant.router import QueryRouter, RouterModel, main
+from portfolio_assistant.search_client import SearchClient
+from portfolio_assistant.sessions import close_async_sessions
+
+
+@pytest.fixture(autouse=True)
+def _fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _recording_server():
+    tops = []
+    def respond(path, body):
+        if "/docs/search" in path:
+            tops.append(body["top"])
+        return default_responder(path, body)
+    return StubServer(respond), tops
+
+
+def test_rules():
+    router = QueryRouter(top_k=4, log=False)
+    for message in ("hi", "Thanks so much!", "how are you?", "   "):
+        assert router.route(message).reason == "small_talk"
+    general = router.route("What is a hash table?")
+    assert (general.retrieve, general.reason) == (False, "general_knowledge")
+    assert router.route("What is a project she is proud of?").retrieve
+    assert router.route("List all of her projects").top_k == 8
+    assert router.route("What is her email?").top_k == 2
+    assert router.route("Tell me about the trading system").top_k == 4
+    assert router.route("hi, what did she build at work?").retrieve
+    counters = metrics.snapshot()["counters"]
+    assert counters["router.skip"] == 5
+    assert counters["router.retrieve"] == 5
+
+def test_model_decides_unmatched_messages(tmp_path):
+    examples = [("tell me a joke", False), ("write me a poem", False),
+                ("tell me about the compiler", True),
+                ("tell me about the trading engine", True)] * 5
+    model = RouterModel.fit(examples)
+    assert model.predict("write a joke") < 0.5 < \
+        model.predict("about the engine")
+    path = str(tmp_path / "model.json")
+    model.save(path)
+    router = QueryRouter(model=RouterModel.load(path), log=False)
+    assert not router.route("write a poem").retrieve
+    assert router.route("tell me about the compiler").reason.startswith(
+        "model:")
+    # portfolio words always retrieve whatever the model says
+    assert router.route("write a poem about her projects").retrieve
+
+def test_decisions_logged_and_recorded(caplog):
+    router = QueryRouter()
+    def logged(level):
+        caplog.clear()
+        with caplog.at_level(level):
+            router.route("hello")
+        line = [r.getMessage() for r in caplog.records
+                if r.getMessage().startswith("route ")][0]
+        return json.loads(line.split(" ", 1)[1])
+    with metrics.request_scope(log=False) as record:
+        assert logged(logging.INFO) == {
+            "retrieve": False, "top_k": 0, "reason": "small_talk"}
+    assert record["route"] == "small_talk"
+    # the message text only at DEBUG
+    assert logged(logging.DEBUG)["message"] == "hello"
+
+def test_agent_skips_search_and_sizes_top_k():
+    server, tops = _recording_server()
+    with server:
+        search = SearchClient(endpoint=server.url, index_name="idx",
+                              api_key="key", api_version="v1")
+        client = AgentClient(endpoint=server.url + "/chat", api_key="key",
+                             search_client=search, top_k=4,
+                             router=QueryRouter(top_k=4, log=False))
+        greeting = client.ask("Hi there!")
+        broad = client.ask("Give me an overview of her experience")
+    assert "citations" not in greeting and greeting["reply"] == "stub reply"
+    assert broad["citations"]
+    assert tops == [8]
+    assert server.requests == 3
+
+def test_async_agent_skips_search():
+    async def scenario(url):
+        search = AsyncSearchClient(endpoint=url, index_name="idx",
+                                   api_key="key", api_version="v1")
+        client = AsyncAgentClient(endpoint=url + "/chat", api_key="key",
+                                  search_client=search,
+                                  router=QueryRouter(log=False))
+        try:
+            return [await client.ask(m) for m in ("thanks!",
+                                                  "What is her email?")]
+        finally:
+            await close_async_sessions()
+    server, tops = _recording_server()
+    with server:
+        thanks, email = asyncio.run(scenario(server.url))
+    assert "citations" not in thanks and email["citations"]
+    assert tops == [3]
+
+def test_cli(tmp_path, capsys):
+    examples = tmp_path / "labelled.jsonl"
+    examples.write_text("\n".join(json.dumps(
+        {"message": m, "retrieve": r}) for m, r in
+        [("tell me a joke", False), ("about the compiler", True)]))
+    model_path = str(tmp_path / "model.json")
+    main(["fit", str(examples), model_path])
+    main(["route", "tell me a joke", "--model", model_path])
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].startswith("Trained on 2 messages")
+    assert json.loads(out[1])["retrieve"] is False
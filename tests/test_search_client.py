@@ -2,7 +2,8 @@
 import pytest
 from requests import RequestException
 from unittest.mock import patch, Mock
-from portfolio_assistant.search_client import SearchClient
+from portfolio_assistant.cache import DiskCache
+from portfolio_assistant.search_client import SearchClient, SearchHit, clean_text, first_text
 
 
 def test_init_with_args():
@@ -18,7 +19,7 @@ def test_init_missing_key():
 
 def test_search_request_exception(monkeypatch):
     client = SearchClient(endpoint="http://test-endpoint", index_name="test-index", api_key="test-key", api_version="test-version")
-    with patch("requests.post") as mock_post:
+    with patch("requests.Session.post") as mock_post:
         mock_post.side_effect = RequestException("fail")
         results = client.search("test")
         assert results == []
@@ -33,7 +34,7 @@ def test_search_valid_response():
             {"id": "2", "content": "test", "@search.score": 2}
         ]
     }
-    with patch("requests.post", return_value=mock_response):
+    with patch("requests.Session.post", return_value=mock_response):
         results = client.search("test")
         assert len(results) == 2
         assert results[0]["id"] == "1"
@@ -65,4 +66,64 @@ def test_extract_text_only_option():
 
 def test_extract_no_resource():
     doc = {}
-    assert SearchClient._extract_text(doc, ["content", "title"]) is None
\ No newline at end of file
+    assert SearchClient._extract_text(doc, ["content", "title"]) is None
+
+def test_search_hit_reads_like_a_dict():
+    raw = {"id": "1", "path": "/a", "@search.score": 2.5,
+           "@search.captions": [{"text": "cap"}]}
+    hit = SearchClient._normalize_hits({"value": [raw]})[0]
+    assert isinstance(hit, SearchHit) and hit.fields is raw
+    assert hit["id"] == "1" and hit["_score"] == 2.5
+    assert hit.get("_answers") == [] and hit.get("missing", "x") == "x"
+    assert "_captions" in hit and "content" not in hit
+    assert dict(hit)["_captions"] == [{"text": "cap"}]
+    assert hit == dict(hit)
+    with pytest.raises(KeyError):
+        hit["content"]
+
+def test_build_context_from_hits_matches_dicts():
+    raw = [{"id": "1", "path": "/a", "content": "  plain\n\ttext ", "@search.score": 1},
+           {"id": "2", "path": "/b", "@search.score": 3, "@search.captions": [{"text": "caption"}], "@search.answers": [{"text": "answer"}]}]
+    client = SearchClient(endpoint="http://test-endpoint", index_name="test-index", api_key="test-key", api_version="test-version")
+    hits = client._normalize_hits({"value": raw})
+    assert client.build_context(hits) == client.build_context([dict(h) for h in hits])
+    context, _ = client.build_context(hits)
+    assert context == "[1] Source: /b\nanswer | caption\n[2] Source: /a\nplain text"
+
+def test_clean_text():
+    assert clean_text(" a \n\n b\t c ") == "a b c"
+
+def test_first_text():
+    assert first_text([{"text": "caption"}, {"text": "other"}]) == "caption"
+    assert first_text([]) is None and first_text(None) is None
+
+def test_semantic_search_selects_fields(monkeypatch):
+    bodies = []
+    def fake_post(self, url, json=None, **kw):
+        bodies.append(json)
+        return Mock(raise_for_status=Mock(), json=Mock(return_value={"value": []}))
+    monkeypatch.setattr("requests.Session.post", fake_post)
+    client = SearchClient(endpoint="http://test-endpoint", index_name="test-index", api_key="test-key", api_version="test-version")
+    client.search("q", semantic=True)
+    assert "select" not in bodies[0]
+    monkeypatch.setenv("SEARCH_SELECT", "id,path")
+    narrowed = SearchClient(endpoint="http://test-endpoint", index_name="test-index", api_key="test-key", api_version="test-version")
+    narrowed.search("q", semantic=True)
+    narrowed.search("q")
+    narrowed.search("q", semantic=True, select=["topics"])
+    assert bodies[1]["select"] == "id,path,content"
+    assert "select" not in bodies[2]
+    assert bodies[3]["select"] == "topics"
+    monkeypatch.setenv("SEARCH_SELECT", "*")
+    everything = SearchClient(endpoint="http://test-endpoint", index_name="test-index", api_key="test-key", api_version="test-version")
+    everything.search("q", semantic=True)
+    assert "select" not in bodies[4]
+
+def test_hits_survive_disk_cache(tmp_path, monkeypatch):
+    response = Mock(raise_for_status=Mock(), json=Mock(return_value={"value": [{"id": "1", "@search.score": 1}]}))
+    monkeypatch.setattr("requests.Session.post", lambda *a, **kw: response)
+    client = SearchClient(endpoint="http://test-endpoint", index_name="test-index", api_key="test-key", api_version="test-version", cache=DiskCache(str(tmp_path / "c.sqlite")))
+    first = client.search("q")
+    second = client.search("q")
+    assert response.json.call_count == 1
+    assert isinstance(second[0], SearchHit) and second == first
@@ -0,0 +1,35 @@
+"""Tests for sessions.py"""
+from portfolio_assistant.agent_client import AgentClient
+from portfolio_assistant.search_client import SearchClient
+from portfolio_assistant.sessions import (get_session, reset_sessions,
+                                          configure_sessions)
+
+
+def test_get_session_is_shared():
+    assert get_session("chat") is get_session("chat")
+    assert get_session("chat") is not get_session("search")
+
+def test_reset_sessions_creates_new():
+    first = get_session("chat")
+    reset_sessions()
+    assert get_session("chat") is not first
+
+def test_configure_sessions_applies_pool_size():
+    configure_sessions(pool_maxsize=3)
+    try:
+        adapter = get_session().get_adapter("https://example.com")
+        assert adapter._pool_maxsize == 3
+    finally:
+        configure_sessions(pool_maxsize=16)
+
+def test_sequential_requests_reuse_connections(stub_server):
+    search = SearchClient(endpoint=stub_server.url, index_name="test-index",
+                          api_key="test-key", api_version="test-version")
+    client = AgentClient(endpoint=stub_server.url + "/chat",
+                         api_key="test-key", search_client=search)
+    n = 20
+    for _ in range(n):
+        assert client.ask("Is anybody there?")["reply"] == "stub reply"
+    assert stub_server.requests == 2 * n
+    # one connection per pool (chat + search), not one per request
+    assert stub_server.connections <= 2
@@ -0,0 +1,13 @@
+"""
+Azure Functions warm-up trigger. On plans that send warm-up requests
+(Premium, Dedicated) a new instance builds the chat client and opens its
+connections before it receives traffic. Consumption plans never call it,
+and the first chat request does the same work instead.
+"""
+import logging
+from portfolio_assistant.app import warm_up
+
+
+async def main(warmupContext) -> None:
+    logging.info("Warming up Portfolio Assistant.")
+    await warm_up()